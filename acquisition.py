@@ -0,0 +1,511 @@
+"""Batched CT acquisition driver.
+
+A scan is a list of angles. The driver preallocates one float32 stack of
+projections (angle x rows x columns), asks a simulator to render every
+angle straight into its slot of the stack, and optionally hands the
+finished projections to a background thread that writes them to disk while
+the next ones are being simulated. No visualisation happens on the hot path.
+
+The simulator is anything that implements the small Simulator interface:
+gVirtualXray through GVXRSimulator, cpu_projector.CPUProjector which
+simulates the same JSON scenes without OpenGL, or MockSimulator.
+
+acquire_parallel() splits the angles of a scan across worker processes,
+each with its own simulator loaded from the same JSON file, which render
+in place into the memory-mapped stack of a projection store.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from typing import Callable, Optional, Sequence, Tuple
+import json
+import multiprocessing
+import numpy as np
+import tracing
+
+
+class Simulator():
+    """Interface between the acquisition driver and an X-ray simulator."""
+
+    def detector_shape(self) -> Tuple[int, int]:
+        """Number of rows and columns of the detector."""
+        raise NotImplementedError
+
+    def set_angle(self, angle:float):
+        """Rotate the sample to an absolute angle (degrees)."""
+        raise NotImplementedError
+
+    def compute_into(self, out:np.ndarray):
+        """Simulate a projection at the current angle and store it in out (rows x columns)."""
+        raise NotImplementedError
+
+    def flat_field(self) -> float:
+        """Value of an unattenuated pixel, used for flat-field correction."""
+        return 1.0
+
+    def schedule(self, angles:Sequence[float]):
+        """Prepare for a scan of these angles, e.g. by precomputing their transforms."""
+        pass
+
+
+class GVXRSimulator(Simulator):
+    """gVirtualXray, with the scene already set up (e.g. by json2gvxr).
+
+    The scene root is rotated around rotation_axis through centre, or each
+    node in labels if given, by setting absolute transforms computed from the
+    angle (see scene_graph), so angles can be set in any order without drift.
+    With supersample > 1,
+    gVirtualXray's detector must have supersample times more pixels along
+    each side than the images, whose pixels average blocks of them. With an
+    roi (detector.ROI), the whole detector is rendered and only the region
+    is kept.
+    """
+
+    def __init__(self, rotation_axis:Sequence[float]=(0, 0, 1), labels:Optional[Sequence[str]]=None, supersample:int=1,
+            centre:Sequence[float]=(0, 0, 0), roi=None):
+        from gvxrPython3 import gvxr
+        import scene_graph
+        self.gvxr = gvxr
+        self.rotation_axis = tuple(rotation_axis)
+        self.labels = list(labels) if labels is not None else None
+        self.supersample = int(supersample)
+        self.roi = roi
+        self.angle = 0.0
+
+        # The transforms set up so far are the static part of the absolute ones
+        static = {label: scene_graph.from_gl(gvxr.getLocalTransformationMatrix(label)) for label in self.labels or []}
+        self.scene = scene_graph.SceneGraph(static, self.rotation_axis, centre, scene_graph.from_gl(gvxr.getRootTransformationMatrix()))
+
+    @classmethod
+    def from_json(cls, fname:str|Path, window_mode:str="EGL", rotation_axis:Optional[Sequence[float]]=None, supersample:int=1,
+            roi=None) -> "GVXRSimulator":
+        """Create a headless simulator from a JSON scene description, optionally with supersampled pixels.
+
+        The scan rotates around the detector's up vector by default, through
+        the scan's CenterOfRotation if any.
+        """
+
+        from gvxrPython3 import json2gvxr
+        import scene_graph
+        json2gvxr.initGVXR(str(fname), window_mode)
+        json2gvxr.initSourceGeometry()
+        json2gvxr.initSpectrum()
+        json2gvxr.initDetector()
+        with tracing.span("mesh.load", file=Path(fname).name):
+            json2gvxr.initSamples()
+
+        with open(fname) as f:
+            config = json.load(f)
+        detector = config["Detector"]
+
+        if supersample > 1:
+            from gvxrPython3 import gvxr
+            cols, rows = detector["NumberOfPixels"]
+            gvxr.setDetectorNumberOfPixels(cols * supersample, rows * supersample)
+            gvxr.setDetectorPixelSize(detector["Spacing"][0] / supersample, detector["Spacing"][1] / supersample, detector["Spacing"][2])
+
+        # Like json2gvxr.doCTScan, rotate around the detector's up vector by default
+        if rotation_axis is None:
+            rotation_axis = detector["UpVector"]
+
+        return cls(rotation_axis, supersample=supersample, centre=scene_graph.rotation_centre(config), roi=roi)
+
+    def detector_shape(self) -> Tuple[int, int]:
+        cols, rows = self.gvxr.getDetectorNumberOfPixels()
+        shape = (rows // self.supersample, cols // self.supersample)
+        return shape if self.roi is None else self.roi.shape(shape)
+
+    def set_angle(self, angle:float):
+        if angle == self.angle:
+            return
+
+        if self.labels is None:
+            self.scene.apply_root(self.gvxr, angle)
+        else:
+            self.scene.apply_nodes(self.gvxr, angle)
+        self.angle = angle
+
+    def schedule(self, angles:Sequence[float]):
+        self.scene.schedule(angles)
+
+    def compute_into(self, out:np.ndarray):
+        if self.roi is not None:
+            image = np.asarray(self.gvxr.computeXRayImage(), dtype=np.single)
+            if self.supersample > 1:
+                import detector
+                image = detector.bin_pixels(image, self.supersample, mean=True)
+            out[...] = self.roi.crop(image)
+            return
+
+        if self.supersample > 1:
+            import detector
+            detector.bin_pixels(np.asarray(self.gvxr.computeXRayImage()), self.supersample, mean=True, out=out)
+            return
+
+        # Let NumPy cast straight into the stack rather than creating an intermediate array
+        out[...] = self.gvxr.computeXRayImage()
+
+    def flat_field(self) -> float:
+        return self.gvxr.getTotalEnergyWithDetectorResponse()
+
+
+def resolve_engine(engine:str="auto") -> str:
+    """"gvxr" or "cpu": for "auto", gVirtualXray if it can be imported and the CPU projector otherwise."""
+
+    if engine == "auto":
+        try:
+            import gvxrPython3  # noqa: F401
+            engine = "gvxr"
+        except ImportError:
+            engine = "cpu"
+    return engine
+
+
+def simulator_from_json(fname:str|Path, engine:str="auto", **kwargs) -> Simulator:
+    """Simulator of a JSON scene description.
+
+    Args:
+        fname (str|Path): The JSON file.
+        engine (str): "gvxr", "cpu", or "auto" for gVirtualXray if it can be imported and the CPU projector otherwise.
+        kwargs: Passed to the simulator's from_json.
+    """
+
+    engine = resolve_engine(engine)
+    if engine == "gvxr":
+        return GVXRSimulator.from_json(fname, **kwargs)
+    if engine == "cpu":
+        from cpu_projector import CPUProjector
+        return CPUProjector.from_json(fname, **kwargs)
+    raise ValueError(f"Unknown engine '{engine}'")
+
+
+class MockSimulator(Simulator):
+    """CPU stand-in for the simulator: a parallel beam through an off-centre cylinder.
+
+    The cylinder's axis is the rotation axis of the scan (detector rows), so
+    each projection is a row-independent profile. Useful to exercise the
+    acquisition, storage and reconstruction code without OpenGL.
+    """
+
+    def __init__(self, shape:Tuple[int, int]=(64, 64), radius:float=0.2, offset:float=0.25, mu:float=4.0, energy:float=1.0):
+        self.shape = tuple(shape)
+        self.radius = radius
+        self.offset = offset
+        self.mu = mu
+        self.energy = energy
+        self.angle = 0.0
+        self.calls = 0
+
+        # Detector coordinates normalised to [-0.5, 0.5]
+        self._u = (np.arange(self.shape[1]) + 0.5) / self.shape[1] - 0.5
+
+    def detector_shape(self) -> Tuple[int, int]:
+        return self.shape
+
+    def set_angle(self, angle:float):
+        self.angle = angle
+
+    def compute_into(self, out:np.ndarray):
+        centre = self.offset * np.cos(np.radians(self.angle))
+        chord = 2 * np.sqrt(np.clip(self.radius ** 2 - (self._u - centre) ** 2, 0, None))
+        out[...] = self.energy * np.exp(-self.mu * chord)
+        self.calls += 1
+
+    def flat_field(self) -> float:
+        return self.energy
+
+
+class TiffStackWriter():
+    """Write projections as the compressed pages of a single BigTIFF file.
+
+    Pages are buffered and written chunk_size at a time. The angles are
+    stored as JSON in the description of the file.
+    """
+
+    def __init__(self, fname:str|Path, angles:Optional[Sequence[float]]=None, compression:Optional[str]="zlib", chunk_size:int=8):
+        import tifffile as tf
+
+        self.fname = Path(fname)
+        self.fname.parent.mkdir(parents=True, exist_ok=True)
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self._tif = tf.TiffWriter(self.fname, bigtiff=True)
+        self._description = json.dumps({"angles": [float(a) for a in angles]}) if angles is not None else None
+        self._pending = []
+        self._next = 0
+
+    def write(self, index:int, image:np.ndarray):
+        if index != self._next:
+            raise ValueError(f"Projections must be written in order, expected {self._next}, got {index}")
+        self._next += 1
+
+        self._pending.append(image)
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        for image in self._pending:
+            self._tif.write(image, compression=self.compression, contiguous=False,
+                description=self._description, metadata=None)
+            self._description = None
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._tif.close()
+
+
+class BackgroundWriter():
+    """Run a writer's write() calls on a background thread.
+
+    The queue is bounded so that a slow disk applies back-pressure to the
+    simulation instead of letting memory grow. Errors raised by the writer
+    are re-raised by submit() or close(). abort() drops what is still
+    queued and discards the output, for writers that can (with abort()).
+    """
+
+    def __init__(self, writer, max_pending:int=32):
+        self.writer = writer
+        self._queue = Queue(maxsize=max_pending)
+        self._error:Optional[BaseException] = None
+        self._aborted = False
+        self._thread = Thread(target=self._run, name="projection-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is None and not self._aborted:
+                try:
+                    with tracing.span("acquire.write", bytes=item[1].nbytes):
+                        self.writer.write(*item)
+                except BaseException as e:
+                    self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, index:int, image:np.ndarray):
+        self._check()
+        self._queue.put((index, image))
+
+    def _stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def close(self):
+        """Write what is queued, then finalise the writer."""
+
+        self._stop()
+        self._check()
+        self.writer.close()
+
+    def abort(self):
+        """Stop writing and discard the output, without raising the writer's errors."""
+
+        self._aborted = True
+        self._stop()
+        if hasattr(self.writer, "abort"):
+            self.writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+@tracing.traced("acquire.scan")
+def acquire(simulator:Simulator,
+        angles:Sequence[float],
+        out:Optional[np.ndarray]=None,
+        writer=None,
+        progress:Optional[Callable[[int, int], None]]=None) -> np.ndarray:
+    """Simulate a CT scan.
+
+    Args:
+        simulator (Simulator): The simulator, with the scene already set up.
+        angles (Sequence[float]): Rotation angles in degrees.
+        out (np.ndarray, optional): Preallocated angle x rows x columns stack, e.g. a memory-mapped array.
+        writer (optional): Object with write(index, image) and close(), called on a background thread,
+            and optionally abort(), called instead of close() if the scan fails.
+        progress (Callable, optional): Called with (number of projections done, total) after each projection.
+
+    Returns:
+        np.ndarray: The projections, angle x rows x columns, float32 unless out was given.
+    """
+
+    angles = np.asarray(angles, dtype=np.double)
+    shape = (len(angles), *simulator.detector_shape())
+    simulator.schedule(angles)
+
+    if out is None:
+        out = np.empty(shape, dtype=np.single)
+    elif out.shape != shape:
+        raise ValueError(f"Output stack has shape {out.shape}, expected {shape}")
+
+    background = BackgroundWriter(writer) if writer is not None else None
+    try:
+        for i, angle in enumerate(angles):
+            with tracing.span("acquire.set_angle"):
+                simulator.set_angle(angle)
+            with tracing.span("acquire.render", bytes=out[i].nbytes):
+                simulator.compute_into(out[i])
+
+            if background is not None:
+                # Rows of the stack are never written twice, so the writer can use the view directly
+                background.submit(i, out[i])
+            if progress is not None:
+                progress(i + 1, len(angles))
+    except BaseException:
+        # A failed scan leaves no output behind, and its error is the one raised
+        if background is not None:
+            background.abort()
+        raise
+
+    if background is not None:
+        background.close()
+    return out
+
+
+# Simulator of a worker process of acquire_parallel
+_worker_simulator:Optional[Simulator] = None
+
+
+def _init_worker(fname:str, engine:str, kwargs:dict, trace:bool=False):
+    global _worker_simulator
+    if trace:
+        tracing.enable()
+    _worker_simulator = simulator_from_json(fname, engine, **kwargs)
+
+
+def _acquire_chunk(stack_file:str, offset:int, shape:Tuple[int, int, int], dtype:str,
+        indices:Sequence[int], angles:Sequence[float]) -> Tuple[Sequence[int], float, list]:
+    """Render projections of a worker's simulator into the shared stack, returning the trace events of the chunk."""
+
+    stack = np.memmap(stack_file, dtype=dtype, mode="r+", offset=offset, shape=shape)
+    _worker_simulator.schedule(angles)
+    for index, angle in zip(indices, angles):
+        with tracing.span("acquire.set_angle"):
+            _worker_simulator.set_angle(angle)
+        with tracing.span("acquire.render", bytes=stack[index].nbytes):
+            _worker_simulator.compute_into(stack[index])
+    stack.flush()
+    return indices, _worker_simulator.flat_field(), tracing.tracer().drain()
+
+
+@tracing.traced("acquire.scan")
+def acquire_parallel(fname:str|Path,
+        angles:Sequence[float],
+        out:str|Path,
+        workers:int=2,
+        engine:str="auto",
+        chunk:Optional[int]=None,
+        retries:int=2,
+        progress:Optional[Callable[[int, int], None]]=None,
+        **kwargs) -> Path:
+    """Simulate a CT scan with several processes, each with its own simulator.
+
+    The angles are split into chunks, which the workers render in place
+    into the memory-mapped stack of an uncompressed projection store, so
+    the stack is assembled in angle order whatever the order the chunks
+    finish in. A chunk that fails, or whose worker dies, is submitted again.
+
+    Args:
+        fname (str|Path): The JSON scene description, which every worker loads.
+        angles (Sequence[float]): Rotation angles in degrees.
+        out (str|Path): File name of the projection store.
+        workers (int): Number of processes.
+        engine (str): Simulator, see simulator_from_json.
+        chunk (int, optional): Projections per task. Defaults to a quarter of a worker's share.
+        retries (int): Number of times a chunk is submitted again before giving up.
+        progress (Callable, optional): Called with (number of projections done, total) as chunks finish.
+        kwargs: Passed to the simulators' from_json, e.g. roi (a detector.ROI), which the store records.
+
+    Returns:
+        Path: The output file name.
+    """
+
+    import detector
+    import projection_store
+
+    angles = np.asarray(angles, dtype=np.double)
+    engine = resolve_engine(engine)
+    if engine == "cpu":
+        # One process per worker, rather than a pool of pools
+        kwargs.setdefault("workers", 1)
+
+    # The detector shape comes from the configuration, so the workers can start at once
+    with open(fname) as f:
+        config = json.load(f)
+    cols, rows = config["Detector"]["NumberOfPixels"]
+    roi = kwargs.get("roi")
+    shape = (len(angles), *(roi.shape((rows, cols)) if roi is not None else (rows, cols)))
+
+    chunk = chunk or max(1, -(-len(angles) // (4 * workers)))
+    chunks = [range(start, min(start + chunk, len(angles))) for start in range(0, len(angles), chunk)]
+    attempts = [0] * len(chunks)
+    done = 0
+    flat = None
+
+    with projection_store.create(out, shape, angles=angles, config=config,
+            geometry=detector.roi_geometry(projection_store.geometry_from_config(config), roi)) as writer:
+        stack_file, offset = writer.stack_location()
+        task = (str(stack_file), offset, shape, writer.dtype.str)
+
+        todo = list(range(len(chunks)))
+        while todo:
+            # OpenGL contexts do not survive a fork, and a broken pool is replaced as a whole
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(str(fname), engine, kwargs, tracing.enabled())) as executor:
+                pending = {executor.submit(_acquire_chunk, *task, list(chunks[i]), angles[chunks[i]].tolist()): i for i in todo}
+                todo = []
+                while pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        i = pending.pop(future)
+                        try:
+                            _, flat, events = future.result()
+                        except BrokenProcessPool:
+                            todo.append(i)
+                            continue
+                        except Exception:
+                            attempts[i] += 1
+                            if attempts[i] > retries:
+                                raise
+                            try:
+                                pending[executor.submit(_acquire_chunk, *task, list(chunks[i]), angles[chunks[i]].tolist())] = i
+                            except BrokenProcessPool:
+                                # Another chunk took the pool down meanwhile: retry with the next one
+                                todo.append(i)
+                            continue
+
+                        tracing.tracer().extend(events)
+                        writer.mark_written(list(chunks[i]))
+                        done += len(chunks[i])
+                        if progress is not None:
+                            progress(done, len(angles))
+
+            for i in todo:
+                attempts[i] += 1
+                if attempts[i] > retries:
+                    raise RuntimeError(f"Projections {chunks[i].start} to {chunks[i].stop - 1} failed {attempts[i]} times")
+
+        if flat is not None:
+            writer.set_flat(flat)
+
+    return Path(out)
+
+
+def scan_angles(num_projections:int, final_angle:float=360, endpoint:bool=False) -> np.ndarray:
+    """Evenly spaced angles (degrees) computed in closed form rather than by accumulation."""
+    return np.linspace(0, final_angle, num_projections, endpoint=endpoint)
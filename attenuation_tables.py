@@ -0,0 +1,274 @@
+"""Cached, vectorised tables of linear attenuation coefficients.
+
+The curves are computed once per (material, density, energy grid) with
+xraylib's NumPy bindings, kept in an in-memory LRU cache and optionally
+persisted to disk as ``.npz`` files (see content_cache). Lookups at arbitrary energies use
+log-log interpolation.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import os
+import re
+import numpy as np
+import xraylib as xrl
+import xraylib_np as xrl_np
+import content_cache
+
+# Energy grid used by the notebooks (keV)
+DEFAULT_ENERGIES = np.arange(5., 800., 0.1, dtype=np.double)
+
+COMPONENTS = ("total", "photo", "compton", "rayleigh")
+
+# Densities (g/cm3) of the compounds used in the notebooks that xraylib does not know about
+_KNOWN_DENSITIES = {
+    'H2O': 1.,
+    'C2F4': 2.25,
+}
+
+_NIST_ALIASES = {
+    'H2C': 'Polyethylene',
+}
+
+
+@lru_cache(maxsize=None)
+def get_density(material:str) -> float:
+    """Density of a material.
+
+    Args:
+        material (str): Element symbol, chemical formula or NIST compound name.
+
+    Returns:
+        float: Density in g/cm3.
+    """
+
+    if material in _KNOWN_DENSITIES:
+        return _KNOWN_DENSITIES[material]
+
+    if material in _NIST_ALIASES:
+        return xrl.GetCompoundDataNISTByName(_NIST_ALIASES[material])['density']
+
+    try:
+        Z = xrl.SymbolToAtomicNumber(material)
+    except ValueError:
+        return xrl.GetCompoundDataNISTByName(material)['density']
+
+    return xrl.ElementDensity(Z)
+
+
+@lru_cache(maxsize=None)
+def mass_fractions(material:str) -> Tuple[np.ndarray, np.ndarray]:
+    """Elemental composition of a material.
+
+    Args:
+        material (str): Element symbol, chemical formula or NIST compound name.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Atomic numbers and their mass fractions.
+    """
+
+    try:
+        data = xrl.CompoundParser(material)
+    except ValueError:
+        data = xrl.GetCompoundDataNISTByName(material)
+
+    Z = np.asarray(data['Elements'], dtype=np.int64)
+    w = np.asarray(data['massFractions'], dtype=np.double)
+    Z.flags.writeable = False
+    w.flags.writeable = False
+    return Z, w
+
+
+# Cross sections (cm2/g) of elements, (number of elements) x (number of energies) arrays
+CROSS_SECTIONS = {
+    "total": xrl_np.CS_Total,
+    "photo": xrl_np.CS_Photo,
+    "compton": xrl_np.CS_Compt,
+    "rayleigh": xrl_np.CS_Rayl,
+}
+
+
+def cross_sections(Z:Sequence[int], energies:Sequence[float], component:str="total") -> np.ndarray:
+    """Cross sections (cm2/g) of elements at energies (keV), elements x energies, in one xraylib_np call."""
+
+    if component not in COMPONENTS:
+        raise ValueError(f"Unknown component '{component}', expected one of {COMPONENTS}")
+    return CROSS_SECTIONS[component](np.ascontiguousarray(Z, dtype=np.int64), np.ascontiguousarray(energies, dtype=np.double))
+
+
+def _mass_attenuation(Z:np.ndarray, w:np.ndarray, energies:np.ndarray) -> dict:
+    """Mass attenuation coefficients (cm2/g) of a mixture, one array per component."""
+    return {component: w @ cross_sections(Z, energies, component) for component in COMPONENTS}
+
+
+@dataclass(frozen=True)
+class AttenuationTable:
+    """Linear attenuation coefficients (cm-1) of a material sampled on an energy grid (keV)."""
+
+    material: str
+    density: float
+    energies: np.ndarray
+    total: np.ndarray
+    photo: np.ndarray
+    compton: np.ndarray
+    rayleigh: np.ndarray
+
+    def __call__(self, energies, component:str="total") -> np.ndarray:
+        return self.interpolate(energies, component)
+
+    def interpolate(self, energies, component:str="total") -> np.ndarray:
+        """Log-log interpolation of a component at arbitrary energies.
+
+        Energies outside the grid are clamped to its ends. Between grid points
+        where the component is zero (e.g. no photoelectric effect), where log-log
+        interpolation is undefined, values are interpolated linearly.
+
+        Args:
+            energies: Energies in keV, scalar or array.
+            component (str): One of "total", "photo", "compton" or "rayleigh".
+
+        Returns:
+            np.ndarray: Linear attenuation coefficients in cm-1.
+        """
+
+        if component not in COMPONENTS:
+            raise ValueError(f"Unknown component '{component}', expected one of {COMPONENTS}")
+
+        values = getattr(self, component)
+        log_energies = np.log(self.energies)
+        x = np.log(np.clip(np.asarray(energies, dtype=np.double), self.energies[0], self.energies[-1]))
+
+        positive = values > 0
+        if positive.all():
+            return np.exp(np.interp(x, log_energies, np.log(values)))
+
+        # Zero entries cannot be interpolated in log space: the intervals that touch one are interpolated linearly
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_log = np.exp(np.interp(x, log_energies, np.log(values)))
+        i = np.clip(np.searchsorted(log_energies, x, side="right") - 1, 0, len(values) - 2)
+        return np.where(positive[i] & positive[i + 1], log_log, np.interp(x, log_energies, values))
+
+    def mass_attenuation(self, component:str="total") -> np.ndarray:
+        """Mass attenuation coefficients (cm2/g) on the table's energy grid."""
+        return getattr(self, component) / self.density
+
+
+def compute_table(material:str, density:Optional[float]=None, energies:Optional[np.ndarray]=None) -> AttenuationTable:
+    """Compute an attenuation table without going through the cache.
+
+    Args:
+        material (str): Element symbol, chemical formula or NIST compound name.
+        density (float, optional): Density in g/cm3. Defaults to the tabulated density.
+        energies (np.ndarray, optional): Energy grid in keV. Defaults to DEFAULT_ENERGIES.
+
+    Returns:
+        AttenuationTable: The attenuation curves.
+    """
+
+    if density is None:
+        density = get_density(material)
+    if energies is None:
+        energies = DEFAULT_ENERGIES
+
+    energies = np.array(energies, dtype=np.double)
+    Z, w = mass_fractions(material)
+
+    curves = {key: value * density for key, value in _mass_attenuation(Z, w, energies).items()}
+
+    for array in (energies, *curves.values()):
+        array.flags.writeable = False
+
+    return AttenuationTable(material, float(density), energies, **curves)
+
+
+class AttenuationCache(content_cache.ContentCache):
+    """LRU cache of attenuation tables, optionally backed by a directory of .npz files."""
+
+    suffix = ".npz"
+
+    @staticmethod
+    def key(material:str, density:float, energies:np.ndarray) -> str:
+        """Content hash identifying a table."""
+        return content_cache.digest(material, np.double(density), np.asarray(energies, dtype=np.double))
+
+    def get(self, material:str, density:Optional[float]=None, energies:Optional[np.ndarray]=None) -> AttenuationTable:
+        """Return the table of a material, computing it on a cache miss."""
+
+        if density is None:
+            density = get_density(material)
+        if energies is None:
+            energies = DEFAULT_ENERGIES
+
+        return self.lookup(self.key(material, density, energies), lambda: compute_table(material, density, energies))
+
+    def _read(self, path:Path) -> AttenuationTable:
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in ("energies", *COMPONENTS)}
+            material = str(data["material"])
+            density = float(data["density"])
+
+        for array in arrays.values():
+            array.flags.writeable = False
+
+        return AttenuationTable(material, density, **arrays)
+
+    def _write(self, path:Path, table:AttenuationTable):
+        np.savez(path,
+            material=table.material,
+            density=table.density,
+            energies=table.energies,
+            **{name: getattr(table, name) for name in COMPONENTS})
+
+
+_default_cache = AttenuationCache(cache_dir=os.environ.get("GVXR_ATTENUATION_CACHE"))
+
+
+def default_cache() -> AttenuationCache:
+    """The process-wide cache used by get_table()."""
+    return _default_cache
+
+
+def set_cache_dir(cache_dir:Optional[str|Path]):
+    """Persist the process-wide cache to a directory (None to keep it in memory only)."""
+    _default_cache.cache_dir = Path(cache_dir) if cache_dir is not None else None
+
+
+def get_table(material:str, density:Optional[float]=None, energies:Optional[np.ndarray]=None) -> AttenuationTable:
+    """Attenuation table of a material from the process-wide cache.
+
+    Args:
+        material (str): Element symbol, chemical formula or NIST compound name.
+        density (float, optional): Density in g/cm3. Defaults to the tabulated density.
+        energies (np.ndarray, optional): Energy grid in keV. Defaults to DEFAULT_ENERGIES.
+
+    Returns:
+        AttenuationTable: The attenuation curves.
+    """
+    return _default_cache.get(material, density, energies)
+
+
+def linear_attenuation(material:str, energies, density:Optional[float]=None, component:str="total") -> np.ndarray:
+    """Linear attenuation coefficients (cm-1) of a material at arbitrary energies (keV)."""
+    return get_table(material, density).interpolate(energies, component)
+
+
+def mixture_fractions(mixture:str|Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Atomic numbers and mass fractions (summing to 1) of a mixture given by mass.
+
+    Args:
+        mixture (str|Sequence[float]): Symbols followed by mass percentages, e.g. "Ti90Al6V4"
+            (like gvxr.setMixture), or a flat list of atomic numbers and mass fractions.
+    """
+
+    if isinstance(mixture, str):
+        parts = re.findall(r"([A-Z][a-z]?)(\d*\.?\d*)", mixture)
+        Z = [xrl.SymbolToAtomicNumber(symbol) for symbol, _ in parts]
+        w = [float(weight) if weight else 1. for _, weight in parts]
+    else:
+        Z = [int(z) for z in mixture[0::2]]
+        w = [float(weight) for weight in mixture[1::2]]
+
+    w = np.asarray(w, dtype=np.double)
+    return np.asarray(Z, dtype=np.int64), w / w.sum()
@@ -0,0 +1,660 @@
+"""Benchmarks of the simulate, correct and reconstruct hot paths, compared with baselines.
+
+Every benchmark is a small headless workload on the CPU (the CPU projector
+or the mock simulator stand in for gVirtualXray), parametrised by a grid
+of values such as the detector size, the number of angles, the meshes
+(the bundled TurboPump, 2StrokeEngine and fibres STL files) and the number
+of workers. A suite maps benchmarks to their grids, each combination of
+values being a case. Each case runs in a fresh process, so that imports,
+caches and peak memory are its own; its setup is not timed, its workload
+is run once, then a few more times, each sample repeating fast workloads
+until it lasts at least MIN_SAMPLE_TIME:
+
+    first       time of the first run, which pays for the cold caches
+    median      median time of the other runs, which the comparisons use
+    best        shortest time of the other runs
+    throughput  items (projections, slices, ...) per second of the median run
+    peak_mb     peak resident memory of the process during the runs
+    children_peak_mb  largest peak memory of its worker processes
+    stages      mean wall time per warm run of the traced stages (see tracing)
+
+Results are written as JSON and compared with a baseline, by default the
+committed benchmarks/baseline.json, measured on the machine it records.
+A case whose median time or peak memory (of the process or of its workers)
+grows by more than the threshold is a regression, which makes the command exit with status 1; changes of
+less than NOISE_FLOOR seconds are never one:
+
+    python benchmark.py                                  # quick suite
+    python benchmark.py --suite full --out results.json
+    python benchmark.py --filter "project|recon" --threshold 0.1
+    python benchmark.py --update-baseline                # after an accepted change
+
+Baselines only transfer between similar machines: measure the baseline and
+the change on the same one, e.g. by running the suite on the base branch
+with --update-baseline --baseline other.json.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import datetime
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Part of the results, to tell files of older versions of the harness apart
+BENCHMARK_VERSION = 2
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baseline.json"
+
+# Shortest time of a sample: faster workloads are run several times per sample, like timeit does
+MIN_SAMPLE_TIME = 0.2
+
+# Samples per case
+DEFAULT_REPEAT = 5
+
+# Relative increase of the median time, and of the peak memory, that fails a comparison
+DEFAULT_THRESHOLD = 0.3
+DEFAULT_MEMORY_THRESHOLD = 0.25
+
+# Smallest change of the median time, in seconds, that can fail or pass a comparison: below it is scheduling noise
+NOISE_FLOOR = 0.01
+
+# Smallest increase of the peak memory, in MB, that can fail a comparison
+MEMORY_NOISE_FLOOR = 16
+
+# Bundled meshes: directory of STL files, material and density of all of them
+SCENES = {
+    "turbopump": ("input_data/TurboPump", ["Element", "Al"], 2.7),
+    "engine": ("input_data/2StrokeEngine", ["Element", "Fe"], 7.874),
+    "fibres": ("input_data/fibres", ["Compound", "SiC"], 3.21),
+}
+
+
+class Skip(Exception):
+    """Raised by the setup of a case that cannot run here, e.g. for a missing optional dependency."""
+
+
+@dataclass(frozen=True)
+class Workload():
+    """What the setup of a case returns.
+
+    Args:
+        run (Callable[[], Any]): The timed workload.
+        items (int): Number of items (projections, slices, ...) a run processes.
+        info (dict): Extra values stored with the results, e.g. the number of triangles.
+        close (Callable[[], Any], optional): Releases what the setup acquired, e.g. a pool of processes.
+    """
+
+    run:Callable[[], Any]
+    items:int = 1
+    info:Optional[dict] = None
+    close:Optional[Callable[[], Any]] = None
+
+
+@dataclass(frozen=True)
+class Benchmark():
+    """A workload parametrised by keyword arguments.
+
+    Args:
+        name (str): Name of the benchmark.
+        setup (Callable[..., Workload]): Prepares a case in a temporary directory (first argument), untimed.
+        unit (str): What the items of a run are.
+    """
+
+    name:str
+    setup:Callable[..., Workload]
+    unit:str = "runs"
+
+
+BENCHMARKS:Dict[str, Benchmark] = {}
+
+
+def benchmark(name:str, unit:str="runs") -> Callable:
+    """Decorator registering the setup function of a benchmark."""
+
+    def decorator(setup:Callable[..., Workload]) -> Callable[..., Workload]:
+        BENCHMARKS[name] = Benchmark(name, setup, unit)
+        return setup
+    return decorator
+
+
+@dataclass(frozen=True)
+class Case():
+    """A benchmark and the values of its parameters."""
+
+    benchmark:str
+    params:Tuple[Tuple[str, Any], ...]
+
+    @property
+    def id(self) -> str:
+        return f"{self.benchmark}[{','.join(f'{key}={value}' for key, value in self.params)}]"
+
+
+def _scene_config(scene:str, pixels:int) -> dict:
+    # A parallel beam through all the meshes of a scene, centred, on a detector a bit wider than them
+    import mesh_io
+
+    directory, material, density = SCENES[scene]
+    files = sorted((ROOT / directory).glob("*.stl"))
+    extent = 0.
+    for fname in files:
+        lo, hi = mesh_io.load(fname).bounds()
+        extent = max(extent, float(np.max(hi - lo)))
+
+    return {
+        "Source": {"Position": [0, -1000, 0, "mm"], "Shape": "Parallel", "Beam": [{"Energy": 100, "Unit": "keV", "PhotonCount": 1000}]},
+        "Detector": {"Position": [0, 1000, 0, "mm"], "UpVector": [0, 0, 1], "NumberOfPixels": [pixels, pixels],
+            "Spacing": [1.2 * extent / pixels, 1.2 * extent / pixels, "mm"]},
+        "Samples": [{"Label": fname.stem, "Path": str(fname), "Unit": "mm", "Material": material, "Density": density}
+            for fname in files] + ["MoveToCentre"],
+    }
+
+
+def _write_scene(tmp:Path, scene:str, pixels:int) -> Path:
+    fname = tmp / f"{scene}.json"
+    with open(fname, "w") as f:
+        json.dump(_scene_config(scene, pixels), f)
+    return fname
+
+
+def _mock_store(tmp:Path, pixels:int, angles:int, final_angle:float=180) -> Path:
+    # Raw projections of the mock simulator in an uncompressed store, with the flat field
+    import acquisition
+    import projection_store
+
+    simulator = acquisition.MockSimulator((pixels, pixels))
+    scan = np.linspace(0, final_angle, angles, endpoint=False)
+    writer = projection_store.create(tmp / "mock.gvxrp", (angles, pixels, pixels), angles=scan,
+        geometry={"type": "parallel", "number_of_pixels": [pixels, pixels], "pixel_size": [1., 1.], "unit": "mm"},
+        flat=simulator.flat_field())
+    acquisition.acquire(simulator, scan, out=writer.stack)
+    writer.mark_written(slice(None))
+    writer.close()
+    return writer.fname
+
+
+def _require(feature:str):
+    from utilities import capabilities
+
+    reason = capabilities.missing(feature)
+    if reason is not None:
+        raise Skip(reason)
+
+
+@benchmark("mu", unit="materials")
+def _mu(tmp:Path, material:str="Ti"):
+    """utilities.mu: attenuation tables of a material, plotted off screen."""
+
+    _require("plotting")
+    _require("attenuation")
+    from utilities import mu
+    return Workload(lambda: mu(material))
+
+
+@benchmark("attenuation_basis", unit="matrices")
+def _attenuation_basis(tmp:Path, scene:str="fibres", energies:int=200):
+    """Energies x materials matrix of the samples of a scene, without the caches."""
+
+    _require("attenuation")
+    import material_basis
+
+    materials = material_basis.scene_materials(_scene_config(scene, 8))
+    grid = np.linspace(10, 150, energies)
+    return Workload(lambda: material_basis.compute_mass_attenuation(materials, grid))
+
+
+@benchmark("spectrum", unit="spectra")
+def _spectrum(tmp:Path, kvp:int=100, filter:int=13, thickness:float=1.0):
+    """utilities.spectrum: a tube spectrum through a filter (atomic number, mm), plotted off screen."""
+
+    _require("plotting")
+    _require("spectra")
+    from utilities import spectrum
+    return Workload(lambda: spectrum(kvp, filter, thickness))
+
+
+@benchmark("phantom", unit="phantoms")
+def _phantom(tmp:Path, phantom:str="DogaSpheres", output:str="voxels", pixels:int=64):
+    """A phantom of phantoms.py, voxelised, meshed or projected."""
+
+    import phantom_mesh
+    import phantom_raster
+    import phantoms
+
+    def run():
+        # The same random phantom at every run
+        np.random.seed(0)
+        shape = getattr(phantoms, phantom)()
+        if output == "voxels":
+            scene = phantom_raster.scene(shape, "subtract" if shape.kind != "spheres" else None)
+            return phantom_raster.voxelize(scene, (pixels // 8, pixels, pixels), 1.2 / pixels)
+        if output == "mesh":
+            return phantom_mesh.triangles(shape, "subtract" if shape.kind != "spheres" else None)
+        if output == "projections":
+            scene = phantom_raster.scene(shape)
+            return phantom_raster.project_parallel(scene, [0, 45], (pixels // 8, pixels), 1.2 / pixels)
+        raise ValueError(f"Unknown phantom output '{output}'")
+
+    return Workload(run)
+
+
+@benchmark("project", unit="projections")
+def _project(tmp:Path, scene:str="fibres", pixels:int=128, angles:int=8, workers:int=1):
+    """Projections of the bundled meshes with the CPU projector."""
+
+    import acquisition
+    import cpu_projector
+
+    simulator = cpu_projector.CPUProjector.from_json(_write_scene(tmp, scene, pixels), workers=workers)
+    scan = np.linspace(0, 180, angles, endpoint=False)
+    out = np.empty((angles, pixels, pixels), dtype=np.single)
+    triangles = sum(len(sample.mesh.indices) for sample in simulator.samples)
+    return Workload(lambda: acquisition.acquire(simulator, scan, out=out), angles, {"triangles": triangles}, simulator.close)
+
+
+@benchmark("scan", unit="projections")
+def _scan(tmp:Path, engine:str="mock", scene:str="fibres", pixels:int=128, angles:int=16, workers:int=1):
+    """A scan written to a projection store and flat-field corrected into another, like scripts/03-pump-json-scan.py."""
+
+    import acquisition
+    import flatfield
+    import projection_store
+
+    scan = np.linspace(0, 180, angles, endpoint=False)
+    if engine == "mock":
+        simulator = acquisition.MockSimulator((pixels, pixels))
+    else:
+        simulator = acquisition.simulator_from_json(_write_scene(tmp, scene, pixels), engine, workers=workers)
+
+    def run():
+        writer = projection_store.create(tmp / "raw.gvxrp", (angles, pixels, pixels), angles=scan, compression="zlib",
+            flat=simulator.flat_field())
+        acquisition.acquire(simulator, scan, writer=writer)
+        return flatfield.process_stack(tmp / "raw.gvxrp", tmp / "corrected.gvxrp", workers=workers, compression="zlib")
+
+    return Workload(run, angles, close=getattr(simulator, "close", None))
+
+
+@benchmark("recon_parallel", unit="slices")
+def _recon_parallel(tmp:Path, pixels:int=128, angles:int=90, workers:int=1):
+    """FBP of a store, what utilities.recon_parallel runs without CIL."""
+
+    import recon_engine
+
+    store = _mock_store(tmp, pixels, angles)
+    scan = np.linspace(0, 180, angles, endpoint=False)
+    return Workload(lambda: recon_engine.fbp_parallel(store, 1.0, scan, workers=workers), pixels)
+
+
+@benchmark("recon_cone", unit="slices")
+def _recon_cone(tmp:Path, pixels:int=128, angles:int=90, workers:int=1):
+    """FDK of exact cone-beam projections of spheres, what utilities.recon_cone runs without CIL."""
+
+    import phantom_raster
+    import phantoms
+    import projection_store
+    import recon_engine
+
+    source, detector = (0, 400, 0), (0, -400, 0)
+    scan = np.linspace(0, 360, angles, endpoint=False)
+    with redirect_stdout(io.StringIO()):
+        scene = phantom_raster.scene(phantoms.DogaSpheres(), scale=100)
+    projections = phantom_raster.project_cone(scene, scan, (pixels, pixels), 240 / pixels, source, detector, mu=0.01, transmission=True)
+    store = projection_store.create(tmp / "cone.gvxrp", projections.shape, angles=scan)
+    store.stack[:] = projections
+    store.mark_written(slice(None))
+    store.close()
+    return Workload(lambda: recon_engine.fdk_cone(store.fname, 240 / pixels, scan, source, detector, workers=workers), pixels)
+
+
+@benchmark("recon_iterative", unit="slices")
+def _recon_iterative(tmp:Path, method:str="os-sart", pixels:int=64, angles:int=30, iterations:int=3, subsets:int=10):
+    """Iterative reconstruction of a few-angle parallel scan of the mock simulator."""
+
+    import recon_iterative
+
+    store = _mock_store(tmp, pixels, angles)
+    scan = np.linspace(0, 180, angles, endpoint=False)
+    return Workload(lambda: recon_iterative.iterative_parallel(store, 1.0, scan, method, iterations, subsets), pixels)
+
+
+# Grids of the parameters of each benchmark, or lists of grids
+SUITES = {
+    "quick": {
+        "mu": {"material": ["Ti"]},
+        "spectrum": {"kvp": [100]},
+        "phantom": {"phantom": ["DogaSpheres", "SiemensStar"], "output": ["voxels", "projections"], "pixels": [256]},
+        "project": {"scene": ["turbopump", "engine", "fibres"], "pixels": [64], "angles": [4], "workers": [1, 2]},
+        "scan": [{"engine": ["mock"], "pixels": [256], "angles": [32], "workers": [1, 2]},
+            {"engine": ["cpu"], "scene": ["engine"], "pixels": [64], "angles": [8], "workers": [1, 2]}],
+        "recon_parallel": {"pixels": [64], "angles": [60], "workers": [1, 2]},
+        "recon_cone": {"pixels": [64], "angles": [60], "workers": [1, 2]},
+        "recon_iterative": {"method": ["os-sart", "cgls"], "pixels": [64], "angles": [30]},
+    },
+    "full": {
+        "mu": {"material": ["Ti", "SiC", "H2C"]},
+        "attenuation_basis": {"scene": ["turbopump", "engine", "fibres"], "energies": [2000, 20000]},
+        "spectrum": {"kvp": [80, 150]},
+        "phantom": {"phantom": ["DogaSpheres", "RandomMatSpheres", "DogaCircles", "SiemensStar"],
+            "output": ["voxels", "mesh", "projections"], "pixels": [256]},
+        "project": {"scene": ["turbopump", "engine", "fibres"], "pixels": [128, 256], "angles": [16], "workers": [1, 2, 4]},
+        "scan": [{"engine": ["mock"], "pixels": [256, 512, 1024], "angles": [128], "workers": [1, 4]},
+            {"engine": ["cpu"], "scene": ["turbopump", "engine", "fibres"], "pixels": [128], "angles": [32], "workers": [1, 4]}],
+        "recon_parallel": {"pixels": [128, 256], "angles": [180], "workers": [1, 2, 4]},
+        "recon_cone": {"pixels": [128, 256], "angles": [180], "workers": [1, 2, 4]},
+        "recon_iterative": {"method": ["sirt", "os-sart", "cgls"], "pixels": [128, 256], "angles": [30, 100]},
+    },
+}
+
+
+def cases(suite:str|dict="quick", pattern:Optional[str]=None) -> List[Case]:
+    """Cases of a suite (a key of SUITES or a dictionary of the same form), those whose id matches pattern if given."""
+
+    grids = SUITES[suite] if isinstance(suite, str) else suite
+    found = []
+    for name, grid_list in grids.items():
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark '{name}', expected one of {list(BENCHMARKS)}")
+        for grid in [grid_list] if isinstance(grid_list, dict) else grid_list:
+            keys = list(grid)
+            for values in itertools.product(*(grid[key] for key in keys)):
+                case = Case(name, tuple(zip(keys, values)))
+                if pattern is None or re.search(pattern, case.id):
+                    found.append(case)
+    return found
+
+
+def _rss() -> Tuple[int, int]:
+    # Current and peak resident memory of this process, in kB
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        return int(status["VmRSS"].split()[0]), int(status["VmHWM"].split()[0])
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+        return peak, peak
+
+
+def _reset_peak() -> bool:
+    # Lower the peak to the current memory (Linux), so that it measures the runs and not the setup
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _children_peak() -> int:
+    # Largest peak memory of the worker processes that have finished, in kB
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+
+
+def _autorange(run:Callable[[], Any]) -> int:
+    # Number of runs of a sample, like timeit.Timer.autorange but for the warm workload
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SAMPLE_TIME:
+            return number
+        number = max(2 * number, int(np.ceil(1.2 * number * MIN_SAMPLE_TIME / max(elapsed, 1e-6))))
+
+
+def measure(case:Case, repeat:int=DEFAULT_REPEAT) -> dict:
+    """Set up and run a case in this process, see run() to measure it in a fresh one."""
+
+    # Plots are drawn off screen and what the workloads print is dropped
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import tracing
+
+    bench = BENCHMARKS[case.benchmark]
+    result = {"benchmark": case.benchmark, "params": dict(case.params), "unit": bench.unit}
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+        try:
+            workload = bench.setup(Path(tmp), **dict(case.params))
+        except Skip as e:
+            return {**result, "skipped": str(e)}
+
+        before, _ = _rss()
+        reset = _reset_peak()
+        tracing.enable()
+        tracing.tracer().clear()
+
+        start = time.perf_counter()
+        try:
+            workload.run()
+            first = time.perf_counter() - start
+            # The first run pays for the cold caches, so it says little about the next ones
+            number = _autorange(workload.run) if first < MIN_SAMPLE_TIME else 1
+            tracing.tracer().clear()
+
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for _ in range(number):
+                    workload.run()
+                times.append((time.perf_counter() - start) / number)
+        finally:
+            if workload.close is not None:
+                workload.close()
+
+        _, peak = _rss()
+        stages = tracing.tracer().summary()
+        tracing.disable()
+
+    median = float(np.median(times))
+    return {**result,
+        "items": workload.items,
+        "times": times,
+        "number": number,
+        "first": first,
+        "best": min(times),
+        "median": median,
+        "throughput": workload.items / median if median > 0 else None,
+        "setup_mb": before / 1024,
+        "peak_mb": (peak - before if reset else peak) / 1024,
+        "children_peak_mb": _children_peak() / 1024,
+        "stages": {name: stage["wall"] / (repeat * number) for name, stage in stages.items()},
+        **(workload.info or {})}
+
+
+def run(case:Case, repeat:int=DEFAULT_REPEAT) -> dict:
+    """Measure a case in a fresh process."""
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(measure, case, repeat).result()
+
+
+def machine() -> dict:
+    """What the results depend on besides the code."""
+
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def run_suite(suite:str|dict="quick", pattern:Optional[str]=None, repeat:int=DEFAULT_REPEAT,
+        progress:Optional[Callable[[Case, dict], None]]=None) -> dict:
+    """Measure every case of a suite, each in a fresh process.
+
+    Returns:
+        dict: The machine, the date and the result of each case by id.
+    """
+
+    results = {}
+    for case in cases(suite, pattern):
+        try:
+            result = run(case, repeat)
+        except Exception as e:
+            result = {"benchmark": case.benchmark, "params": dict(case.params), "error": f"{type(e).__name__}: {e}"}
+        results[case.id] = result
+        if progress is not None:
+            progress(case, result)
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "suite": suite if isinstance(suite, str) else "custom",
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": machine(),
+        "cases": results,
+    }
+
+
+def load(fname:str|Path) -> dict:
+    with open(fname) as f:
+        return json.load(f)
+
+
+def save(results:dict, fname:str|Path) -> Path:
+    fname = Path(fname)
+    os.makedirs(fname.parent, exist_ok=True)
+    with open(fname, "w") as f:
+        json.dump(results, f, indent=1)
+    return fname
+
+
+def update_baseline(results:dict, fname:str|Path=DEFAULT_BASELINE) -> Path:
+    """Store the measured cases in a baseline, keeping the other cases it holds."""
+
+    baseline = load(fname) if Path(fname).exists() else {"cases": {}}
+    cases = {**baseline.get("cases", {}), **{id: result for id, result in results["cases"].items() if "median" in result}}
+    return save({**results, "cases": cases}, fname)
+
+
+def _memory_ratio(result:dict, reference:dict, key:str, memory_threshold:float) -> Tuple[Optional[float], bool]:
+    # Ratio of a peak memory to the baseline's, and whether it is a regression
+    if reference.get(key, 0) <= 0 or result.get(key) is None:
+        return None, False
+    ratio = result[key] / reference[key]
+    return ratio, ratio > 1 + memory_threshold and result[key] - reference[key] >= MEMORY_NOISE_FLOOR
+
+
+def compare(results:dict, baseline:dict, threshold:float=DEFAULT_THRESHOLD, memory_threshold:float=DEFAULT_MEMORY_THRESHOLD) -> List[dict]:
+    """Compare results with a baseline, case by case.
+
+    The status of a case is "regression" when its median time, its peak
+    memory or the peak memory of its workers exceeds the baseline's by more
+    than the thresholds (relative increases), "faster" when its median time is below the baseline's by
+    more than threshold, "ok" otherwise, and "new", "skipped" or "error"
+    when there is nothing to compare. Times that differ by less than
+    NOISE_FLOOR seconds, and peaks that grow by less than
+    MEMORY_NOISE_FLOOR MB, are "ok" whatever their ratio.
+    """
+
+    rows = []
+    for id, result in results["cases"].items():
+        reference = baseline.get("cases", {}).get(id)
+        row = {"id": id, "median": result.get("median"), "peak_mb": result.get("peak_mb"), "baseline": None, "time_ratio": None,
+            "memory_ratio": None, "children_ratio": None}
+        if "error" in result:
+            row["status"] = "error"
+        elif "skipped" in result:
+            row["status"] = "skipped"
+        elif reference is None or "median" not in reference:
+            row["status"] = "new"
+        else:
+            row["baseline"] = reference["median"]
+            row["time_ratio"] = result["median"] / reference["median"]
+            significant = abs(result["median"] - reference["median"]) >= NOISE_FLOOR
+            row["memory_ratio"], more_memory = _memory_ratio(result, reference, "peak_mb", memory_threshold)
+            row["children_ratio"], more_children_memory = _memory_ratio(result, reference, "children_peak_mb", memory_threshold)
+            more_memory = more_memory or more_children_memory
+
+            if (significant and row["time_ratio"] > 1 + threshold) or more_memory:
+                row["status"] = "regression"
+            elif significant and row["time_ratio"] < 1 / (1 + threshold):
+                row["status"] = "faster"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def report(rows:Sequence[dict], file=None) -> str:
+    """A table of a comparison, printed to file (stdout by default) unless file is False."""
+
+    def number(value, fmt:str) -> str:
+        return "-" if value is None else format(value, fmt)
+
+    width = max([len(row["id"]) for row in rows] + [4])
+    lines = [f"{'case':<{width}}{'median (ms)':>13}{'base (ms)':>11}{'time':>8}{'peak MB':>9}{'memory':>8}{'workers':>9}  status"]
+    for row in rows:
+        lines.append(f"{row['id']:<{width}}{number(row['median'] and 1e3 * row['median'], '.1f'):>13}"
+            f"{number(row['baseline'] and 1e3 * row['baseline'], '.1f'):>11}{number(row['time_ratio'], '.2f'):>8}"
+            f"{number(row['peak_mb'], '.1f'):>9}{number(row['memory_ratio'], '.2f'):>8}{number(row['children_ratio'], '.2f'):>9}  {row['status']}")
+    text = "\n".join(lines)
+    if file is not False:
+        print(text, file=file)
+    return text
+
+
+def main(argv:Optional[Sequence[str]]=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths and compare them with a baseline.")
+    parser.add_argument("--suite", choices=list(SUITES), default="quick")
+    parser.add_argument("--filter", help="Only run the cases whose id matches this regular expression")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Samples per case")
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline to compare with or to update")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative increase of the median time that fails")
+    parser.add_argument("--memory-threshold", type=float, default=DEFAULT_MEMORY_THRESHOLD, help="Relative increase of the peak memory that fails")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results in the baseline instead of comparing")
+    parser.add_argument("--list", action="store_true", help="List the cases and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for case in cases(args.suite, args.filter):
+            print(case.id)
+        return 0
+
+    def progress(case:Case, result:dict):
+        status = result.get("error") or (f"skipped ({result['skipped']})" if "skipped" in result else
+            f"{1e3 * result['median']:.1f} ms, {result['throughput']:.3g} {result['unit']}/s, {result['peak_mb']:.1f} MB")
+        print(f"{case.id}: {status}", file=sys.stderr)
+
+    results = run_suite(args.suite, args.filter, args.repeat, progress)
+    if args.out:
+        save(results, args.out)
+    if args.update_baseline:
+        print(f"Baseline written to {update_baseline(results, args.baseline)}")
+        return 0
+
+    if not Path(args.baseline).exists():
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create it")
+        return 0
+
+    baseline = load(args.baseline)
+    if baseline.get("machine") != results["machine"]:
+        print(f"The baseline was measured on another machine ({baseline.get('machine')}), the comparison is indicative")
+    rows = compare(results, baseline, args.threshold, args.memory_threshold)
+    report(rows)
+    return 1 if any(row["status"] in ("regression", "error") for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Content-addressed LRU cache, in memory and optionally on disk.
+
+Values are identified by a hash of what they are computed from (see
+digest()), so a key never goes stale and the files of a cache directory
+can be shared between processes and sessions. The most recently used
+values are kept in memory; with a cache directory, each value is also
+stored in a file named after its key, written to a temporary file first
+so that concurrent readers never see a partial one.
+
+Subclasses say how their values are stored, see ContentCache._read() and
+ContentCache._write(); by default values are NumPy arrays in .npy files.
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional
+import hashlib
+import os
+import threading
+import numpy as np
+
+
+def digest(*parts) -> str:
+    """SHA-1 of strings (UTF-8) and arrays (their bytes, so their dtype matters), in order."""
+
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(part.encode() if isinstance(part, str) else np.ascontiguousarray(part).tobytes())
+    return sha.hexdigest()
+
+
+class ContentCache():
+    """LRU cache of values by content hash, optionally backed by a directory with a file per value.
+
+    Args:
+        maxsize (int): Number of values kept in memory.
+        cache_dir (str|Path, optional): Directory of the files, None to keep the values in memory only.
+    """
+
+    # Extension of the files of the values
+    suffix = ".npy"
+
+    def __init__(self, maxsize:int=128, cache_dir:Optional[str|Path]=None):
+        self.maxsize = maxsize
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key:str, compute:Callable[[], Any]) -> Any:
+        """Value of a key from memory, else from its file, else computed (outside the lock) and stored."""
+
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = self._load(key)
+        if value is None:
+            value = compute()
+            self._save(key, value)
+
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+        return value
+
+    def clear(self, disk:bool=False):
+        """Empty the in-memory cache, and the on-disk cache if requested."""
+
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+        if disk and self.cache_dir is not None:
+            for fname in self.cache_dir.glob(f"*{self.suffix}"):
+                fname.unlink()
+
+    def _path(self, key:str) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"{key}{self.suffix}"
+
+    def _load(self, key:str) -> Any:
+        path = self._path(key)
+        if path is None or not path.exists():
+            return None
+        return self._read(path)
+
+    def _save(self, key:str, value:Any):
+        path = self._path(key)
+        if path is None:
+            return
+
+        os.makedirs(path.parent, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see a partial file
+        tmp = path.with_suffix(f".{os.getpid()}.tmp{self.suffix}")
+        self._write(tmp, value)
+        os.replace(tmp, path)
+
+    def _read(self, path:Path) -> Any:
+        """Value stored in a file."""
+
+        value = np.load(path)
+        value.flags.writeable = False
+        return value
+
+    def _write(self, path:Path, value:Any):
+        """Store a value in a file of that exact name."""
+        np.save(path, value)
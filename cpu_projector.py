@@ -0,0 +1,516 @@
+"""CPU reference X-ray projector over triangle meshes.
+
+Reads the same JSON scene descriptions as json2gvxr (meshes, materials and
+densities, parallel or point source, detector pixels and spacing) and
+computes images without OpenGL, for batch nodes without a GPU and as a
+regression oracle for gVirtualXray.
+
+Like gVirtualXray's L-buffer, the path length of a ray through a closed
+mesh is the sum of the distances to the surfaces it leaves minus the sum of
+the distances to the surfaces it enters. Since all the rays come from one
+point (or one direction), each triangle is projected onto the detector
+plane and the ray-triangle tests become 2D point-in-triangle tests. The
+detector is cut into square bins of pixels, a uniform grid in ray space:
+each triangle is listed in the bins its bounding box overlaps, and each bin
+tests its pixels against its triangles with array operations. Edge
+functions are evaluated the same way for the two triangles sharing an edge,
+with a tie-breaking rule, so rays through edges are counted exactly once.
+
+Conventions, close to gVirtualXray's:
+
+- lengths are in mm and energies in keV, images are energies in MeV;
+- sample transforms are applied like OpenGL's (and gvxr.rotateNode's),
+  the last one listed first, and the scan rotation is applied last;
+- detector columns run along the right vector, up x (source to detector)
+  unless "RightVector" is given, and rows along the up vector, row 0 at the
+  lowest position;
+- the detector plane faces the source.
+
+Beer-Lambert is applied over the beam spectrum by polychromatic, from the
+path-length maps of the samples, and the detector energy response of the
+JSON file ("EnergyResponse") if any. Rows of the detector are
+tiled across a process pool, whose workers attach to the meshes through
+shared memory. With supersample > 1, each pixel is integrated over a grid
+of sub-pixels, a tile of rows at a time so that the sub-pixel images are
+never held whole. With a detector.ROI, only its rows and columns are
+computed, each contiguous band of rows as a cropped detector.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+import json
+import os
+import numpy as np
+import acquisition
+import detector
+import material_basis
+import mesh_io
+import polychromatic
+import projection_store
+import scene_graph
+import tracing
+
+# Pixels along each side of the bins of the acceleration grid
+DEFAULT_BIN_SIZE = 16
+
+# Detector rows computed at once, which bounds the memory used by supersampling
+DEFAULT_TILE_ROWS = 64
+
+
+@dataclass
+class Geometry():
+    """Source and detector, in mm."""
+
+    source:np.ndarray
+    detector:np.ndarray
+    up:np.ndarray
+    right:np.ndarray
+    shape:Tuple[int, int]
+    spacing:Tuple[float, float]
+    parallel:bool
+    # Column and row of the pixel grid at the detector position, the middle of the grid by default
+    centre_pixel:Optional[Tuple[float, float]] = None
+
+    @classmethod
+    def from_config(cls, config:dict) -> "Geometry":
+        geometry = projection_store.geometry_from_config(config)
+        source = np.array(geometry["source_position"])
+        detector = np.array(geometry["detector_position"])
+        cols, rows = geometry["number_of_pixels"]
+
+        direction = scene_graph.unit_vector(detector - source)
+        if "RightVector" in config["Detector"]:
+            right = scene_graph.unit_vector(np.array(config["Detector"]["RightVector"][:3], dtype=np.double))
+        else:
+            right = scene_graph.unit_vector(np.cross(geometry["detector_up"], direction))
+        up = np.cross(direction, right)
+
+        return cls(source, detector, up, right, (rows, cols), tuple(geometry["pixel_size"]), geometry["type"] == "parallel")
+
+    @property
+    def direction(self) -> np.ndarray:
+        return scene_graph.unit_vector(self.detector - self.source)
+
+    @property
+    def centre(self) -> Tuple[float, float]:
+        """Column and row of the pixel grid at the detector position."""
+
+        if self.centre_pixel is not None:
+            return self.centre_pixel
+        rows, cols = self.shape
+        return (cols - 1) / 2, (rows - 1) / 2
+
+    def crop(self, rows:Tuple[int, int], columns:Tuple[int, int]) -> "Geometry":
+        """The pixels of rows [start, stop) and columns [start, stop), in the same detector plane."""
+
+        centre_col, centre_row = self.centre
+        return replace(self, shape=(rows[1] - rows[0], columns[1] - columns[0]),
+            centre_pixel=(centre_col - columns[0], centre_row - rows[0]))
+
+    def supersampled(self, factor:int) -> "Geometry":
+        """The grid of factor x factor sub-pixels of each pixel."""
+
+        centre_col, centre_row = self.centre
+        return replace(self, shape=(self.shape[0] * factor, self.shape[1] * factor),
+            spacing=(self.spacing[0] / factor, self.spacing[1] / factor),
+            centre_pixel=((centre_col + 0.5) * factor - 0.5, (centre_row + 0.5) * factor - 0.5))
+
+    def pixel_coordinates(self, start:int, stop:int) -> Tuple[np.ndarray, np.ndarray]:
+        """Coordinates of the pixel centres of rows [start, stop) along the right and up vectors, from the detector centre."""
+
+        centre_col, centre_row = self.centre
+        u = (np.arange(self.shape[1]) - centre_col) * self.spacing[0]
+        v = (np.arange(start, stop) - centre_row) * self.spacing[1]
+        return np.meshgrid(u, v)
+
+
+@dataclass
+class Sample():
+    """A mesh (in mm, static transforms applied) and its material."""
+
+    mesh:mesh_io.Mesh
+    material:material_basis.Material
+
+    @property
+    def label(self) -> str:
+        return self.mesh.label
+
+    @property
+    def density(self) -> float:
+        return self.material.density
+
+
+def _resolve(path:str, base:Optional[Path]) -> Path:
+    # Paths in the JSON files are relative to the file itself
+    if base is not None and (base / path).exists():
+        return base / path
+    return Path(path)
+
+
+def load_samples(config:dict, base:Optional[Path]=None) -> List[Sample]:
+    """Samples of a JSON scene description."""
+
+    samples = []
+    centre = False
+    for entry in config["Samples"]:
+        if entry == "MoveToCentre":
+            centre = True
+            continue
+
+        mesh = mesh_io.load(_resolve(entry["Path"], base), entry["Label"])
+        matrix = scene_graph.transform_matrix(entry.get("Transform", []))
+        scale = projection_store.UNITS[entry.get("Unit", "mm")]
+        vertices = (mesh.vertices.astype(np.double) * scale) @ matrix[:3, :3].T + matrix[:3, 3]
+
+        material = material_basis.Material.from_config(entry["Material"], entry.get("Density"))
+        samples.append(Sample(mesh_io.Mesh(vertices, mesh.indices, entry["Label"]), material))
+
+    # Centre the bounding box of the scene on the origin, like gvxr.moveToCentre
+    if centre and samples:
+        lo = np.min([sample.mesh.bounds()[0] for sample in samples], axis=0)
+        hi = np.max([sample.mesh.bounds()[1] for sample in samples], axis=0)
+        for sample in samples:
+            sample.mesh.vertices = sample.mesh.vertices - (lo + hi) / 2
+
+    return samples
+
+
+def beam_spectrum(config:dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Energies (keV) and photon counts of the beam of a JSON scene description."""
+
+    beam = config["Source"]["Beam"]
+    if isinstance(beam, dict):
+        # Tube spectrum, filters given in mm
+        import spectrum_engine
+        import xraylib as xrl
+
+        spectrum = spectrum_engine.unfiltered_spectrum(beam["kvp"], theta=beam.get("tube angle", 12))
+        filters = [(xrl.SymbolToAtomicNumber(symbol), 0.1 * thickness) for symbol, thickness in beam.get("filters", [])]
+        energies, density = spectrum.attenuate(filters).points()
+        return energies, density * np.gradient(energies)
+
+    energies = np.array([b["Energy"] * polychromatic.ENERGY_UNITS[b.get("Unit", "keV")] for b in beam], dtype=np.double)
+    counts = np.array([b.get("PhotonCount", 1) for b in beam], dtype=np.double)
+    return energies, counts
+
+
+def _bins(u_min, u_max, v_min, v_max, geometry:Geometry, start:int, stop:int, bin_size:int):
+    """(triangle, bin) pairs of the bins of rows [start, stop) overlapped by the triangles' bounding boxes."""
+
+    cols = geometry.shape[1]
+    centre_col, centre_row = geometry.centre
+    # Pixels whose centres fall in the bounding boxes
+    c0 = np.maximum(np.ceil(u_min / geometry.spacing[0] + centre_col), 0)
+    c1 = np.minimum(np.floor(u_max / geometry.spacing[0] + centre_col), cols - 1)
+    r0 = np.maximum(np.ceil(v_min / geometry.spacing[1] + centre_row), start)
+    r1 = np.minimum(np.floor(v_max / geometry.spacing[1] + centre_row), stop - 1)
+    visible = np.flatnonzero((c0 <= c1) & (r0 <= r1))
+
+    bx0, bx1 = (c0[visible] // bin_size).astype(int), (c1[visible] // bin_size).astype(int)
+    by0, by1 = ((r0[visible] - start) // bin_size).astype(int), ((r1[visible] - start) // bin_size).astype(int)
+    nx, ny = bx1 - bx0 + 1, by1 - by0 + 1
+    counts = nx * ny
+
+    # Expand each triangle to the bins of its bounding box
+    triangles = np.repeat(visible, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    bx = np.repeat(bx0, counts) + offsets % np.repeat(nx, counts)
+    by = np.repeat(by0, counts) + offsets // np.repeat(nx, counts)
+    return triangles, by, bx
+
+
+def mesh_path_lengths(vertices:np.ndarray, indices:np.ndarray, geometry:Geometry,
+        start:int=0, stop:Optional[int]=None, bin_size:int=DEFAULT_BIN_SIZE) -> np.ndarray:
+    """Path lengths (mm) through a closed mesh for rows [start, stop) of the detector.
+
+    Args:
+        vertices (np.ndarray): V x 3 vertices, in mm.
+        indices (np.ndarray): T x 3 vertex indices, counterclockwise seen from outside.
+        geometry (Geometry): The source and detector.
+        start, stop (int): Rows of the detector.
+        bin_size (int): Pixels along each side of the bins.
+
+    Returns:
+        np.ndarray: (stop - start) x columns path lengths.
+    """
+
+    stop = geometry.shape[0] if stop is None else stop
+    cols = geometry.shape[1]
+    lengths = np.zeros((stop - start, cols))
+
+    vertices = np.asarray(vertices, dtype=np.double)
+    indices = np.asarray(indices, dtype=np.intp)
+    offset = vertices - geometry.detector if geometry.parallel else vertices - geometry.source
+
+    # Projection of the vertices on the detector plane, from the detector centre
+    u = offset @ geometry.right
+    v = offset @ geometry.up
+    if not geometry.parallel:
+        depth = offset @ geometry.direction
+        distance = np.linalg.norm(geometry.detector - geometry.source)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u, v = u * distance / depth, v * distance / depth
+        # Triangles that are not in front of the source are not seen
+        indices = indices[np.all(depth[indices] > 0, axis=1)]
+
+    a, b, c = indices[:, 0], indices[:, 1], indices[:, 2]
+    area = (u[b] - u[a]) * (v[c] - v[a]) - (v[b] - v[a]) * (u[c] - u[a])
+    indices = indices[area != 0]
+    orientation = np.sign(area[area != 0])
+
+    # Edges go from the lower to the higher vertex index so that neighbours compute them identically
+    first = np.minimum(indices, np.roll(indices, -1, axis=1))
+    second = np.maximum(indices, np.roll(indices, -1, axis=1))
+    side = np.where(indices < np.roll(indices, -1, axis=1), 1, -1) * orientation[:, None]
+
+    # Plane of each triangle, with outward normals
+    triangles = vertices[indices]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    plane = np.einsum("ij,ij->i", normals, triangles[:, 0])
+
+    corners = u[indices], v[indices]
+    triangle_ids, by, bx = _bins(corners[0].min(axis=1), corners[0].max(axis=1), corners[1].min(axis=1), corners[1].max(axis=1),
+        geometry, start, stop, bin_size)
+    order = np.lexsort((bx, by))
+    triangle_ids, by, bx = triangle_ids[order], by[order], bx[order]
+    bounds = np.flatnonzero(np.diff(by * (cols // bin_size + 1) + bx)) + 1
+
+    pu_all, pv_all = geometry.pixel_coordinates(start, stop)
+    for ids, y, x in zip(np.split(triangle_ids, bounds), by[np.r_[0, bounds]] if len(by) else [], bx[np.r_[0, bounds]] if len(bx) else []):
+        rows = slice(y * bin_size, min((y + 1) * bin_size, stop - start))
+        columns = slice(x * bin_size, min((x + 1) * bin_size, cols))
+        pu = pu_all[rows, columns].reshape(-1, 1)
+        pv = pv_all[rows, columns].reshape(-1, 1)
+
+        inside = np.ones((len(pu), len(ids)), dtype=bool)
+        for k in range(3):
+            p, q, s = first[ids, k], second[ids, k], side[ids, k]
+            edge = (u[q] - u[p]) * (pv - v[p]) - (v[q] - v[p]) * (pu - u[p])
+            inside &= (edge * s > 0) | ((edge == 0) & (s > 0))
+
+        hits = np.flatnonzero(inside.any(axis=0))
+        if len(hits) == 0:
+            continue
+        ids, inside = ids[hits], inside[:, hits]
+
+        # Signed distances to the planes: positive where the ray leaves the mesh, negative where it enters
+        n = normals[ids]
+        if geometry.parallel:
+            origins = geometry.detector + pu * geometry.right + pv * geometry.up
+            distances = (plane[ids] - origins @ n.T) / np.abs(n @ geometry.direction)
+        else:
+            pixels = geometry.detector + pu * geometry.right + pv * geometry.up
+            directions = pixels - geometry.source
+            directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+            distances = (plane[ids] - geometry.source @ n.T) / np.abs(directions @ n.T)
+
+        lengths[rows, columns] += np.where(inside, distances, 0).sum(axis=1).reshape(lengths[rows, columns].shape)
+
+    # Meshes that are not closed (e.g. a matrix whose holes are cut by the fibres) may leave negative lengths
+    return np.maximum(lengths, 0, out=lengths)
+
+
+def _tile(infos:Sequence[mesh_io.SharedMeshInfo], rotation:np.ndarray, centre:np.ndarray,
+        geometry:Geometry, start:int, stop:int, bin_size:int) -> Tuple[int, np.ndarray]:
+    """Path lengths of every sample for rows [start, stop), with the meshes from shared memory."""
+
+    lengths = []
+    for info in infos:
+        mesh = mesh_io.attach(info)
+        vertices = (mesh.vertices.astype(np.double) - centre) @ rotation.T + centre
+        lengths.append(mesh_path_lengths(vertices, mesh.indices, geometry, start, stop, bin_size))
+    return start, np.stack(lengths)
+
+
+class CPUProjector(acquisition.Simulator):
+    """Simulator computing projections on the CPU.
+
+    The scan rotates the samples by an absolute angle around rotation_axis
+    through centre. With an roi (detector.ROI), images only hold its rows
+    and columns.
+    """
+
+    def __init__(self,
+            samples:Sequence[Sample],
+            geometry:Geometry,
+            energies:np.ndarray,
+            counts:np.ndarray,
+            rotation_axis:Sequence[float]=(0, 0, 1),
+            centre:Sequence[float]=(0, 0, 0),
+            workers:Optional[int]=None,
+            bin_size:int=DEFAULT_BIN_SIZE,
+            response=None,
+            supersample:int=1,
+            roi:Optional[detector.ROI]=None):
+
+        self.samples = list(samples)
+        self.geometry = geometry
+        self.rotation_axis = tuple(rotation_axis)
+        self.centre = np.asarray(centre, dtype=np.double)
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.bin_size = bin_size
+        self.supersample = int(supersample)
+        self.roi = roi
+        self.angle = 0.0
+
+        # Pixels are integrated over supersample x supersample sub-pixels, band of rows by band of rows of the ROI
+        rows, cols = geometry.shape
+        bands = roi.runs(rows) if roi is not None else [(0, rows)]
+        columns = roi.column_range(cols) if roi is not None else (0, cols)
+        self.bands = [geometry.crop(band, columns).supersampled(self.supersample) for band in bands]
+
+        # One material per sample, the images are contractions of the samples' path-length maps
+        self.model = polychromatic.SpectralModel.from_materials([sample.material for sample in self.samples],
+            None, energies, counts, response)
+
+        self._shared = None
+        self._infos = None
+        self._executor = None
+
+    @classmethod
+    def from_json(cls, fname:str|Path, rotation_axis:Optional[Sequence[float]]=None, **kwargs) -> "CPUProjector":
+        """Create a projector from a JSON scene description.
+
+        Like GVXRSimulator.from_json, the scan rotates around the detector's
+        up vector by default, through the scan's CenterOfRotation if any.
+        """
+
+        fname = Path(fname)
+        with open(fname) as f:
+            config = json.load(f)
+
+        if rotation_axis is None:
+            rotation_axis = config["Detector"]["UpVector"]
+        kwargs.setdefault("centre", scene_graph.rotation_centre(config))
+
+        response = config["Detector"].get("EnergyResponse")
+        if response is not None:
+            kwargs.setdefault("response", polychromatic.load_energy_response(_resolve(response["File"], fname.parent), response.get("Energy", "MeV")))
+
+        return cls(load_samples(config, fname.parent), Geometry.from_config(config), *beam_spectrum(config),
+            rotation_axis=rotation_axis, **kwargs)
+
+    def detector_shape(self) -> Tuple[int, int]:
+        return self.geometry.shape if self.roi is None else self.roi.shape(self.geometry.shape)
+
+    @property
+    def sampling_shape(self) -> Tuple[int, int]:
+        """Rows and columns of the sub-pixels computed."""
+        return sum(band.shape[0] for band in self.bands), self.bands[0].shape[1]
+
+    def set_angle(self, angle:float):
+        # Absolute angles, the meshes themselves are never modified
+        self.angle = angle
+
+    def _start(self):
+        if self._executor is None:
+            self._shared = mesh_io.SharedMeshes()
+            self._infos = [self._shared.publish(sample.mesh) for sample in self.samples]
+            self._executor = ProcessPoolExecutor(self.workers, initializer=mesh_io.attach_all, initargs=(self._infos,))
+
+    def _tiles(self, tile_rows:int) -> Iterator[Tuple[int, np.ndarray]]:
+        """Path lengths of tiles of rows of the sampling grid, in order, with their first row."""
+
+        rotation = scene_graph.rotation_matrix(self.angle, self.rotation_axis)
+        # (first row of the tile in the sampling grid, band, rows of the tile in the band)
+        tiles = []
+        offset = 0
+        for band in self.bands:
+            tiles += [(offset + start, band, start, min(start + tile_rows, band.shape[0])) for start in range(0, band.shape[0], tile_rows)]
+            offset += band.shape[0]
+
+        if self.workers <= 1:
+            meshes = [((sample.mesh.vertices - self.centre) @ rotation.T + self.centre, sample.mesh.indices) for sample in self.samples]
+            for first, band, start, stop in tiles:
+                with tracing.span("cpu.path_lengths"):
+                    block = np.stack([mesh_path_lengths(vertices, indices, band, start, stop, self.bin_size)
+                        for vertices, indices in meshes])
+                yield first, block
+            return
+
+        self._start()
+        futures = [(first, self._executor.submit(_tile, self._infos, rotation, self.centre, band, start, stop, self.bin_size))
+            for first, band, start, stop in tiles]
+        for first, future in futures:
+            # Time spent waiting for the workers, whose own spans stay in their processes
+            with tracing.span("cpu.wait"):
+                _, block = future.result()
+            yield first, block
+
+    def _tile_rows(self) -> int:
+        # Detector rows per tile: enough tiles to balance the workers, few enough rows to bound the memory
+        rows = self.detector_shape()[0]
+        if self.workers <= 1:
+            return min(rows, DEFAULT_TILE_ROWS)
+        return max(1, min(-(-rows // (4 * self.workers)), DEFAULT_TILE_ROWS))
+
+    def path_lengths(self) -> np.ndarray:
+        """Path lengths (mm) through each sample at the current angle, samples x rows x columns of the sampling grid."""
+
+        lengths = np.empty((len(self.samples), *self.sampling_shape))
+        for start, block in self._tiles(self._tile_rows() * self.supersample):
+            lengths[:, start:start + block.shape[1]] = block
+        return lengths
+
+    def compute_into(self, out:np.ndarray):
+        # Each tile is integrated over the supersampled pixels as soon as it is computed
+        s = self.supersample
+        for start, block in self._tiles(self._tile_rows() * s):
+            with tracing.span("cpu.project", bytes=block.nbytes):
+                image = self.model.project(block)
+            if s > 1:
+                with tracing.span("detector.bin", bytes=image.nbytes):
+                    image = detector.bin_pixels(image, s, mean=True)
+            out[start // s:start // s + image.shape[0]] = image
+
+    def flat_field(self) -> float:
+        return self.model.flat_field()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._shared.close()
+            self._executor = self._shared = self._infos = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def compare(image:np.ndarray, reference:np.ndarray) -> dict:
+    """Differences between an image and a reference, e.g. the same scene simulated by gVirtualXray."""
+
+    image = np.asarray(image, dtype=np.double)
+    reference = np.asarray(reference, dtype=np.double)
+    difference = image - reference
+    return {
+        "max_abs": float(np.abs(difference).max()),
+        "rmse": float(np.sqrt(np.mean(difference ** 2))),
+        "relative_rmse": float(np.sqrt(np.mean(difference ** 2)) / max(np.sqrt(np.mean(reference ** 2)), 1e-30)),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import tifffile as tf
+
+    parser = argparse.ArgumentParser(description="Simulate a projection of a JSON scene on the CPU.")
+    parser.add_argument("config", help="JSON scene description")
+    parser.add_argument("output", help="Output TIFF file")
+    parser.add_argument("--angle", type=float, default=0, help="Rotation of the samples (degrees)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes")
+    parser.add_argument("--reference", help="TIFF file to compare the projection with")
+    args = parser.parse_args()
+
+    with CPUProjector.from_json(args.config, workers=args.workers) as projector:
+        projector.set_angle(args.angle)
+        image = np.empty(projector.detector_shape(), dtype=np.single)
+        projector.compute_into(image)
+
+    tf.imwrite(args.output, image)
+    if args.reference is not None:
+        print(json.dumps(compare(image, tf.imread(args.reference)), indent=2))
@@ -0,0 +1,427 @@
+"""Detector model applied to ideal projections: blur, binning and energy response.
+
+gVirtualXray applies the detector's line spread function (gvxr.setLSF) and
+energy response while simulating, so exploring them means simulating again.
+This module applies them to stored ideal projections instead, a whole stack
+at a time:
+
+- the LSF is a 1D kernel convolved along the rows and then the columns of
+  the images (a separable point spread function), directly for short
+  kernels and by FFT for long ones, with the kernel spectra cached;
+- binning sums (or averages) blocks of pixels;
+- the energy response weights the energies of the spectrum, from
+  per-material path-length maps (see polychromatic);
+- a region of interest (ROI) keeps some rows and a window of columns of
+  the detector, and is recorded in the geometry of the stores that hold it.
+
+Images are padded by repeating their edge pixels before blurring, so that
+the borders of a flat field stay flat.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import json
+import os
+import numpy as np
+import projection_store
+
+# Kernels longer than this are applied by FFT
+DIRECT_MAX_TAPS = 16
+
+PAD_MODES = ("edge", "reflect", "constant")
+
+
+def load_lsf(fname:str|Path) -> np.ndarray:
+    """LSF from a text file with one value per line, e.g. input_data/fibres/LSF.txt."""
+    return np.loadtxt(fname, dtype=np.double).ravel()
+
+
+def lsf_from_config(config) -> Optional[np.ndarray]:
+    """LSF of a JSON scene description, from its detector (or source) "LSF" entry, None if it has none."""
+
+    if not isinstance(config, dict):
+        with open(config) as f:
+            config = json.load(f)
+
+    for section in ("Detector", "Source"):
+        lsf = config.get(section, {}).get("LSF")
+        if lsf is not None:
+            return load_lsf(lsf) if isinstance(lsf, str) else np.asarray(lsf, dtype=np.double)
+    return None
+
+
+def _fft_size(n:int) -> int:
+    # Smallest 2^a 3^b 5^c >= n, sizes numpy's FFT handles efficiently
+    best = 2 ** int(np.ceil(np.log2(n)))
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+@lru_cache(maxsize=64)
+def kernel_spectrum(kernel:Tuple[float, ...], size:int) -> np.ndarray:
+    """rfft of a kernel zero-padded to size, centred on index 0."""
+
+    kernel = np.asarray(kernel, dtype=np.double)
+    padded = np.zeros(size)
+    padded[:len(kernel)] = kernel
+    padded = np.roll(padded, -(len(kernel) // 2))
+
+    spectrum = np.fft.rfft(padded)
+    spectrum.flags.writeable = False
+    return spectrum
+
+
+def convolve_axis(images:np.ndarray, kernel:Sequence[float], axis:int=-1, mode:str="edge", method:str="auto") -> np.ndarray:
+    """Convolve images with a 1D kernel along one axis, keeping their shape.
+
+    Args:
+        images (np.ndarray): Images, any number of leading dimensions.
+        kernel (Sequence[float]): Kernel with an odd number of taps, centred on the middle one.
+        axis (int): Axis to convolve along.
+        mode (str): Padding of the borders, one of PAD_MODES.
+        method (str): "direct", "fft" or "auto" to choose from the kernel's length.
+
+    Returns:
+        np.ndarray: The convolved images, in the floating-point type of the input (float32 for integers).
+    """
+
+    if mode not in PAD_MODES:
+        raise ValueError(f"Unknown padding mode '{mode}', expected one of {PAD_MODES}")
+
+    kernel = np.asarray(kernel, dtype=np.double).ravel()
+    if len(kernel) % 2 == 0:
+        raise ValueError(f"Kernels need an odd number of taps, got {len(kernel)}")
+
+    dtype = images.dtype if np.issubdtype(images.dtype, np.floating) else np.dtype(np.single)
+    images = np.moveaxis(np.asarray(images, dtype=dtype), axis, -1)
+    half = len(kernel) // 2
+    n = images.shape[-1]
+    padded = np.pad(images, [(0, 0)] * (images.ndim - 1) + [(half, half)], mode=mode)
+
+    if method == "auto":
+        method = "direct" if len(kernel) <= DIRECT_MAX_TAPS else "fft"
+
+    if method == "direct":
+        out = np.zeros(images.shape, dtype=dtype)
+        # Correlation with the flipped kernel, one shifted slice per tap
+        for k, weight in enumerate(kernel[::-1]):
+            if weight != 0:
+                out += dtype.type(weight) * padded[..., k:k + n]
+    elif method == "fft":
+        size = _fft_size(padded.shape[-1])
+        spectrum = np.fft.rfft(padded, n=size, axis=-1)
+        spectrum *= kernel_spectrum(tuple(kernel), size)
+        out = np.fft.irfft(spectrum, n=size, axis=-1)[..., half:half + n].astype(dtype, copy=False)
+    else:
+        raise ValueError(f"Unknown method '{method}', expected 'direct', 'fft' or 'auto'")
+
+    return np.moveaxis(out, -1, axis)
+
+
+def apply_lsf(images:np.ndarray, lsf:Sequence[float], normalise:bool=True, **kwargs) -> np.ndarray:
+    """Blur images (rows x columns, or a stack) with an LSF along their rows and columns.
+
+    Args:
+        images (np.ndarray): The images.
+        lsf (Sequence[float]): The LSF, an odd number of taps.
+        normalise (bool): Scale the LSF to a unit sum, which preserves the total energy.
+        kwargs: See convolve_axis().
+    """
+
+    lsf = np.asarray(lsf, dtype=np.double)
+    if normalise:
+        lsf = lsf / lsf.sum()
+    return convolve_axis(convolve_axis(images, lsf, -1, **kwargs), lsf, -2, **kwargs)
+
+
+def _factors(factor:int|Tuple[int, int]) -> Tuple[int, int]:
+    return (int(factor), int(factor)) if np.isscalar(factor) else (int(factor[0]), int(factor[1]))
+
+
+def binned_shape(shape:Sequence[int], factor:int|Tuple[int, int]) -> Tuple[int, ...]:
+    """Shape of images once binned, the rows and columns left over being dropped."""
+
+    fy, fx = _factors(factor)
+    return (*shape[:-2], shape[-2] // fy, shape[-1] // fx)
+
+
+def bin_pixels(images:np.ndarray, factor:int|Tuple[int, int], mean:bool=False, dtype=None, out:Optional[np.ndarray]=None) -> np.ndarray:
+    """Sum (or average) blocks of pixels of images or stacks, dropping the rows and columns left over.
+
+    Blocks are accumulated one offset at a time into the output, from strided
+    views of the input, so no temporary the size of the input is created.
+
+    Args:
+        images (np.ndarray): Images, rows and columns last.
+        factor (int|Tuple[int, int]): Pixels per block along the rows and columns.
+        mean (bool): Average rather than sum.
+        dtype (optional): Accumulation type. Defaults to the floating-point type of the input (float32 for integers).
+        out (np.ndarray, optional): Output array.
+
+    Returns:
+        np.ndarray: The binned images.
+    """
+
+    fy, fx = _factors(factor)
+    if dtype is None:
+        dtype = images.dtype if np.issubdtype(images.dtype, np.floating) else np.single
+    dtype = np.dtype(dtype)
+
+    shape = binned_shape(images.shape, factor)
+    accumulator = out if out is not None and out.dtype == dtype else np.empty(shape, dtype=dtype)
+    rows, cols = shape[-2] * fy, shape[-1] * fx
+    for i in range(fy):
+        for j in range(fx):
+            block = images[..., i:rows:fy, j:cols:fx]
+            if i == 0 and j == 0:
+                np.copyto(accumulator, block, casting="unsafe")
+            else:
+                np.add(accumulator, block, out=accumulator, dtype=dtype, casting="unsafe")
+
+    if mean:
+        np.multiply(accumulator, dtype.type(1 / (fy * fx)), out=accumulator, casting="unsafe")
+    if out is not None and accumulator is not out:
+        np.copyto(out, accumulator, casting="unsafe")
+        return out
+    return accumulator
+
+
+def binned_geometry(geometry:dict, factor:int|Tuple[int, int]) -> dict:
+    """Geometry of a projection store (see projection_store.geometry_from_config) once its pixels are binned."""
+
+    if not geometry:
+        return geometry
+
+    fy, fx = _factors(factor)
+    geometry = dict(geometry)
+    if "pixel_size" in geometry:
+        geometry["pixel_size"] = [geometry["pixel_size"][0] * fx, geometry["pixel_size"][1] * fy]
+    if "number_of_pixels" in geometry:
+        geometry["number_of_pixels"] = [geometry["number_of_pixels"][0] // fx, geometry["number_of_pixels"][1] // fy]
+    return geometry
+
+
+@dataclass(frozen=True)
+class ROI():
+    """Region of interest of the detector: some of its rows and a window of columns.
+
+    Rows are detector row indices (row 0 being the lowest), e.g. the few
+    slices of a QA run. Only the region is simulated and stored, and its
+    position on the detector is recorded in the geometry of the stores (see
+    roi_geometry), so that reconstructions place it correctly.
+
+    Args:
+        rows (Sequence[int], optional): Increasing row indices, all the rows by default.
+        columns (Tuple[int, int], optional): First column and last column + 1, all the columns by default.
+    """
+
+    rows:Optional[Tuple[int, ...]] = None
+    columns:Optional[Tuple[int, int]] = None
+
+    def __post_init__(self):
+        if self.rows is not None:
+            rows = tuple(int(row) for row in np.ravel(self.rows))
+            if not rows or any(b <= a for a, b in zip(rows, rows[1:])) or rows[0] < 0:
+                raise ValueError(f"ROI rows must be increasing non-negative indices, got {rows}")
+            object.__setattr__(self, "rows", rows)
+        if self.columns is not None:
+            start, stop = (int(c) for c in self.columns)
+            if not 0 <= start < stop:
+                raise ValueError(f"Invalid ROI columns {self.columns}")
+            object.__setattr__(self, "columns", (start, stop))
+
+    @classmethod
+    def band(cls, start:int, stop:int, columns:Optional[Tuple[int, int]]=None) -> "ROI":
+        """Rows [start, stop)."""
+        return cls(tuple(range(start, stop)), columns)
+
+    @classmethod
+    def from_geometry(cls, geometry:Optional[dict]) -> Optional["ROI"]:
+        """ROI recorded in the geometry of a projection store, None if there is none."""
+
+        roi = (geometry or {}).get("roi")
+        if roi is None:
+            return None
+        return cls(tuple(roi["rows"]), tuple(roi["columns"]))
+
+    def row_indices(self, n_rows:int) -> np.ndarray:
+        rows = np.arange(n_rows) if self.rows is None else np.asarray(self.rows)
+        if len(rows) and rows[-1] >= n_rows:
+            raise ValueError(f"ROI row {rows[-1]} is outside the {n_rows} rows of the detector")
+        return rows
+
+    def column_range(self, n_cols:int) -> Tuple[int, int]:
+        start, stop = (0, n_cols) if self.columns is None else self.columns
+        if stop > n_cols:
+            raise ValueError(f"ROI columns {start}:{stop} are outside the {n_cols} columns of the detector")
+        return start, stop
+
+    def shape(self, detector_shape:Tuple[int, int]) -> Tuple[int, int]:
+        """Rows and columns of the region of a detector of detector_shape (rows, columns)."""
+
+        start, stop = self.column_range(detector_shape[1])
+        return len(self.row_indices(detector_shape[0])), stop - start
+
+    def runs(self, n_rows:int) -> list:
+        """Contiguous bands [start, stop) of detector rows making up the region, in order."""
+
+        rows = self.row_indices(n_rows)
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        return [(int(band[0]), int(band[-1]) + 1) for band in np.split(rows, breaks) if len(band)]
+
+    def is_band(self, n_rows:int) -> bool:
+        return len(self.runs(n_rows)) == 1
+
+    def crop(self, images:np.ndarray) -> np.ndarray:
+        """The region of full-detector images (rows and columns last), a view for a band of rows."""
+
+        start, stop = self.column_range(images.shape[-1])
+        runs = self.runs(images.shape[-2])
+        if len(runs) == 1:
+            return images[..., runs[0][0]:runs[0][1], start:stop]
+        return images[..., self.row_indices(images.shape[-2]), start:stop]
+
+
+def roi_geometry(geometry:dict, roi:Optional[ROI]) -> dict:
+    """Geometry of a projection store (see projection_store.geometry_from_config) that only holds an ROI of the detector.
+
+    number_of_pixels becomes that of the region, and "roi" records its rows,
+    columns and the number of pixels of the whole detector.
+    """
+
+    if not geometry or roi is None:
+        return geometry
+
+    cols, rows = geometry["number_of_pixels"]
+    start, stop = roi.column_range(cols)
+    geometry = dict(geometry)
+    geometry["roi"] = {"rows": roi.row_indices(rows).tolist(), "columns": [start, stop], "detector_pixels": [cols, rows]}
+    geometry["number_of_pixels"] = [stop - start, len(geometry["roi"]["rows"])]
+    return geometry
+
+
+def roi_centre(geometry:Optional[dict]) -> Optional[Tuple[float, float]]:
+    """Column and row of a store's stack where the detector centre falls, None without an ROI.
+
+    The row is only meaningful for a band of rows.
+    """
+
+    roi = (geometry or {}).get("roi")
+    if roi is None:
+        return None
+    cols, rows = roi["detector_pixels"]
+    return (cols - 1) / 2 - roi["columns"][0], (rows - 1) / 2 - roi["rows"][0]
+
+
+@dataclass(frozen=True)
+class DetectorModel():
+    """Detector blur, binning and energy response.
+
+    Args:
+        lsf (np.ndarray, optional): Line spread function, None for no blur.
+        binning (int|Tuple[int, int]): Pixels binned along the rows and columns.
+        mean (bool): Average binned pixels rather than summing them.
+        response (optional): Energy response, see polychromatic.SpectralModel.from_materials.
+        mode (str): Padding of the borders when blurring.
+    """
+
+    lsf:Optional[np.ndarray] = None
+    binning:int|Tuple[int, int] = 1
+    mean:bool = False
+    response:object = None
+    mode:str = "edge"
+
+    def output_shape(self, shape:Tuple[int, int]) -> Tuple[int, int]:
+        return binned_shape(shape, self.binning)
+
+    def apply(self, images:np.ndarray, out:Optional[np.ndarray]=None) -> np.ndarray:
+        """Blur and bin images (energy images, whose energy response is already applied), optionally into out."""
+
+        if self.lsf is not None:
+            images = apply_lsf(images, self.lsf, mode=self.mode)
+        if _factors(self.binning) != (1, 1):
+            return bin_pixels(images, self.binning, self.mean, out=out)
+        if out is not None:
+            out[...] = images
+            return out
+        return images
+
+    def render(self, lengths:np.ndarray, model) -> np.ndarray:
+        """Image of a projection from its per-material path-length maps, with this detector's energy response.
+
+        Args:
+            lengths (np.ndarray): Materials x rows x columns path lengths (mm).
+            model (polychromatic.SpectralModel): Spectrum and materials.
+        """
+        return self.apply(model.with_response(self.response).project(lengths))
+
+
+def process_stack(src,
+        dst:str|Path,
+        detector:DetectorModel,
+        workers:Optional[int]=None,
+        batch:int=16,
+        compression:Optional[str]=None) -> Path:
+    """Apply a detector model to a stack of ideal projections, into a new projection store.
+
+    Args:
+        src (np.ndarray|ProjectionStore|str): Ideal projections, angle x rows x columns.
+        dst (str|Path): File name of the output projection store.
+        detector (DetectorModel): The detector model. Its energy response is not used, the
+            projections already being energies.
+        workers (int, optional): Number of threads. Defaults to the number of CPUs.
+        batch (int): Number of projections per task.
+        compression (str, optional): Compression of the output store.
+
+    Returns:
+        Path: The output file name.
+    """
+
+    src = projection_store.as_stack(src)
+    is_store = isinstance(src, projection_store.ProjectionStore)
+    shape = (src.shape[0], *detector.output_shape(src.shape[1:]))
+    if is_store and ROI.from_geometry(src.geometry) is not None and _factors(detector.binning) != (1, 1):
+        raise ValueError(f"{src.fname} holds an ROI of the detector, which cannot be binned")
+
+    kwargs = {}
+    if is_store:
+        kwargs = dict(angles=src.angles, geometry=binned_geometry(src.geometry, detector.binning), units=src.units, config=src.config)
+        if src.flat is not None:
+            # A uniform flat field is only changed by the binning
+            flat = np.broadcast_to(np.asarray(src.flat, dtype=np.double), src.shape[1:])
+            kwargs["flat"] = detector.apply(flat[None])[0]
+
+    dtype = src.dtype if np.issubdtype(src.dtype, np.floating) else np.dtype(np.single)
+    workers = workers or os.cpu_count() or 1
+
+    with projection_store.create(dst, shape, dtype=dtype, compression=compression, **kwargs) as writer:
+        writer.metadata["detector"] = {"lsf": None if detector.lsf is None else [float(v) for v in detector.lsf],
+            "binning": detector.binning, "mean": detector.mean, "mode": detector.mode}
+
+        def task(start:int):
+            stop = min(start + batch, src.shape[0])
+            if writer.stack is not None:
+                detector.apply(np.asarray(src[start:stop]), out=writer.stack[start:stop])
+                writer.mark_written(slice(start, stop))
+            else:
+                images = detector.apply(np.asarray(src[start:stop]))
+                for i, image in enumerate(images):
+                    writer.write(start + i, image)
+
+        # NumPy's FFT and array operations release the GIL
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(task, range(0, src.shape[0], batch)))
+
+    return Path(dst)
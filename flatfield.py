@@ -0,0 +1,227 @@
+"""Streaming flat-field correction and log transform of projections.
+
+Each projection is corrected as
+
+    I = (raw - dark) / (flat - dark)
+
+optionally clipped to a minimum intensity and turned into line integrals
+with -log(I). The computation is element-wise and done in the floating-point
+type of the input (float32 for integer images), so processing a stack in
+chunks, in any order and on any number of workers gives results that are
+bit-identical to correct() applied to the whole stack at once.
+
+Stacks are processed a batch of projections at a time by a thread pool
+(NumPy releases the GIL) and written to a projection store, directories of
+TIFF files one file per task by a process pool. Outputs are written under a
+temporary name and renamed once complete.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import os
+import numpy as np
+import detector
+import pools
+import projection_store
+import tracing
+
+
+def work_dtype(dtype) -> np.dtype:
+    """Floating-point type used to correct images of a given type."""
+    dtype = np.dtype(dtype)
+    return dtype if np.issubdtype(dtype, np.floating) else np.dtype(np.single)
+
+
+def correct(images:np.ndarray,
+        flat:np.ndarray|float=1.0,
+        dark:Optional[np.ndarray|float]=None,
+        min_intensity:Optional[float]=None,
+        log:bool=False,
+        out:Optional[np.ndarray]=None) -> np.ndarray:
+    """Flat-field correction of one or more projections.
+
+    Args:
+        images (np.ndarray): Raw projections, rows x columns or angle x rows x columns.
+        flat (np.ndarray|float): Flat field (unattenuated beam).
+        dark (np.ndarray|float, optional): Dark field (no beam).
+        min_intensity (float, optional): Corrected intensities are clipped to this value.
+        log (bool): Return -log of the corrected intensities.
+        out (np.ndarray, optional): Output array, may be images itself.
+
+    Returns:
+        np.ndarray: The corrected projections.
+    """
+
+    dtype = work_dtype(images.dtype)
+    if out is None:
+        out = np.empty(images.shape, dtype=dtype)
+
+    flat = np.asarray(flat, dtype=dtype)
+    if dark is not None:
+        dark = np.asarray(dark, dtype=dtype)
+        np.subtract(images, dark, out=out, dtype=dtype)
+        np.divide(out, flat - dark, out=out)
+    else:
+        np.divide(images, flat, out=out, dtype=dtype)
+
+    if min_intensity is not None:
+        np.maximum(out, dtype.type(min_intensity), out=out)
+
+    if log:
+        np.log(out, out=out)
+        np.negative(out, out=out)
+
+    return out
+
+
+@tracing.traced("correct.stack")
+def process_stack(src,
+        dst:str|Path,
+        flat:Optional[np.ndarray|float]=None,
+        dark:Optional[np.ndarray|float]=None,
+        min_intensity:Optional[float]=None,
+        log:bool=False,
+        workers:Optional[int]=None,
+        batch:int=8,
+        compression:Optional[str]=None,
+        binning:int|Tuple[int, int]=1,
+        roi:Optional[detector.ROI]=None) -> Path:
+    """Correct a stack of projections into a new projection store.
+
+    Args:
+        src (np.ndarray|ProjectionStore|str): Raw projections, angle x rows x columns.
+        dst (str|Path): File name of the corrected projection store.
+        flat, dark: Flat and dark fields. Default to the ones of the source store, if any.
+        min_intensity (float, optional): Corrected intensities are clipped to this value.
+        log (bool): Store -log of the corrected intensities.
+        workers (int, optional): Number of threads. Defaults to the number of CPUs.
+        batch (int): Number of projections per task.
+        compression (str, optional): Compression of the output store.
+        binning (int|Tuple[int, int]): Pixels summed along the rows and columns before the
+            correction, along with the flat and dark fields.
+        roi (detector.ROI, optional): Region of the detector to keep, recorded in the geometry.
+
+    Returns:
+        Path: The output file name.
+    """
+
+    src = projection_store.as_stack(src)
+    is_store = isinstance(src, projection_store.ProjectionStore)
+    binned = binning not in (1, (1, 1))
+    if is_store and detector.ROI.from_geometry(src.geometry) is not None and (roi is not None or binned):
+        raise ValueError(f"{src.fname} already holds an ROI of the detector, it can be neither cropped nor binned")
+    if roi is not None and binned:
+        raise ValueError("Binning an ROI is not supported")
+
+    if flat is None:
+        flat = src.flat if is_store and src.flat is not None else 1.0
+    if dark is None and is_store:
+        dark = src.dark
+
+    # Read the auxiliary arrays once rather than from every task
+    flat = np.array(flat)
+    dark = np.array(dark) if dark is not None else None
+
+    kwargs = {}
+    if is_store:
+        geometry = detector.roi_geometry(src.geometry, roi) if roi is not None else detector.binned_geometry(src.geometry, binning)
+        kwargs = dict(angles=src.angles, geometry=geometry, units=src.units, config=src.config)
+
+    dtype = work_dtype(src.dtype)
+    workers = workers or os.cpu_count() or 1
+
+    shape = src.shape
+    if roi is not None:
+        # Only the rows of the region are read
+        shape = (src.shape[0], *roi.shape(src.shape[1:]))
+        flat = roi.crop(np.broadcast_to(flat, src.shape[1:]))
+        dark = roi.crop(np.broadcast_to(dark, src.shape[1:])) if dark is not None else None
+    if binned:
+        # Binned pixels collect the flat and dark fields of their sub-pixels too
+        flat = detector.bin_pixels(np.broadcast_to(flat, src.shape[1:]), binning)
+        dark = detector.bin_pixels(np.broadcast_to(dark, src.shape[1:]), binning) if dark is not None else None
+
+    with projection_store.create(dst, detector.binned_shape(shape, binning), dtype=dtype, compression=compression, **kwargs) as writer:
+        writer.metadata["processing"] = {"flat_field": True, "dark_field": dark is not None,
+            "min_intensity": min_intensity, "log": log, "binning": binning}
+
+        def task(start:int):
+            stop = min(start + batch, src.shape[0])
+            with tracing.span("correct.read") as span:
+                images = np.asarray(src[start:stop] if roi is None else _read_roi(src, start, stop, roi))
+                span.add_bytes(images.nbytes)
+            if binned:
+                with tracing.span("detector.bin", bytes=images.nbytes):
+                    images = detector.bin_pixels(images, binning, dtype=dtype)
+            with tracing.span("correct.batch", bytes=images.nbytes):
+                if writer.stack is not None:
+                    correct(images, flat, dark, min_intensity, log, out=writer.stack[start:stop])
+                    writer.mark_written(slice(start, stop))
+                else:
+                    corrected = correct(images, flat, dark, min_intensity, log)
+                    for i, image in enumerate(corrected):
+                        writer.write(start + i, image)
+            return stop - start
+
+        with ThreadPoolExecutor(workers) as executor:
+            for _ in pools.bounded_map(executor, task, ((start,) for start in range(0, src.shape[0], batch)), 2 * workers):
+                pass
+
+    return Path(dst)
+
+
+def _read_roi(src, start:int, stop:int, roi:detector.ROI) -> np.ndarray:
+    # Read each band of rows of the region rather than whole projections
+    columns = slice(*roi.column_range(src.shape[2]))
+    return np.concatenate([src[start:stop, a:b, columns] for a, b in roi.runs(src.shape[1])], axis=1)
+
+
+def _correct_file(src:str, dst:str, flat, dark, min_intensity, log):
+    import tifffile as tf
+
+    corrected = correct(tf.imread(src), flat, dark, min_intensity, log)
+
+    # Write next to the destination and rename so that readers never see a partial file
+    tmp = f"{dst}.{os.getpid()}.partial"
+    tf.imwrite(tmp, corrected, photometric="minisblack")
+    os.replace(tmp, dst)
+    return dst
+
+
+def process_files(files:Sequence[str|Path],
+        out_dir:str|Path,
+        flat:np.ndarray|float=1.0,
+        dark:Optional[np.ndarray|float]=None,
+        min_intensity:Optional[float]=None,
+        log:bool=False,
+        workers:Optional[int]=None) -> list:
+    """Correct TIFF files into another directory, keeping their names.
+
+    Args:
+        files (Sequence[str|Path]): Raw projections, one per file.
+        out_dir (str|Path): Output directory, must differ from the input directory.
+        flat, dark, min_intensity, log: See correct().
+        workers (int, optional): Number of processes. Defaults to the number of CPUs.
+
+    Returns:
+        list: The output file names.
+    """
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    tasks = []
+    for f in files:
+        f = Path(f)
+        dst = out_dir / f.name
+        if dst.resolve() == f.resolve():
+            raise ValueError(f"Refusing to overwrite the input file {f}")
+        tasks.append((str(f), str(dst), flat, dark, min_intensity, log))
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        for _ in pools.bounded_map(executor, _correct_file, tasks, 2 * workers):
+            pass
+
+    return [Path(task[1]) for task in tasks]
@@ -0,0 +1,215 @@
+"""Materials of a scene and their attenuation basis.
+
+Elements, compounds, NIST materials and mixtures by mass are all resolved
+into the same form: atomic numbers, their mass fractions and a density.
+The attenuation basis of a list of materials is then a dense energies x
+materials float32 matrix of mass attenuation coefficients, computed with
+one xraylib_np call for all the elements of the scene and a single matrix
+product with the materials' mass fractions:
+
+    mass_attenuation = cross_sections(elements, energies).T @ fractions.T
+
+A basis only depends on the compositions, the energies and the cross
+section, so it is cached by a content hash of these (see content_cache), in
+memory and in the "basis" subdirectory of GVXR_ATTENUATION_CACHE if it is set. Densities are
+applied afterwards, so density sweeps reuse the same matrix. Every
+projection and flat field of a scene shares one basis:
+
+    basis = material_basis.scene_basis(config, energies)
+    mu = basis.linear_attenuation   # energies x samples, cm-1
+"""
+
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+import os
+import numpy as np
+import xraylib as xrl
+import attenuation_tables
+import content_cache
+
+
+@dataclass(frozen=True)
+class Material():
+    """Elemental composition and density of a material.
+
+    Args:
+        name (str): Name of the material, e.g. its formula.
+        elements (np.ndarray): Atomic numbers.
+        fractions (np.ndarray): Mass fraction of each element, summing to 1.
+        density (float): Density in g/cm3.
+    """
+
+    name:str
+    elements:np.ndarray
+    fractions:np.ndarray
+    density:float
+
+    @classmethod
+    def from_name(cls, name:str, density:Optional[float]=None) -> "Material":
+        """Material from an element symbol, a chemical formula or a NIST compound name, at its tabulated density by default."""
+
+        elements, fractions = attenuation_tables.mass_fractions(name)
+        if density is None:
+            density = attenuation_tables.get_density(name)
+        return cls(name, elements, fractions, float(density))
+
+    @classmethod
+    def mixture(cls, elements:Sequence[int|str], amounts:Sequence[float], density:float, name:Optional[str]=None) -> "Material":
+        """Mixture by mass, like gvxr.setMixture.
+
+        Args:
+            elements (Sequence[int|str]): Atomic numbers or symbols, an element may appear more than once.
+            amounts (Sequence[float]): Mass of each element, in any unit (they are normalised).
+            density (float): Density in g/cm3.
+            name (str, optional): Name of the mixture, defaults to symbols followed by amounts.
+        """
+
+        if density is None:
+            raise ValueError(f"The density of mixture {name or list(elements)} must be given")
+        if len(elements) != len(amounts):
+            raise ValueError(f"Got {len(amounts)} amounts for {len(elements)} elements")
+
+        Z = np.array([xrl.SymbolToAtomicNumber(element) if isinstance(element, str) else int(element) for element in elements], dtype=np.int64)
+        amounts = np.asarray(amounts, dtype=np.double)
+        if name is None:
+            name = "".join(f"{xrl.AtomicNumberToSymbol(int(z))}{amount:g}" for z, amount in zip(Z, amounts))
+
+        # Merge repeated elements
+        elements, inverse = np.unique(Z, return_inverse=True)
+        fractions = np.zeros(len(elements))
+        np.add.at(fractions, inverse, amounts / amounts.sum())
+        return cls(name, elements, fractions, float(density))
+
+    @classmethod
+    def from_config(cls, material:Sequence, density:Optional[float]=None) -> "Material":
+        """Material of a JSON scene description: ["Element", "Ti"], ["Compound", "SiC"], ["Mixture", "Ti90Al6V4"] or ["Mixture", [Z, w, ...]]."""
+
+        kind, value = material[0], material[1:] if len(material) > 2 else material[1]
+        if kind == "Mixture":
+            Z, w = attenuation_tables.mixture_fractions(value)
+            return cls.mixture(Z, w, density, value if isinstance(value, str) else None)
+        if kind in ("Element", "Compound"):
+            return cls.from_name(value, density)
+        raise ValueError(f"Unknown kind of material '{kind}'")
+
+    def with_density(self, density:float) -> "Material":
+        return replace(self, density=float(density))
+
+
+def resolve(material, density:Optional[float]=None) -> Material:
+    """Material from a Material, a name or a JSON material list, with another density if given."""
+
+    if isinstance(material, Material):
+        return material if density is None else material.with_density(density)
+    if isinstance(material, str):
+        return Material.from_name(material, density)
+    return Material.from_config(material, density)
+
+
+def scene_materials(config:dict) -> List[Material]:
+    """Material of each sample of a JSON scene description, in order."""
+
+    return [Material.from_config(sample["Material"], sample.get("Density"))
+        for sample in config["Samples"] if isinstance(sample, dict)]
+
+
+def basis_key(materials:Sequence[Material], energies:np.ndarray, component:str="total") -> str:
+    """Content hash of the compositions (not the names or densities), energies and component of a basis."""
+
+    parts = [component, np.asarray(energies, dtype=np.double)]
+    for material in materials:
+        parts += [np.int64(len(material.elements)), np.asarray(material.elements, dtype=np.int64),
+            np.asarray(material.fractions, dtype=np.double)]
+    return content_cache.digest(*parts)
+
+
+def compute_mass_attenuation(materials:Sequence[Material], energies:np.ndarray, component:str="total") -> np.ndarray:
+    """Mass attenuation coefficients (cm2/g), energies x materials, without going through the cache."""
+
+    elements = np.unique(np.concatenate([material.elements for material in materials])) if materials else np.zeros(0, dtype=np.int64)
+
+    # Mass fractions of the elements of the whole scene, materials x elements
+    fractions = np.zeros((len(materials), len(elements)))
+    for i, material in enumerate(materials):
+        fractions[i, np.searchsorted(elements, material.elements)] = material.fractions
+
+    sections = attenuation_tables.cross_sections(elements, energies, component) if len(elements) else np.zeros((0, len(energies)))
+    return np.ascontiguousarray((fractions @ sections).T, dtype=np.single)
+
+
+@dataclass(frozen=True)
+class AttenuationBasis():
+    """Attenuation of a list of materials on an energy grid.
+
+    Args:
+        materials (Tuple[Material, ...]): The materials, one column each.
+        energies (np.ndarray): Energies in keV.
+        mass_attenuation (np.ndarray): Mass attenuation coefficients (cm2/g), energies x materials, float32.
+        component (str): Cross section, see attenuation_tables.COMPONENTS.
+        key (str): Content hash of the matrix, see basis_key().
+    """
+
+    materials:Tuple[Material, ...]
+    energies:np.ndarray
+    mass_attenuation:np.ndarray
+    component:str = "total"
+    key:str = ""
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(material.name for material in self.materials)
+
+    @property
+    def densities(self) -> np.ndarray:
+        return np.array([material.density for material in self.materials], dtype=np.double)
+
+    @property
+    def linear_attenuation(self) -> np.ndarray:
+        """Linear attenuation coefficients (cm-1), energies x materials, float32."""
+        return self.mass_attenuation * self.densities.astype(np.single)
+
+    def with_densities(self, densities:Sequence[float]) -> "AttenuationBasis":
+        """The same matrix for other densities."""
+        return replace(self, materials=tuple(material.with_density(d) for material, d in zip(self.materials, densities)))
+
+
+class BasisCache(content_cache.ContentCache):
+    """LRU cache of attenuation matrices by content hash, optionally backed by a directory of .npy files."""
+
+    def __init__(self, maxsize:int=64, cache_dir:Optional[str|Path]=None):
+        super().__init__(maxsize, cache_dir)
+
+    def get(self, materials:Sequence, energies:Sequence[float], component:str="total") -> AttenuationBasis:
+        """Basis of materials (Material objects, names or JSON lists), computing the matrix on a cache miss."""
+
+        materials = tuple(resolve(material) for material in materials)
+        energies = np.atleast_1d(np.array(energies, dtype=np.double))
+        energies.flags.writeable = False
+        key = basis_key(materials, energies, component)
+
+        def compute() -> np.ndarray:
+            matrix = compute_mass_attenuation(materials, energies, component)
+            matrix.flags.writeable = False
+            return matrix
+
+        return AttenuationBasis(materials, energies, self.lookup(key, compute), component, key)
+
+
+_cache_dir = os.environ.get("GVXR_ATTENUATION_CACHE")
+_default_cache = BasisCache(cache_dir=Path(_cache_dir) / "basis" if _cache_dir else None)
+
+
+def default_cache() -> BasisCache:
+    """The process-wide cache used by basis()."""
+    return _default_cache
+
+
+def basis(materials:Sequence, energies:Sequence[float], component:str="total") -> AttenuationBasis:
+    """Attenuation basis of materials (Material objects, names or JSON lists) from the process-wide cache."""
+    return _default_cache.get(materials, energies, component)
+
+
+def scene_basis(config:dict, energies:Sequence[float], component:str="total") -> AttenuationBasis:
+    """Attenuation basis of the samples of a JSON scene description, one column per sample."""
+    return basis(scene_materials(config), energies, component)
@@ -0,0 +1,284 @@
+"""Triangle mesh I/O: STL parsing, indexed meshes and shared-memory publishing.
+
+Binary STL files are read through a memory map as arrays of 50-byte records,
+so the triangles are a strided view of the file rather than a copy. Indexed
+meshes deduplicate the vertices of those triangles, and their bounding boxes
+and normals are computed with array operations.
+
+A process that loads meshes can publish them in shared memory. Workers of a
+pool attach to them by name, which costs neither parsing nor copying:
+
+    with mesh_io.SharedMeshes() as shared:
+        infos = [shared.publish(mesh_io.load(f)) for f in files]
+        with ProcessPoolExecutor(initializer=mesh_io.attach_all, initargs=(infos,)) as executor:
+            ...  # tasks call mesh_io.worker_mesh(label)
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Sequence, Tuple
+import os
+import numpy as np
+import tracing
+
+STL_DTYPE = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+
+STL_HEADER_SIZE = 84
+
+
+def is_binary_stl(fname:str|Path) -> bool:
+    """Whether a file is a binary STL, from its size and triangle count (ASCII files may start with "solid" too)."""
+
+    size = os.path.getsize(fname)
+    if size < STL_HEADER_SIZE:
+        return False
+    with open(fname, "rb") as f:
+        f.seek(80)
+        count = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+    return size == STL_HEADER_SIZE + count * STL_DTYPE.itemsize
+
+
+def read_records(fname:str|Path) -> np.ndarray:
+    """The records of a binary STL file, as a read-only memory map."""
+    return np.memmap(fname, dtype=STL_DTYPE, mode="r", offset=STL_HEADER_SIZE)
+
+
+def _read_ascii(fname:str|Path) -> np.ndarray:
+    values = []
+    with open(fname) as f:
+        for line in f:
+            words = line.split()
+            if words and words[0] == "vertex":
+                values.append(words[1:4])
+    return np.array(values, dtype=np.single).reshape(-1, 3, 3)
+
+
+def read_triangles(fname:str|Path) -> np.ndarray:
+    """Triangles of an STL file, T x 3 x 3.
+
+    For binary files this is a view of the memory-mapped file, for ASCII
+    files a parsed array.
+    """
+
+    if is_binary_stl(fname):
+        return read_records(fname)["vertices"]
+    return _read_ascii(fname)
+
+
+def write_stl(fname:str|Path, triangles:np.ndarray, header:str="") -> Path:
+    """Write triangles (T x 3 x 3) to a binary STL file."""
+
+    fname = Path(fname)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+
+    records = np.zeros(len(triangles), dtype=STL_DTYPE)
+    records["normal"] = face_normals(triangles)
+    records["vertices"] = triangles
+
+    # Write under a temporary name so that readers never see a partial file
+    tmp = fname.with_name(f"{fname.name}.{os.getpid()}.partial")
+    with open(tmp, "wb") as f:
+        f.write(header.encode()[:80].ljust(80, b"\0"))
+        f.write(np.uint32(len(records)).tobytes())
+        records.tofile(f)
+    os.replace(tmp, fname)
+    return fname
+
+
+def face_normals(triangles:np.ndarray) -> np.ndarray:
+    """Unit normals of T x 3 x 3 triangles (counterclockwise seen from outside), zero for degenerate ones."""
+
+    n = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    length = np.linalg.norm(n, axis=1, keepdims=True)
+    return np.divide(n, length, out=np.zeros_like(n), where=length > 0)
+
+
+@dataclass
+class Mesh():
+    """An indexed triangle mesh: unique vertices (V x 3, float32) and triangles as indices into them (T x 3, uint32)."""
+
+    vertices:np.ndarray
+    indices:np.ndarray
+    label:str = ""
+
+    @classmethod
+    def from_triangles(cls, triangles:np.ndarray, label:str="") -> "Mesh":
+        """Index a triangle soup, merging vertices with the same coordinates."""
+
+        # Adding zero turns -0.0 into 0.0, which would not compare equal as bytes
+        points = np.ascontiguousarray(np.asarray(triangles, dtype=np.single).reshape(-1, 3)) + np.single(0)
+        keys = points.view(np.dtype((np.void, points.dtype.itemsize * 3))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return cls(points[first], inverse.reshape(-1, 3).astype(np.uint32), label)
+
+    @property
+    def n_vertices(self) -> int:
+        return len(self.vertices)
+
+    @property
+    def n_triangles(self) -> int:
+        return len(self.indices)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vertices.nbytes + self.indices.nbytes
+
+    def triangles(self) -> np.ndarray:
+        """The triangles, T x 3 x 3."""
+        return self.vertices[self.indices]
+
+    def bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Lower and upper corners of the bounding box."""
+        return self.vertices.min(axis=0), self.vertices.max(axis=0)
+
+    def face_normals(self) -> np.ndarray:
+        return face_normals(self.triangles())
+
+    def vertex_normals(self) -> np.ndarray:
+        """Unit normals of the vertices, the area-weighted mean of the normals of their triangles."""
+
+        triangles = self.triangles()
+        weighted = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        normals = np.zeros(self.vertices.shape, dtype=weighted.dtype)
+        for corner in range(3):
+            np.add.at(normals, self.indices[:, corner], weighted)
+        length = np.linalg.norm(normals, axis=1, keepdims=True)
+        return np.divide(normals, length, out=np.zeros_like(normals), where=length > 0)
+
+    def scaled(self, factor:float) -> "Mesh":
+        return Mesh(self.vertices * np.single(factor), self.indices, self.label)
+
+    def save(self, fname:str|Path) -> Path:
+        return write_stl(fname, self.triangles(), self.label)
+
+    def to_gvxr(self, label:Optional[str]=None, unit:str="mm"):
+        """Create the mesh in gVirtualXray, instead of having it parse the file again."""
+
+        from gvxrPython3 import gvxr
+        gvxr.makeTriangularMesh(label or self.label, self.vertices.ravel().tolist(), self.indices.ravel().astype(int).tolist(), unit)
+
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+CACHE_SIZE = 32
+
+
+def load(fname:str|Path, label:Optional[str]=None) -> Mesh:
+    """Load and index an STL file, reusing the mesh of an unchanged file loaded before in this process."""
+
+    fname = Path(fname)
+    stat = fname.stat()
+    key = (str(fname.resolve()), stat.st_size, stat.st_mtime_ns)
+    label = label if label is not None else fname.stem
+
+    with _cache_lock:
+        mesh = _cache.get(key)
+        if mesh is not None:
+            _cache.move_to_end(key)
+
+    if mesh is None:
+        with tracing.span("mesh.load", bytes=stat.st_size, file=fname.name):
+            mesh = Mesh.from_triangles(read_triangles(fname), fname.stem)
+        mesh.vertices.flags.writeable = False
+        mesh.indices.flags.writeable = False
+        with _cache_lock:
+            _cache[key] = mesh
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return Mesh(mesh.vertices, mesh.indices, label)
+
+
+@dataclass(frozen=True)
+class SharedMeshInfo():
+    """What a process needs to attach to a published mesh, cheap to pickle."""
+
+    name:str
+    n_vertices:int
+    n_triangles:int
+    label:str
+
+
+def _vertex_bytes(n_vertices:int) -> int:
+    return n_vertices * 3 * np.dtype(np.single).itemsize
+
+
+def _open_shared(name:str) -> shared_memory.SharedMemory:
+    # Only the publisher should unlink the block, attaching processes must not track it (Python >= 3.13)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedMeshes():
+    """Meshes published in shared memory, which is released by close()."""
+
+    def __init__(self):
+        self._blocks:Dict[str, shared_memory.SharedMemory] = {}
+
+    def publish(self, mesh:Mesh) -> SharedMeshInfo:
+        """Copy a mesh into a new shared memory block."""
+
+        size = _vertex_bytes(mesh.n_vertices) + mesh.indices.size * np.dtype(np.uint32).itemsize
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._blocks[block.name] = block
+
+        info = SharedMeshInfo(block.name, mesh.n_vertices, mesh.n_triangles, mesh.label)
+        shared = _view(block, info)
+        shared.vertices[...] = mesh.vertices
+        shared.indices[...] = mesh.indices
+        return info
+
+    def close(self):
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _view(block:shared_memory.SharedMemory, info:SharedMeshInfo) -> Mesh:
+    vertices = np.ndarray((info.n_vertices, 3), dtype=np.single, buffer=block.buf)
+    indices = np.ndarray((info.n_triangles, 3), dtype=np.uint32, buffer=block.buf, offset=_vertex_bytes(info.n_vertices))
+    return Mesh(vertices, indices, info.label)
+
+
+# Blocks attached by this process, kept open for as long as their meshes may be used
+_attached:Dict[str, Tuple[shared_memory.SharedMemory, Mesh]] = {}
+
+
+def attach(info:SharedMeshInfo) -> Mesh:
+    """A read-only mesh backed by a published shared memory block, attached once per process."""
+
+    entry = _attached.get(info.name)
+    if entry is None:
+        block = _open_shared(info.name)
+        mesh = _view(block, info)
+        mesh.vertices.flags.writeable = False
+        mesh.indices.flags.writeable = False
+        entry = _attached[info.name] = (block, mesh)
+    return entry[1]
+
+
+def attach_all(infos:Sequence[SharedMeshInfo]):
+    """Attach to published meshes, e.g. as the initializer of a process pool."""
+    for info in infos:
+        attach(info)
+
+
+def worker_mesh(label:str) -> Mesh:
+    """A mesh attached by this process, by label."""
+
+    for _, mesh in _attached.values():
+        if mesh.label == label:
+            return mesh
+    raise KeyError(f"No shared mesh labelled '{label}' is attached to this process")
@@ -0,0 +1,285 @@
+"""Image-quality metrics, batched over slices and projections.
+
+Every metric reduces the last two axes of its inputs (the images) and keeps
+the leading ones, so scoring all the slices of a reconstruction against a
+reference is a single call:
+
+    scores = metrics.zncc(reference, recon)   # one value per slice
+
+Stacks larger than memory (projection stores, memory maps) are compared
+a batch of images at a time by compare_stacks(), which also accumulates
+stack-wide values with StackComparison.
+
+MTFs are measured from an edge (the profile across it, or a slanted edge
+in an image) or from a Siemens star such as phantoms.SiemensStar.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+
+IMAGE_AXES = (-2, -1)
+
+
+def _pair(reference, target) -> Tuple[np.ndarray, np.ndarray]:
+    reference = np.asarray(reference, dtype=np.double)
+    target = np.asarray(target, dtype=np.double)
+    if reference.shape[-2:] != target.shape[-2:]:
+        raise ValueError(f"Images of shapes {reference.shape[-2:]} and {target.shape[-2:]} cannot be compared")
+    return reference, target
+
+
+def rmse(reference, target) -> np.ndarray:
+    """Root mean square error of each image."""
+
+    reference, target = _pair(reference, target)
+    return np.sqrt(np.mean((target - reference) ** 2, axis=IMAGE_AXES))
+
+
+def psnr(reference, target, data_range:Optional[float]=None) -> np.ndarray:
+    """Peak signal-to-noise ratio (dB) of each image, data_range defaulting to that of each reference image."""
+
+    reference, target = _pair(reference, target)
+    if data_range is None:
+        data_range = np.ptp(reference, axis=IMAGE_AXES)
+    with np.errstate(divide="ignore"):
+        return 20 * np.log10(data_range / rmse(reference, target))
+
+
+def zncc(reference, target) -> np.ndarray:
+    """Zero-mean normalised cross-correlation of each image, in [-1, 1].
+
+    The CT notebook's zncc() returns (1 + zncc) / 2.
+    """
+
+    reference, target = _pair(reference, target)
+    a = reference - reference.mean(axis=IMAGE_AXES, keepdims=True)
+    b = target - target.mean(axis=IMAGE_AXES, keepdims=True)
+    return np.sum(a * b, axis=IMAGE_AXES) / np.sqrt(np.sum(a * a, axis=IMAGE_AXES) * np.sum(b * b, axis=IMAGE_AXES))
+
+
+def _box_mean(images:np.ndarray, size:int) -> np.ndarray:
+    """Means over size x size windows fully inside the images, from summed-area tables."""
+
+    table = np.zeros((*images.shape[:-2], images.shape[-2] + 1, images.shape[-1] + 1))
+    np.cumsum(np.cumsum(images, axis=-2), axis=-1, out=table[..., 1:, 1:])
+    sums = table[..., size:, size:] - table[..., :-size, size:] - table[..., size:, :-size] + table[..., :-size, :-size]
+    return sums / (size * size)
+
+
+def ssim(reference, target, data_range:Optional[float]=None, win_size:int=7, k1:float=0.01, k2:float=0.03) -> np.ndarray:
+    """Mean structural similarity of each image.
+
+    Like skimage.metrics.structural_similarity with its defaults: uniform
+    windows, sample covariances, and the mean taken over the windows that
+    fit in the image.
+
+    Args:
+        reference, target: Images, or stacks of them.
+        data_range (float, optional): Dynamic range of the images. Defaults to that of each reference image.
+        win_size (int): Side of the windows, odd.
+        k1, k2 (float): Stabilisation constants.
+    """
+
+    reference, target = _pair(reference, target)
+    if data_range is None:
+        data_range = np.ptp(reference, axis=IMAGE_AXES)
+    data_range = np.asarray(data_range, dtype=np.double)[..., None, None]
+
+    n = win_size * win_size
+    unbiased = n / (n - 1)
+    ux, uy = _box_mean(reference, win_size), _box_mean(target, win_size)
+    vx = unbiased * (_box_mean(reference * reference, win_size) - ux * ux)
+    vy = unbiased * (_box_mean(target * target, win_size) - uy * uy)
+    vxy = unbiased * (_box_mean(reference * target, win_size) - ux * uy)
+
+    c1, c2 = (k1 * data_range) ** 2, (k2 * data_range) ** 2
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return s.mean(axis=IMAGE_AXES)
+
+
+def cnr(images, roi:np.ndarray, background:np.ndarray) -> np.ndarray:
+    """Contrast-to-noise ratio of a region against a background, for each image.
+
+    Args:
+        images: Images, or stacks of them.
+        roi (np.ndarray): Boolean mask of the region, the shape of an image.
+        background (np.ndarray): Boolean mask of the background.
+
+    Returns:
+        np.ndarray: |mean(roi) - mean(background)| / std(background).
+    """
+
+    images = np.asarray(images, dtype=np.double)
+    inside = images[..., np.asarray(roi, dtype=bool)]
+    outside = images[..., np.asarray(background, dtype=bool)]
+    return np.abs(inside.mean(axis=-1) - outside.mean(axis=-1)) / outside.std(axis=-1)
+
+
+def circular_roi(shape:Tuple[int, int], centre:Tuple[float, float], radius:float) -> np.ndarray:
+    """Boolean mask of a disk, centre as (row, column) in pixels."""
+
+    rows, cols = np.ogrid[:shape[0], :shape[1]]
+    return (rows - centre[0]) ** 2 + (cols - centre[1]) ** 2 <= radius ** 2
+
+
+def mtf_from_esf(esf, spacing:float=1.0, window:bool=True) -> Tuple[np.ndarray, np.ndarray]:
+    """MTF from edge spread functions (profiles across an edge), along their last axis.
+
+    Args:
+        esf: Profiles, sampled every spacing pixels (e.g. 0.25 for 4x oversampled profiles).
+        spacing (float): Sampling step of the profiles, in pixels.
+        window (bool): Apply a Hann window to the line spread functions.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Frequencies (cycles per pixel) and the MTFs, normalised to 1 at 0.
+    """
+
+    lsf = np.gradient(np.asarray(esf, dtype=np.double), axis=-1)
+    if window:
+        lsf = lsf * np.hanning(lsf.shape[-1])
+    spectrum = np.abs(np.fft.rfft(lsf, axis=-1))
+    return np.fft.rfftfreq(lsf.shape[-1], spacing), spectrum / spectrum[..., :1]
+
+
+def slanted_edge_mtf(image, oversample:int=4) -> Tuple[np.ndarray, np.ndarray]:
+    """MTF of an image of a slightly slanted, near-vertical edge (ISO 12233).
+
+    The edge position in each row is the centroid of the row's derivative,
+    a line is fitted to them, and the pixels are binned by their distance to
+    the line at 1 / oversample pixels into an oversampled ESF.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Frequencies (cycles per pixel, up to oversample / 2) and the MTF.
+    """
+
+    image = np.asarray(image, dtype=np.double)
+    rows, cols = image.shape
+    derivative = np.abs(np.diff(image, axis=1))
+    x = np.arange(cols - 1) + 0.5
+    centroids = (derivative * x).sum(axis=1) / derivative.sum(axis=1)
+    slope, intercept = np.polyfit(np.arange(rows), centroids, 1)
+
+    # Signed horizontal distance of every pixel to the edge, measured perpendicular to it
+    r, c = np.mgrid[:rows, :cols]
+    distance = (c - (slope * r + intercept)) / np.sqrt(1 + slope ** 2)
+    bins = np.round(distance * oversample).astype(int)
+    bins -= bins.min()
+    counts = np.bincount(bins.ravel())
+    sums = np.bincount(bins.ravel(), image.ravel())
+
+    # Bins without samples are interpolated from their neighbours
+    filled = counts > 0
+    positions = np.arange(len(counts))
+    esf = np.interp(positions, positions[filled], sums[filled] / counts[filled])
+    return mtf_from_esf(esf, 1 / oversample)
+
+
+def siemens_star_mtf(image, n_sectors:int, radii:Sequence[float], centre:Optional[Tuple[float, float]]=None,
+        contrast:Optional[float]=None, samples:int=720) -> Tuple[np.ndarray, np.ndarray]:
+    """MTF from images of a Siemens star, e.g. phantoms.SiemensStar(n_sectors).
+
+    The images are sampled on circles around the centre of the star. A star
+    of n sectors is a square wave of n periods along each circle, of spatial
+    frequency n / (2 pi r), whose modulation is measured from its
+    fundamental Fourier coefficient.
+
+    Args:
+        image: Image, or a stack of images.
+        n_sectors (int): Number of sectors of the star.
+        radii (Sequence[float]): Radii of the circles, in pixels.
+        centre (Tuple[float, float], optional): Centre of the star as (row, column), defaults to the centre of the image.
+        contrast (float, optional): Difference between the sectors and the background. Defaults to
+            the modulation at the largest radius, which normalises the MTF to 1 there.
+        samples (int): Samples along each circle.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Frequencies (cycles per pixel) and the MTFs, one per radius.
+    """
+
+    image = np.asarray(image, dtype=np.double)
+    rows, cols = image.shape[-2:]
+    if centre is None:
+        centre = ((rows - 1) / 2, (cols - 1) / 2)
+    radii = np.asarray(radii, dtype=np.double)
+
+    # Bilinear interpolation on all the circles at once
+    theta = np.linspace(0, 2 * np.pi, samples, endpoint=False)
+    y = np.clip(centre[0] + radii[:, None] * np.sin(theta), 0, rows - 1)
+    x = np.clip(centre[1] + radii[:, None] * np.cos(theta), 0, cols - 1)
+    y0, x0 = np.minimum(y.astype(int), rows - 2), np.minimum(x.astype(int), cols - 2)
+    fy, fx = y - y0, x - x0
+    profiles = (image[..., y0, x0] * (1 - fy) * (1 - fx) + image[..., y0 + 1, x0] * fy * (1 - fx)
+        + image[..., y0, x0 + 1] * (1 - fy) * fx + image[..., y0 + 1, x0 + 1] * fy * fx)
+
+    # A 0/1 square wave of contrast C has a fundamental coefficient of modulus C / pi
+    modulation = np.pi * np.abs(np.mean(profiles * np.exp(-1j * n_sectors * theta), axis=-1))
+    if contrast is None:
+        contrast = modulation[..., np.argmax(radii), None]
+    return n_sectors / (2 * np.pi * radii), modulation / contrast
+
+
+@dataclass
+class StackComparison():
+    """Stack-wide RMSE, PSNR and ZNCC, accumulated a batch of images at a time."""
+
+    count:int = 0
+    sums:np.ndarray = field(default_factory=lambda: np.zeros(6))
+    minimum:float = np.inf
+    maximum:float = -np.inf
+
+    def update(self, reference, target):
+        reference, target = _pair(reference, target)
+        # Sums of x, y, x^2, y^2, xy and (x - y)^2
+        self.sums += [reference.sum(), target.sum(), np.sum(reference * reference), np.sum(target * target),
+            np.sum(reference * target), np.sum((reference - target) ** 2)]
+        self.count += reference.size
+        self.minimum = min(self.minimum, float(reference.min()))
+        self.maximum = max(self.maximum, float(reference.max()))
+
+    @property
+    def rmse(self) -> float:
+        return float(np.sqrt(self.sums[5] / self.count))
+
+    @property
+    def psnr(self) -> float:
+        return float(20 * np.log10((self.maximum - self.minimum) / self.rmse))
+
+    @property
+    def zncc(self) -> float:
+        n = self.count
+        sx, sy, sxx, syy, sxy, _ = self.sums
+        return float((sxy - sx * sy / n) / np.sqrt((sxx - sx * sx / n) * (syy - sy * sy / n)))
+
+
+def compare_stacks(reference, target, metrics:Sequence[str]=("rmse", "zncc", "ssim"), batch:int=16, **kwargs) -> Dict[str, np.ndarray|float]:
+    """Score every image of a stack against a reference, a batch at a time.
+
+    Args:
+        reference, target: Stacks of images (arrays, memory maps or projection stores).
+        metrics (Sequence[str]): Per-image metrics among "rmse", "psnr", "zncc" and "ssim".
+        batch (int): Number of images loaded at once.
+        kwargs: Passed to ssim().
+
+    Returns:
+        dict: An array of per-image values for each metric, and the stack-wide
+            "stack_rmse", "stack_psnr" and "stack_zncc".
+    """
+
+    functions = {"rmse": rmse, "psnr": psnr, "zncc": zncc, "ssim": lambda a, b: ssim(a, b, **kwargs)}
+    for metric in metrics:
+        if metric not in functions:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {tuple(functions)}")
+    if len(reference) != len(target):
+        raise ValueError(f"Stacks of {len(reference)} and {len(target)} images cannot be compared")
+
+    scores = {metric: np.empty(len(reference)) for metric in metrics}
+    stack = StackComparison()
+    for start in range(0, len(reference), batch):
+        a, b = _pair(reference[start:start + batch], target[start:start + batch])
+        for metric in metrics:
+            scores[metric][start:start + len(a)] = functions[metric](a, b)
+        stack.update(a, b)
+
+    scores.update(stack_rmse=stack.rmse, stack_psnr=stack.psnr, stack_zncc=stack.zncc)
+    return scores
@@ -0,0 +1,188 @@
+"""Photon and electronic noise applied to noise-free projections.
+
+Simulated images are energies (MeV) per pixel. A pixel that records an
+energy I received on average I / g photons, where g is the mean energy the
+detector records per photon of the unattenuated beam, so that the flat
+field corresponds to the number of photons per pixel of the beam (the
+"PhotonCount" of the JSON files, summed over the spectrum). A noisy image
+is
+
+    g * Poisson(I / g) + Normal(0, sigma)
+
+with sigma the standard deviation of the electronic noise, in image units.
+
+Each projection of each realisation draws from its own random stream,
+the child (realisation, projection) of a SeedSequence, as
+SeedSequence.spawn would make it. Results are therefore bit-reproducible
+whatever the number of workers or the size of the batches, and any
+realisation can be recomputed alone. Many realisations are made from one
+noise-free stack by reading it once.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Optional, Sequence
+import json
+import os
+import numpy as np
+import projection_store
+
+
+@dataclass(frozen=True)
+class NoiseModel():
+    """Quantum and electronic noise of a detector.
+
+    Args:
+        photons (float): Photons per pixel of the unattenuated beam.
+        flat (float): Value of an unattenuated pixel.
+        electronic (float): Standard deviation of the electronic noise, in image units.
+        clip (bool): Clip negative values to zero.
+    """
+
+    photons:float
+    flat:float = 1.0
+    electronic:float = 0.0
+    clip:bool = False
+
+    @classmethod
+    def from_spectrum(cls, model, photons:Optional[float]=None, **kwargs) -> "NoiseModel":
+        """Noise of a polychromatic.SpectralModel, with its photon counts unless photons is given."""
+
+        photons = float(np.sum(model.counts)) if photons is None else photons
+        return cls(photons, model.flat_field(), **kwargs)
+
+    @classmethod
+    def from_config(cls, config, flat:Optional[float]=None, **kwargs) -> "NoiseModel":
+        """Noise of the beam of a JSON scene description (dict or file name).
+
+        The flat field defaults to the energy of the beam, that of a perfect
+        detector. Pass the simulator's flat field to account for its energy response.
+        """
+
+        import cpu_projector
+
+        if not isinstance(config, dict):
+            with open(config) as f:
+                config = json.load(f)
+
+        energies, counts = cpu_projector.beam_spectrum(config)
+        if flat is None:
+            flat = float(np.sum(energies * counts) * 1e-3)
+        return cls(float(np.sum(counts)), flat, **kwargs)
+
+    @property
+    def gain(self) -> float:
+        """Mean image value per photon."""
+        return self.flat / self.photons
+
+    def with_photons(self, photons:float) -> "NoiseModel":
+        """The same detector with another dose, e.g. for dose studies."""
+        return replace(self, photons=photons)
+
+    def apply(self, images:np.ndarray, seed:int|np.random.SeedSequence, realisation:int=0, start:int=0,
+            out:Optional[np.ndarray]=None) -> np.ndarray:
+        """Noisy copies of projections.
+
+        Args:
+            images (np.ndarray): Noise-free projections, angle x rows x columns, or a single one.
+            seed (int|SeedSequence): Seed of the whole set of realisations.
+            realisation (int): Index of the realisation.
+            start (int): Index in the stack of the first projection of images.
+            out (np.ndarray, optional): Output array, may be images itself.
+
+        Returns:
+            np.ndarray: The noisy projections, in the floating-point type of the input (float32 for integers).
+        """
+
+        single = images.ndim == 2
+        dtype = images.dtype if np.issubdtype(images.dtype, np.floating) else np.dtype(np.single)
+        if out is None:
+            out = np.empty(images.shape, dtype=dtype)
+        images = images[None] if single else images
+        target = out[None] if single else out
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        gain = self.gain
+        for i, image in enumerate(images):
+            rng = np.random.default_rng(np.random.SeedSequence(seed.entropy, spawn_key=(*seed.spawn_key, realisation, start + i)))
+            expected = np.maximum(image / gain, 0)
+            noisy = rng.poisson(expected).astype(dtype, copy=False)
+            noisy *= dtype.type(gain)
+            if self.electronic > 0:
+                noisy += rng.normal(0, self.electronic, noisy.shape).astype(dtype, copy=False)
+            if self.clip:
+                np.maximum(noisy, 0, out=noisy)
+            target[i] = noisy
+
+        return out
+
+
+def process_stack(src,
+        dsts:str|Path|Sequence[str|Path],
+        model:NoiseModel,
+        seed:int,
+        realisations:Optional[Sequence[int]]=None,
+        workers:Optional[int]=None,
+        batch:int=8,
+        compression:Optional[str]=None) -> list:
+    """Write noisy realisations of a stack of projections to projection stores.
+
+    The source is read once, a batch of projections at a time, and every
+    realisation of the batch is written before moving on.
+
+    Args:
+        src (np.ndarray|ProjectionStore|str): Noise-free projections, angle x rows x columns.
+        dsts (str|Path|Sequence): File name of the output store, or one per realisation.
+        model (NoiseModel): The noise model.
+        seed (int): Seed of the whole set of realisations.
+        realisations (Sequence[int], optional): Indices of the realisations, defaults to 0, 1, ...
+        workers (int, optional): Number of threads. Defaults to the number of CPUs.
+        batch (int): Number of projections per task.
+        compression (str, optional): Compression of the output stores.
+
+    Returns:
+        list: The output file names.
+    """
+
+    dsts = [dsts] if isinstance(dsts, (str, Path)) else list(dsts)
+    realisations = list(range(len(dsts))) if realisations is None else list(realisations)
+    if len(realisations) != len(dsts):
+        raise ValueError(f"Got {len(realisations)} realisations for {len(dsts)} outputs")
+
+    src = projection_store.as_stack(src)
+    kwargs = {}
+    if isinstance(src, projection_store.ProjectionStore):
+        kwargs = dict(angles=src.angles, geometry=src.geometry, units=src.units, config=src.config, flat=src.flat, dark=src.dark)
+
+    dtype = src.dtype if np.issubdtype(src.dtype, np.floating) else np.dtype(np.single)
+    workers = workers or os.cpu_count() or 1
+
+    writers = [projection_store.create(dst, src.shape, dtype=dtype, compression=compression, **kwargs) for dst in dsts]
+    try:
+        for writer, realisation in zip(writers, realisations):
+            writer.metadata["noise"] = {"photons": model.photons, "flat": model.flat, "electronic": model.electronic,
+                "clip": model.clip, "seed": seed, "realisation": realisation}
+
+        def task(start:int):
+            stop = min(start + batch, src.shape[0])
+            images = np.asarray(src[start:stop])
+            for writer, realisation in zip(writers, realisations):
+                if writer.stack is not None:
+                    model.apply(images, seed, realisation, start, out=writer.stack[start:stop])
+                    writer.mark_written(slice(start, stop))
+                else:
+                    for i, image in enumerate(model.apply(images, seed, realisation, start)):
+                        writer.write(start + i, image)
+
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(task, range(0, src.shape[0], batch)))
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+
+    for writer in writers:
+        writer.close()
+    return [Path(dst) for dst in dsts]
@@ -0,0 +1,377 @@
+"""Binary STL meshes of the phantoms of phantoms.py, without OpenSCAD.
+
+Spheres, extruded convex polygons (the Doga circles and the Siemens star
+sectors) and plates with holes cut out are tessellated with NumPy from the
+primitive arrays of the phantoms, with the same fragment counts as OpenSCAD,
+and written as binary STL.
+
+Plates with holes are triangulated by cutting the plate into vertical slabs
+at the x coordinates of every vertex. Inside a slab no edge starts or ends,
+so the material between consecutive edges is a trapezoid. Edges are split at
+the slab boundaries and trapezoids include every vertex on their sides, so
+the mesh is closed and has no T-junctions.
+
+Meshes built from phantom parameters are kept in a content-addressed cache:
+the files are named after a hash of the phantom class, its parameters and
+the export options, so sweeps reuse the meshes they have already built.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+import phantoms
+from mesh_io import write_stl
+
+# Bump when the tessellation changes, to invalidate the cached meshes
+MESH_VERSION = 1
+
+# Thickness of phantoms.plate()
+PLATE_THICKNESS = 0.1
+
+
+def fragments(radius:float, fn:int=0, fa:float=12, fs:float=2) -> int:
+    """Number of fragments of a circle or sphere, like OpenSCAD's $fn, $fa and $fs."""
+
+    if radius < 1e-8:
+        return 3
+    if fn > 0:
+        return max(fn, 3)
+    return int(np.ceil(max(min(360 / fa, radius * 2 * np.pi / fs), 5)))
+
+
+def circle_points(centres:np.ndarray, radii:np.ndarray, segments:int) -> np.ndarray:
+    """Vertices of OpenSCAD circles, N x segments x 2, counterclockwise."""
+
+    t = 2 * np.pi * np.arange(segments) / segments
+    unit = np.stack((np.cos(t), np.sin(t)), axis=-1)
+    return np.asarray(centres)[:, None, :2] + np.asarray(radii)[:, None, None] * unit[None]
+
+
+def _fan(polygon:np.ndarray) -> np.ndarray:
+    # Triangles of a convex polygon (V x d), fanned from its first vertex
+    n = len(polygon)
+    return np.stack((np.broadcast_to(polygon[0], (n - 2, polygon.shape[1])), polygon[1:-1], polygon[2:]), axis=1)
+
+
+def _centroid_fan(polygon:np.ndarray) -> np.ndarray:
+    # Triangles of a convex polygon with collinear vertices, fanned from an inner point
+    centre = np.broadcast_to(polygon.mean(axis=0), polygon.shape)
+    return np.stack((centre, polygon, np.roll(polygon, -1, axis=0)), axis=1)
+
+
+def _lift(triangles:np.ndarray, z:float, flip:bool=False) -> np.ndarray:
+    # 2D triangles to 3D at height z, reversed for faces looking down
+    if flip:
+        triangles = triangles[:, ::-1]
+    return np.concatenate((triangles, np.full((*triangles.shape[:2], 1), z)), axis=-1)
+
+
+def _walls(loop:np.ndarray, z0:float, z1:float) -> np.ndarray:
+    """Side faces of a loop extruded from z0 to z1, facing right of the direction of travel."""
+
+    p = loop
+    q = np.roll(loop, -1, axis=0)
+    p0, q0 = _lift(p[:, None], z0)[:, 0], _lift(q[:, None], z0)[:, 0]
+    p1, q1 = _lift(p[:, None], z1)[:, 0], _lift(q[:, None], z1)[:, 0]
+    return np.concatenate((np.stack((p0, q0, q1), axis=1), np.stack((p0, q1, p1), axis=1)))
+
+
+def _signed_area(polygon:np.ndarray) -> float:
+    x, y = polygon[:, 0], polygon[:, 1]
+    return 0.5 * float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+
+def _oriented(polygon:np.ndarray, ccw:bool=True) -> np.ndarray:
+    # Rounding merges coordinates that only differ by rounding errors, e.g. cos(pi / 2), which would give sliver slabs
+    polygon = np.round(np.asarray(polygon, dtype=np.double), 12) + 0.0
+    return polygon if (_signed_area(polygon) > 0) == ccw else polygon[::-1]
+
+
+def sphere_triangles(centres:np.ndarray, radii:np.ndarray, segments:int) -> np.ndarray:
+    """Triangles of OpenSCAD spheres with the same number of fragments, (N * T) x 3 x 3."""
+
+    # Rings of latitude at the middle of the slices of the sphere, from the top down
+    rings = (segments + 1) // 2
+    phi = np.pi * (np.arange(rings) + 0.5) / rings
+    theta = 2 * np.pi * np.arange(segments) / segments
+    ring = np.stack((np.sin(phi)[:, None] * np.cos(theta), np.sin(phi)[:, None] * np.sin(theta),
+        np.broadcast_to(np.cos(phi)[:, None], (rings, segments))), axis=-1)
+
+    j = np.arange(segments)
+    k = np.roll(j, -1)
+    faces = [_fan(ring[0]), _fan(ring[-1][::-1])]
+    for i in range(rings - 1):
+        a, b = ring[i], ring[i + 1]
+        faces.append(np.stack((b[j], b[k], a[k]), axis=1))
+        faces.append(np.stack((b[j], a[k], a[j]), axis=1))
+    template = np.concatenate(faces)
+
+    centres = np.asarray(centres, dtype=np.double).reshape(-1, 3)
+    radii = np.ravel(radii).astype(np.double)
+    triangles = centres[:, None, None, :] + radii[:, None, None, None] * template[None]
+    return triangles.reshape(-1, 3, 3)
+
+
+def prism_triangles(polygons:Sequence[np.ndarray], z0:float, z1:float) -> np.ndarray:
+    """Triangles of convex polygons (each V x 2) extruded from z0 to z1."""
+
+    faces = []
+    for polygon in polygons:
+        polygon = _oriented(polygon)
+        faces += [_lift(_fan(polygon), z1), _lift(_fan(polygon), z0, flip=True), _walls(polygon, z0, z1)]
+    return np.concatenate(faces) if faces else np.empty((0, 3, 3))
+
+
+def _refine(loop:np.ndarray, xs:np.ndarray) -> np.ndarray:
+    """Split the edges of a loop where they cross the vertical lines at xs."""
+
+    points = []
+    for p, q in zip(loop, np.roll(loop, -1, axis=0)):
+        points.append(p[None])
+        if p[0] != q[0]:
+            inner = xs[(xs > min(p[0], q[0])) & (xs < max(p[0], q[0]))]
+            if p[0] > q[0]:
+                inner = inner[::-1]
+            t = (inner - p[0]) / (q[0] - p[0])
+            points.append(np.stack((inner, p[1] + t * (q[1] - p[1])), axis=-1))
+    return np.concatenate(points)
+
+
+def _cap(loops:Sequence[np.ndarray], xs:np.ndarray) -> np.ndarray:
+    """Counterclockwise triangles of the region inside the first loop and outside the others.
+
+    The loops must be refined at xs, which must contain the x coordinate of
+    every vertex, and must not cross each other.
+    """
+
+    p = np.concatenate(loops)
+    q = np.concatenate([np.roll(loop, -1, axis=0) for loop in loops])
+    left = np.where((p[:, 0] < q[:, 0])[:, None], p, q)
+    right = np.where((p[:, 0] < q[:, 0])[:, None], q, p)
+
+    triangles = []
+    for x0, x1 in zip(xs[:-1], xs[1:]):
+        crossing = (left[:, 0] == x0) & (right[:, 0] == x1)
+        l, r = left[crossing], right[crossing]
+        order = np.argsort(l[:, 1] + r[:, 1])
+        l, r = l[order], r[order]
+
+        # Material lies between the 1st and 2nd edges from the bottom, the 3rd and 4th, ...
+        on_left = np.unique(p[p[:, 0] == x0, 1])
+        on_right = np.unique(p[p[:, 0] == x1, 1])
+        for lower, upper in zip(range(0, len(l), 2), range(1, len(l), 2)):
+            yl0, yl1 = l[lower, 1], l[upper, 1]
+            yr0, yr1 = r[lower, 1], r[upper, 1]
+            ys_right = on_right[(on_right > yr0) & (on_right < yr1)]
+            ys_left = on_left[(on_left > yl0) & (on_left < yl1)][::-1]
+
+            polygon = np.concatenate((
+                [(x0, yl0), (x1, yr0)],
+                np.stack((np.full(len(ys_right), x1), ys_right), axis=-1),
+                [(x1, yr1), (x0, yl1)],
+                np.stack((np.full(len(ys_left), x0), ys_left), axis=-1)))
+
+            # Slabs that end at a vertex give triangles
+            keep = np.any(polygon != np.roll(polygon, -1, axis=0), axis=1)
+            polygon = polygon[keep]
+            if len(polygon) < 3:
+                continue
+            triangles.append(_fan(polygon) if len(ys_left) + len(ys_right) == 0 else _centroid_fan(polygon))
+
+    return np.concatenate(triangles) if triangles else np.empty((0, 3, 2))
+
+
+def plate_triangles(size:float, z0:float, z1:float, holes:Sequence[np.ndarray], heights:Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Triangles of a square plate (centred on the origin) with convex holes along z cut out.
+
+    Args:
+        size (float): Side of the plate.
+        z0, z1 (float): Extent of the plate along z.
+        holes (Sequence[np.ndarray]): Convex polygons (V x 2), which may touch but not overlap.
+        heights (Sequence[Tuple[float, float]]): Extent of each hole along z. Holes must reach at least one face of the plate.
+    """
+
+    half = size / 2
+    outer = np.array([(-half, -half), (half, -half), (half, half), (-half, half)])
+
+    kept = []
+    for hole, (h0, h1) in zip(holes, heights):
+        h0, h1 = max(h0, z0), min(h1, z1)
+        if h0 < h1:
+            if h0 > z0 and h1 < z1:
+                raise ValueError("Holes must reach at least one face of the plate")
+            kept.append((_oriented(hole, ccw=False), h0, h1))
+
+    xs = np.unique(np.concatenate([outer[:, 0]] + [hole[:, 0] for hole, _, _ in kept]))
+    outer = _refine(outer, xs)
+    kept = [(_refine(hole, xs), h0, h1) for hole, h0, h1 in kept]
+
+    faces = [
+        _lift(_cap([outer] + [hole for hole, _, h1 in kept if h1 >= z1], xs), z1),
+        _lift(_cap([outer] + [hole for hole, h0, _ in kept if h0 <= z0], xs), z0, flip=True),
+        _walls(outer, z0, z1)]
+
+    for hole, h0, h1 in kept:
+        faces.append(_walls(hole, h0, h1))
+        # Bottoms and tops of blind holes, facing into the hole
+        if h0 > z0:
+            faces.append(_lift(_centroid_fan(hole[::-1]), h0))
+        if h1 < z1:
+            faces.append(_lift(_centroid_fan(hole[::-1]), h1, flip=True))
+
+    return np.concatenate(faces)
+
+
+def _polygons(phantom, res:Optional[int]) -> List[np.ndarray]:
+    if phantom.kind == "cylinders":
+        return [circle_points(centre[None], [r], fragments(r, res or 0))[0]
+            for centre, r in zip(phantom.centres, np.ravel(phantom.radii))]
+    return list(phantom.vertices)
+
+
+def triangles(phantom, with_plate:Optional[str]=None, res:Optional[int]=None, scale:float=100) -> Dict[int, np.ndarray]:
+    """Triangles of a phantom, per material, as exported by phantoms.py.
+
+    Args:
+        phantom (phantoms.Phantom): The phantom.
+        with_plate (str, optional): "subtract" for plate() - phantom, "intersect" for plate() * phantom.
+        res (int, optional): Number of fragments of spheres and circles, OpenSCAD's defaults if None.
+        scale (float): Scale of the exported geometry, 100 for the STL files in mm.
+
+    Returns:
+        Dict[int, np.ndarray]: T x 3 x 3 triangles of each material.
+    """
+
+    if with_plate not in (None, "subtract", "intersect"):
+        raise ValueError(f"with_plate must be None, 'subtract' or 'intersect', got '{with_plate}'")
+
+    z0, z1 = -PLATE_THICKNESS / 2, PLATE_THICKNESS / 2
+    materials = np.ravel(phantom.materials)
+    meshes = {}
+
+    if phantom.kind == "spheres":
+        if with_plate is not None:
+            raise ValueError("Spheres are not cut out of plates")
+
+        radii = np.ravel(phantom.radii)
+        counts = np.array([fragments(r, res or 0) for r in radii])
+        for material in np.unique(materials):
+            parts = []
+            for count in np.unique(counts[materials == material]):
+                selected = (materials == material) & (counts == count)
+                parts.append(sphere_triangles(phantom.centres[selected], radii[selected], count))
+            meshes[int(material)] = np.concatenate(parts)
+
+    elif phantom.kind in ("cylinders", "sectors"):
+        polygons = _polygons(phantom, res)
+        h0, h1 = phantom.height
+
+        if with_plate == "subtract":
+            meshes[0] = plate_triangles(1, z0, z1, polygons, [(h0, h1)] * len(polygons))
+        else:
+            if with_plate == "intersect":
+                h0, h1 = max(h0, z0), min(h1, z1)
+            for material in np.unique(materials):
+                meshes[int(material)] = prism_triangles([p for p, m in zip(polygons, materials) if m == material], h0, h1)
+
+    else:
+        raise ValueError(f"Unknown kind of phantom '{phantom.kind}'")
+
+    return {material: mesh * scale for material, mesh in meshes.items()}
+
+
+# Phantoms whose geometry only depends on their parameters
+PHANTOMS = {
+    "DogaSpheres": phantoms.DogaSpheres,
+    "RandomMatSpheres": phantoms.RandomMatSpheres,
+    "DogaCircles": phantoms.DogaCircles,
+    "SiemensStar": phantoms.SiemensStar,
+}
+
+
+class MeshCache():
+    """Directory of STL files named after a hash of the phantom parameters.
+
+    A manifest listing the files of each entry is written last, so that an
+    interrupted build is simply built again.
+    """
+
+    def __init__(self, cache_dir:str|Path):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def parameters(phantom:str, **params) -> dict:
+        """All the parameters of a phantom, defaults included, so that equivalent calls share an entry."""
+
+        if phantom not in PHANTOMS:
+            raise ValueError(f"Unknown phantom '{phantom}', expected one of {tuple(PHANTOMS)}")
+        bound = inspect.signature(PHANTOMS[phantom]).bind(**params)
+        bound.apply_defaults()
+        return dict(bound.arguments)
+
+    @staticmethod
+    def key(phantom:str, params:dict, with_plate:Optional[str], scale:float) -> str:
+        """Content hash identifying a mesh."""
+
+        description = json.dumps({"phantom": phantom, "params": params, "with_plate": with_plate,
+            "scale": scale, "version": MESH_VERSION}, sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def get(self, phantom:str, with_plate:Optional[str]=None, scale:float=100, **params) -> List[Path]:
+        """STL files of a phantom, one per material, building them on a cache miss.
+
+        Args:
+            phantom (str): Name of the phantom class, one of PHANTOMS.
+            with_plate, scale: See triangles().
+            **params: Parameters of the phantom class, including res for the number of fragments.
+
+        Returns:
+            List[Path]: The STL files, in the order of the materials.
+        """
+
+        params = self.parameters(phantom, **params)
+        key = self.key(phantom, params, with_plate, scale)
+        manifest = self.cache_dir / f"{key}.json"
+
+        if manifest.exists():
+            with open(manifest) as f:
+                files = [self.cache_dir / name for name in json.load(f)["files"]]
+            if all(f.exists() for f in files):
+                self.hits += 1
+                return files
+
+        self.misses += 1
+        meshes = triangles(PHANTOMS[phantom](**params), with_plate, params.get("res"), scale)
+        files = [write_stl(self.cache_dir / f"{key}-{material}.stl", mesh, f"{phantom} {key}")
+            for material, mesh in sorted(meshes.items())]
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = manifest.with_name(f"{manifest.name}.{os.getpid()}.partial")
+        with open(tmp, "w") as f:
+            json.dump({"phantom": phantom, "params": params, "with_plate": with_plate, "scale": scale,
+                "version": MESH_VERSION, "files": [f.name for f in files]}, f, indent=2)
+        os.replace(tmp, manifest)
+        return files
+
+
+_default_cache = MeshCache(os.environ.get("GVXR_MESH_CACHE", Path.home() / ".cache" / "gvxr-meshes"))
+
+
+def default_cache() -> MeshCache:
+    """The process-wide cache used by mesh_files()."""
+    return _default_cache
+
+
+def set_cache_dir(cache_dir:str|Path):
+    _default_cache.cache_dir = Path(cache_dir)
+
+
+def mesh_files(phantom:str, with_plate:Optional[str]=None, scale:float=100, **params) -> List[Path]:
+    """STL files of a phantom from the process-wide cache, see MeshCache.get()."""
+    return _default_cache.get(phantom, with_plate, scale, **params)
@@ -0,0 +1,514 @@
+"""Analytic voxelisation and projection of the phantoms of phantoms.py.
+
+A scene is a union of disjoint convex primitives (spheres, cylinders and
+triangular prisms along z, boxes), optionally intersected with or subtracted
+from a box such as the plate. A ray crosses a convex primitive along a
+single interval that is found in closed form, and the part of it inside the
+plate is the intersection of two intervals, so line integrals are exact.
+Everything is vectorised over rays and primitives, and needs neither
+OpenSCAD nor a GPU.
+
+The conventions are the ones of recon_engine, so the projections can be
+reconstructed directly and compared with the voxelised volume:
+
+- volumes are slices x y x x, voxel centres symmetric about the origin;
+- projections are angle x rows x columns, rows along z and columns along x
+  at angle 0, the sample turning counterclockwise around z by the angle;
+- cone beams have the source on the +y side at angle 0, the detector centre
+  opposite;
+- lengths are in the unit of the phantom, scaled by Scene.scaled().
+"""
+
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import numpy as np
+import projection_store
+import recon_engine
+
+
+def _slab(origins:np.ndarray, directions:np.ndarray, lo:np.ndarray, hi:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Interval of t where lo <= origins + t * directions <= hi, for broadcastable arrays."""
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ta = (lo - origins) / directions
+        tb = (hi - origins) / directions
+
+    # Rays parallel to the slab are either always or never inside it
+    parallel = directions == 0
+    inside = (origins >= lo) & (origins <= hi)
+    t0 = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(ta, tb))
+    t1 = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(ta, tb))
+    return t0, t1
+
+
+def _disk(origins:np.ndarray, directions:np.ndarray, centres:np.ndarray, radii:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Interval of t inside circles (2D) or spheres (3D), rays x primitives, directions of unit length along the last axis."""
+
+    oc = origins[:, None, :] - centres[None, :, :]
+    d = directions[:, None, :]
+    a = np.sum(d * d, axis=-1)
+    b = np.sum(oc * d, axis=-1)
+    c = np.sum(oc * oc, axis=-1) - radii[None, :] ** 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        half = np.sqrt(b * b - a * c) / a
+        t0 = -b / a - half
+        t1 = -b / a + half
+
+    # Misses give NaN, rays with no component in the plane of a circle are inside it or not
+    parallel = a == 0
+    t0 = np.where(parallel, np.where(c <= 0, -np.inf, np.inf), t0)
+    t1 = np.where(parallel, np.where(c <= 0, np.inf, -np.inf), t1)
+    return np.nan_to_num(t0, nan=np.inf, posinf=np.inf, neginf=-np.inf), np.nan_to_num(t1, nan=-np.inf, posinf=np.inf, neginf=-np.inf)
+
+
+class Primitives():
+    """A set of convex primitives of the same kind, each with a material label."""
+
+    def __init__(self, labels):
+        self.labels = np.asarray(labels, dtype=int)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Lower and upper corners of the bounding boxes, N x 3."""
+        raise NotImplementedError
+
+    def contains(self, i:int, x:np.ndarray, y:np.ndarray, z:np.ndarray) -> np.ndarray:
+        """Whether the points at broadcastable coordinates are inside primitive i."""
+        raise NotImplementedError
+
+    def intervals(self, origins:np.ndarray, directions:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Entry and exit parameters of rays (R x 3, unit directions) in every primitive, R x N. Misses have t0 > t1."""
+        raise NotImplementedError
+
+    def scaled(self, factor:float) -> "Primitives":
+        raise NotImplementedError
+
+
+class Spheres(Primitives):
+    def __init__(self, centres, radii, labels=None):
+        self.centres = np.asarray(centres, dtype=np.double).reshape(-1, 3)
+        self.radii = np.ravel(radii).astype(np.double)
+        super().__init__(np.zeros(len(self.radii)) if labels is None else np.ravel(labels))
+
+    def bounds(self):
+        return self.centres - self.radii[:, None], self.centres + self.radii[:, None]
+
+    def contains(self, i, x, y, z):
+        cx, cy, cz = self.centres[i]
+        return (x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2 <= self.radii[i] ** 2
+
+    def intervals(self, origins, directions):
+        return _disk(origins, directions, self.centres, self.radii)
+
+    def scaled(self, factor):
+        return Spheres(self.centres * factor, self.radii * factor, self.labels)
+
+
+class Cylinders(Primitives):
+    """Cylinders along z, between heights (N x 2)."""
+
+    def __init__(self, centres, radii, heights, labels=None):
+        self.centres = np.asarray(centres, dtype=np.double)[..., :2].reshape(-1, 2)
+        self.radii = np.ravel(radii).astype(np.double)
+        self.heights = np.broadcast_to(np.asarray(heights, dtype=np.double), (len(self.radii), 2))
+        super().__init__(np.zeros(len(self.radii)) if labels is None else np.ravel(labels))
+
+    def bounds(self):
+        lo = np.concatenate((self.centres - self.radii[:, None], self.heights[:, :1]), axis=1)
+        hi = np.concatenate((self.centres + self.radii[:, None], self.heights[:, 1:]), axis=1)
+        return lo, hi
+
+    def contains(self, i, x, y, z):
+        cx, cy = self.centres[i]
+        return ((x - cx) ** 2 + (y - cy) ** 2 <= self.radii[i] ** 2) & (z >= self.heights[i, 0]) & (z <= self.heights[i, 1])
+
+    def intervals(self, origins, directions):
+        t0, t1 = _disk(origins[:, :2], directions[:, :2], self.centres, self.radii)
+        z0, z1 = _slab(origins[:, 2:], directions[:, 2:], self.heights[None, :, 0], self.heights[None, :, 1])
+        return np.maximum(t0, z0), np.minimum(t1, z1)
+
+    def scaled(self, factor):
+        return Cylinders(self.centres * factor, self.radii * factor, self.heights * factor, self.labels)
+
+
+class Prisms(Primitives):
+    """Prisms along z with convex polygonal sections (N x vertices x 2), between heights (N x 2)."""
+
+    def __init__(self, vertices, heights, labels=None):
+        self.vertices = np.asarray(vertices, dtype=np.double)
+        self.heights = np.broadcast_to(np.asarray(heights, dtype=np.double), (len(self.vertices), 2))
+        super().__init__(np.zeros(len(self.vertices)) if labels is None else np.ravel(labels))
+
+        # Inward normals of the edges, whatever the winding of the polygons
+        edges = np.roll(self.vertices, -1, axis=1) - self.vertices
+        normals = np.stack((-edges[..., 1], edges[..., 0]), axis=-1)
+        area = np.sum(self.vertices[..., 0] * np.roll(self.vertices[..., 1], -1, axis=1)
+            - np.roll(self.vertices[..., 0], -1, axis=1) * self.vertices[..., 1], axis=1)
+        self.normals = normals * np.sign(area)[:, None, None]
+
+    def bounds(self):
+        lo = np.concatenate((self.vertices.min(axis=1), self.heights[:, :1]), axis=1)
+        hi = np.concatenate((self.vertices.max(axis=1), self.heights[:, 1:]), axis=1)
+        return lo, hi
+
+    def contains(self, i, x, y, z):
+        inside = (z >= self.heights[i, 0]) & (z <= self.heights[i, 1])
+        for (vx, vy), (nx, ny) in zip(self.vertices[i], self.normals[i]):
+            inside = inside & ((x - vx) * nx + (y - vy) * ny >= 0)
+        return inside
+
+    def intervals(self, origins, directions):
+        # Cyrus-Beck clipping against the half-planes of the edges, rays x primitives x edges
+        num = np.einsum("nek,rnek->rne", self.normals, origins[:, None, None, :2] - self.vertices[None])
+        den = np.einsum("nek,rk->rne", self.normals, directions[:, :2])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = -num / den
+        t0 = np.max(np.where(den > 0, t, np.where((den == 0) & (num < 0), np.inf, -np.inf)), axis=-1)
+        t1 = np.min(np.where(den < 0, t, np.where((den == 0) & (num < 0), -np.inf, np.inf)), axis=-1)
+
+        z0, z1 = _slab(origins[:, 2:], directions[:, 2:], self.heights[None, :, 0], self.heights[None, :, 1])
+        return np.maximum(t0, z0), np.minimum(t1, z1)
+
+    def scaled(self, factor):
+        return Prisms(self.vertices * factor, self.heights * factor, self.labels)
+
+
+class Boxes(Primitives):
+    """Axis-aligned boxes between corners lo and hi (N x 3)."""
+
+    def __init__(self, lo, hi, labels=None):
+        self.lo = np.asarray(lo, dtype=np.double).reshape(-1, 3)
+        self.hi = np.asarray(hi, dtype=np.double).reshape(-1, 3)
+        super().__init__(np.zeros(len(self.lo)) if labels is None else np.ravel(labels))
+
+    def bounds(self):
+        return self.lo, self.hi
+
+    def contains(self, i, x, y, z):
+        lo, hi = self.lo[i], self.hi[i]
+        return (x >= lo[0]) & (x <= hi[0]) & (y >= lo[1]) & (y <= hi[1]) & (z >= lo[2]) & (z <= hi[2])
+
+    def intervals(self, origins, directions):
+        t0, t1 = _slab(origins[:, None, :], directions[:, None, :], self.lo[None], self.hi[None])
+        return t0.max(axis=-1), t1.min(axis=-1)
+
+    def scaled(self, factor):
+        return Boxes(self.lo * factor, self.hi * factor, self.labels)
+
+
+class Scene():
+    """A union of disjoint primitives, optionally clipped by a box.
+
+    With subtract=False, the primitives are intersected with the clip box
+    (like plate() * star in phantoms.py), otherwise they are holes cut in
+    the box, which is then made of material label (like plate() - star).
+    """
+
+    def __init__(self, shapes:Sequence[Primitives], clip:Optional[Boxes]=None, subtract:bool=False, label:int=0):
+        if subtract and clip is None:
+            raise ValueError("Subtracting primitives needs a clip box to subtract them from")
+        self.shapes = list(shapes)
+        self.clip = clip
+        self.subtract = subtract
+        self.label = label
+
+    @property
+    def n_labels(self) -> int:
+        labels = [shape.labels.max(initial=-1) for shape in self.shapes]
+        if self.subtract:
+            labels.append(self.label)
+        return int(max(labels, default=-1)) + 1
+
+    def scaled(self, factor:float) -> "Scene":
+        return Scene([shape.scaled(factor) for shape in self.shapes],
+            self.clip.scaled(factor) if self.clip is not None else None, self.subtract, self.label)
+
+
+def plate(scale:float=1) -> Boxes:
+    """The box of phantoms.plate()."""
+    half = np.array([scale, scale, 0.1]) / 2
+    return Boxes(-half, half)
+
+
+def shapes(phantom) -> Primitives:
+    """The primitives of a phantom of phantoms.py, labelled with its materials."""
+
+    if phantom.kind == "spheres":
+        return Spheres(phantom.centres, phantom.radii, phantom.materials)
+    if phantom.kind == "cylinders":
+        return Cylinders(phantom.centres, phantom.radii, phantom.height, phantom.materials)
+    if phantom.kind == "sectors":
+        return Prisms(phantom.vertices, phantom.height, phantom.materials)
+    raise ValueError(f"Unknown kind of phantom '{phantom.kind}'")
+
+
+def scene(phantom, with_plate:Optional[str]=None, scale:float=1) -> Scene:
+    """The scene of a phantom, as exported by phantoms.py.
+
+    Args:
+        phantom (phantoms.Phantom): The phantom.
+        with_plate (str, optional): "subtract" for plate() - phantom, "intersect" for plate() * phantom.
+        scale (float): Scale of the exported geometry, 100 for the STL files in mm.
+    """
+
+    if with_plate not in (None, "subtract", "intersect"):
+        raise ValueError(f"with_plate must be None, 'subtract' or 'intersect', got '{with_plate}'")
+
+    clip = plate() if with_plate is not None else None
+    return Scene([shapes(phantom)], clip, with_plate == "subtract").scaled(scale)
+
+
+def path_lengths(scene:Scene, origins:np.ndarray, directions:np.ndarray,
+        t_range:Tuple[float, float]=(-np.inf, np.inf), batch:int=8192) -> np.ndarray:
+    """Length of the rays in each material.
+
+    Args:
+        scene (Scene): The scene.
+        origins (np.ndarray): R x 3 origins of the rays.
+        directions (np.ndarray): R x 3 unit directions.
+        t_range (Tuple[float, float]): Part of the rays to integrate over, or broadcastable arrays of them.
+        batch (int): Rays processed at once, to bound the size of the rays x primitives temporaries.
+
+    Returns:
+        np.ndarray: n_labels x R path lengths.
+    """
+
+    origins = np.asarray(origins, dtype=np.double).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=np.double).reshape(-1, 3)
+    t_min = np.broadcast_to(t_range[0], len(origins))
+    t_max = np.broadcast_to(t_range[1], len(origins))
+    lengths = np.zeros((scene.n_labels, len(origins)))
+
+    for start in range(0, len(origins), batch):
+        o = origins[start:start + batch]
+        d = directions[start:start + batch]
+        lo = t_min[start:start + batch].astype(np.double)
+        hi = t_max[start:start + batch].astype(np.double)
+
+        if scene.clip is not None:
+            c0, c1 = scene.clip.intervals(o, d)
+            lo = np.maximum(lo, c0[:, 0])
+            hi = np.minimum(hi, c1[:, 0])
+
+        sign = -1 if scene.subtract else 1
+        if scene.subtract:
+            lengths[scene.label, start:start + batch] += np.clip(hi - lo, 0, None)
+
+        for shape in scene.shapes:
+            t0, t1 = shape.intervals(o, d)
+            inside = np.clip(np.minimum(t1, hi[:, None]) - np.maximum(t0, lo[:, None]), 0, None)
+            if scene.subtract:
+                lengths[scene.label, start:start + batch] -= inside.sum(axis=1)
+            else:
+                # Sum the primitives of each label
+                np.add.at(lengths[:, start:start + batch], shape.labels, inside.T)
+
+    return lengths
+
+
+def _weights(scene:Scene, mu) -> np.ndarray:
+    return np.broadcast_to(np.asarray(mu, dtype=np.double), (scene.n_labels,))
+
+
+def _detector(shape:Tuple[int, int], pixel_size:float) -> Tuple[np.ndarray, np.ndarray]:
+    rows, cols = shape
+    v = (np.arange(rows) - (rows - 1) / 2) * pixel_size
+    u = (np.arange(cols) - (cols - 1) / 2) * pixel_size
+    return np.meshgrid(u, v)
+
+
+def _finish(integrals:np.ndarray, transmission:bool, out:Optional[np.ndarray]) -> np.ndarray:
+    if transmission:
+        integrals = np.exp(-integrals)
+    if out is None:
+        return integrals.astype(np.single)
+    out[...] = integrals
+    return out
+
+
+def project_parallel(scene:Scene,
+        angles:Sequence[float],
+        shape:Tuple[int, int],
+        pixel_size:float,
+        mu=1.0,
+        transmission:bool=False,
+        out:Optional[np.ndarray]=None) -> np.ndarray:
+    """Exact parallel-beam projections of a scene.
+
+    Args:
+        scene (Scene): The scene.
+        angles (Sequence[float]): Angles in degrees.
+        shape (Tuple[int, int]): Rows and columns of the detector.
+        pixel_size (float): Pixel size, in the unit of the scene.
+        mu (float|Sequence[float]): Attenuation coefficient of each material.
+        transmission (bool): Return exp(-line integral) instead of the line integrals.
+        out (np.ndarray, optional): Output array, angle x rows x columns.
+
+    Returns:
+        np.ndarray: angle x rows x columns line integrals (or transmissions).
+    """
+
+    u, v = _detector(shape, pixel_size)
+    weights = _weights(scene, mu)
+    integrals = np.empty((len(angles), *shape))
+
+    for a, beta in enumerate(np.radians(angles)):
+        # The detector in the frame of the sample, which is rotated by -beta
+        c, s = np.cos(beta), np.sin(beta)
+        origins = np.stack((u * c, -u * s, v), axis=-1).reshape(-1, 3)
+        directions = np.broadcast_to((-s, -c, 0.0), origins.shape)
+        integrals[a] = (weights @ path_lengths(scene, origins, directions)).reshape(shape)
+
+    return _finish(integrals, transmission, out)
+
+
+def project_cone(scene:Scene,
+        angles:Sequence[float],
+        shape:Tuple[int, int],
+        pixel_size:float,
+        source_pos:Sequence[float],
+        detector_pos:Sequence[float],
+        mu=1.0,
+        transmission:bool=False,
+        out:Optional[np.ndarray]=None) -> np.ndarray:
+    """Exact cone-beam projections of a scene, on the circular orbit of recon_engine.fdk_cone().
+
+    Args:
+        source_pos (Sequence[float]): Position of the source.
+        detector_pos (Sequence[float]): Position of the centre of the detector.
+
+    See project_parallel() for the other arguments.
+    """
+
+    sod, sdd = recon_engine.cone_distances(source_pos, detector_pos)
+    u, v = _detector(shape, pixel_size)
+    weights = _weights(scene, mu)
+    integrals = np.empty((len(angles), *shape))
+
+    # Rays from the source to the pixels, integrated between the two
+    rays = np.stack((u, np.full(u.shape, -sdd), v), axis=-1).reshape(-1, 3)
+    length = np.linalg.norm(rays, axis=1)
+    rays /= length[:, None]
+
+    for a, beta in enumerate(np.radians(angles)):
+        c, s = np.cos(beta), np.sin(beta)
+        rotation = np.array([[c, s, 0], [-s, c, 0], [0, 0, 1]])
+        origin = rotation @ (0, sod, 0)
+        directions = rays @ rotation.T
+        origins = np.broadcast_to(origin, directions.shape)
+        integrals[a] = (weights @ path_lengths(scene, origins, directions, (0, length))).reshape(shape)
+
+    return _finish(integrals, transmission, out)
+
+
+def _voxel_range(lo:float, hi:float, n:int, voxel_size:float) -> Tuple[int, int]:
+    # Voxels overlapping [lo, hi], voxel k covering (k - n / 2) * voxel_size + [0, voxel_size]
+    start = int(np.clip(np.floor(lo / voxel_size + n / 2), 0, n))
+    stop = int(np.clip(np.floor(hi / voxel_size + n / 2) + 1, 0, n))
+    return start, stop
+
+
+def _fractions(scene:Scene, shape:Primitives, i:int, ranges, n:Tuple[int, int, int], voxel_size:float, supersample:int) -> np.ndarray:
+    """Fraction of the voxels in ranges (z, y, x) inside primitive i (and the clip box)."""
+
+    coords = []
+    for (start, stop), size in zip(ranges, n):
+        fine = np.arange(start * supersample, stop * supersample)
+        coords.append(((fine + 0.5) / supersample - size / 2) * voxel_size)
+
+    z, y, x = coords[0][:, None, None], coords[1][None, :, None], coords[2][None, None, :]
+    inside = shape.contains(i, x, y, z)
+    if scene.clip is not None and shape is not scene.clip:
+        inside = inside & scene.clip.contains(0, x, y, z)
+
+    s = supersample
+    nz, ny, nx = (stop - start for start, stop in ranges)
+    return inside.reshape(nz, s, ny, s, nx, s).mean(axis=(1, 3, 5))
+
+
+def voxelize(scene:Scene,
+        shape:Tuple[int, int, int],
+        voxel_size:float,
+        mu=1.0,
+        supersample:int=1,
+        out=None,
+        chunk_slices:int=32) -> np.ndarray|Path:
+    """Voxelise a scene, a chunk of slices at a time.
+
+    Only the voxels in the bounding box of each primitive are tested. With
+    supersample > 1, each voxel holds the fraction of supersample ** 3 points
+    that are inside, which approximates partial volumes.
+
+    Args:
+        scene (Scene): The scene.
+        shape (Tuple[int, int, int]): Slices, rows (y) and columns (x) of the volume.
+        voxel_size (float): Voxel size, in the unit of the scene.
+        mu (float|Sequence[float]): Value of each material, e.g. its attenuation coefficient.
+        supersample (int): Points per voxel along each axis.
+        out (np.ndarray|str, optional): Output array (e.g. a memory map), or file name of a volume store.
+        chunk_slices (int): Slices computed at once.
+
+    Returns:
+        np.ndarray|Path: The float32 volume, or the file name of the volume store.
+    """
+
+    shape = tuple(shape)
+    weights = _weights(scene, mu)
+
+    writer = None
+    if out is None:
+        volume = np.zeros(shape, dtype=np.single)
+        result = volume
+    elif isinstance(out, (str, Path)):
+        writer = projection_store.create(out, shape, geometry={"type": "volume", "voxel_size": voxel_size})
+        volume = writer.stack
+        result = Path(out)
+    else:
+        volume = out
+        result = out
+
+    # The primitives, their weights and the bounding boxes of their kind (computed once), the clip box
+    # first when the others are cut out of it
+    items = []
+    if scene.subtract:
+        items.append((scene.clip, 0, weights[scene.label], scene.clip.bounds()))
+    for primitives in scene.shapes:
+        bounds = primitives.bounds()
+        for i in range(len(primitives)):
+            weight = -weights[scene.label] if scene.subtract else weights[primitives.labels[i]]
+            items.append((primitives, i, weight, bounds))
+
+    # Voxel ranges of the bounding boxes, (z, y, x)
+    boxes = []
+    for primitives, i, weight, (lo, hi) in items:
+        ranges = [_voxel_range(lo[i, axis], hi[i, axis], size, voxel_size) for axis, size in zip((2, 1, 0), shape)]
+        if weight != 0 and all(r0 < r1 for r0, r1 in ranges):
+            boxes.append((primitives, i, weight, ranges))
+
+    try:
+        for start in range(0, shape[0], chunk_slices):
+            stop = min(start + chunk_slices, shape[0])
+            chunk = np.zeros((stop - start, *shape[1:]))
+
+            for primitives, i, weight, ((z0, z1), (y0, y1), (x0, x1)) in boxes:
+                z0, z1 = max(z0, start), min(z1, stop)
+                if z0 >= z1:
+                    continue
+
+                fractions = _fractions(scene, primitives, i, ((z0, z1), (y0, y1), (x0, x1)), shape, voxel_size, supersample)
+                chunk[z0 - start:z1 - start, y0:y1, x0:x1] += weight * fractions
+
+            volume[start:stop] = chunk
+            if writer is not None:
+                writer.mark_written(slice(start, stop))
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        writer.close()
+    return result
@@ -1,12 +1,28 @@
 from pathlib import Path
 from typing import Tuple, cast
 import numpy as np
-import solid as scad
 import os
-from subprocess import run
+from subprocess import run, CalledProcessError
+
+# SolidPython is only needed for the CSG trees, phantom_raster works from the primitive arrays
+try:
+	import solid as scad
+except ImportError:
+	scad = None
 
 class Phantom():
-	geometry: scad.OpenSCADObject
+	"""A phantom, as a SolidPython CSG tree and as arrays of primitives.
+
+	The primitives are in the coordinates of the geometry (before the
+	scaling to mm done when exporting): centres (N x 3), radii (in the order
+	of the centres once flattened) and materials (an integer per primitive).
+	See phantom_raster for voxelisation and analytic projections.
+	"""
+	geometry: "scad.OpenSCADObject"
+	kind: str = "spheres"
+	centres: np.ndarray
+	radii: np.ndarray
+	materials: np.ndarray
 
 class RandomSpheres(Phantom):
 	"""Generates a phantom of randomly placed spheres in a jittered grid."""
@@ -30,12 +46,13 @@ class RandomSpheres(Phantom):
 		# jutter by random amount
 		jitters = radius * (np.random.rand(2, spheres) - 0.5) * 2
 
+		self.centres = np.stack((x[:spheres] + jitters[0], y[:spheres] + jitters[1], np.zeros(spheres)), axis=1)
+		self.radii = np.full(spheres, radius)
+		self.materials = np.zeros(spheres, dtype=int)
+
 		# place the circles
-		geo = scad.translate((x[0] + jitters[0, 0], y[0] + jitters[1, 0], 0))(scad.sphere(radius))
-		for i in range(1, spheres):
-			center = (x[i] + jitters[0, i], y[i] + jitters[1, i], 0)
-			geo += scad.translate(center)(scad.sphere(radius))
-		self.geometry = geo
+		if scad is not None:
+			self.geometry = scad.union()(*[scad.translate(tuple(c))(scad.sphere(radius)) for c in self.centres])
 
 def dogaPoints(n_sizes=8, size_ratio=0.5, n_shuffles=8) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
 		# Seed a latin square, use integers to prevent rounding errors
@@ -55,144 +72,169 @@ def dogaPoints(n_sizes=8, size_ratio=0.5, n_shuffles=8) -> Tuple[np.ndarray, np.
 
 		return (radii, x, y)
 
+def _dogaCentres(x, y) -> np.ndarray:
+	# Centres of the flattened grid, translated like the geometry
+	return np.stack((np.ravel(x) - 0.5, np.ravel(y) - 0.5, np.zeros(x.size)), axis=1)
+
 class DogaSpheres(Phantom):
 	def __init__(self, n_sizes=5, size_ratio=0.5, n_shuffles=5, res=20):
 		radii, _x, _y = dogaPoints(n_sizes, size_ratio, n_shuffles)
 		print(radii)
-		geo = None
-		for (k, x, y) in zip(radii.flatten(), _x.flatten(), _y.flatten()):
-			if geo is None:
-				geo = scad.translate((x, y, 0))(scad.sphere(k,segments=res))
-			else:
-				geo += scad.translate((x, y, 0))(scad.sphere(k,segments=res))
-
-		assert geo
 
 		self.radii = radii
 		self.x = _x
 		self.y = _y
-		self.geometry = scad.translate((-0.5, -0.5, 0))(geo)
+		self.centres = _dogaCentres(_x, _y)
+		self.materials = np.zeros(radii.size, dtype=int)
+
+		if scad is not None:
+			geo = scad.union()(*[scad.translate((x, y, 0))(scad.sphere(k,segments=res))
+				for (k, x, y) in zip(radii.flatten(), _x.flatten(), _y.flatten())])
+			self.geometry = scad.translate((-0.5, -0.5, 0))(geo)
 
 class RandomMatSpheres(DogaSpheres):
 	def __init__(self, size=1, n_sizes=5, size_ratio=0.5, n_shuffles=5, res=20):
 		radii, _x, _y = dogaPoints(n_sizes, size_ratio, n_shuffles)
 		rads = np.unique(radii)
 
-		spheres = []
-		for i in range(0, rads.shape[0]):
-			spheres.append(None)
-
-		for (k, x, y) in zip(radii.flatten(), _x.flatten(), _y.flatten()):
-			i = int(np.where(rads == k)[0])
-			if spheres[i] is None:
-				spheres[i] = scad.translate((x, y, 0))(scad.sphere(k,segments=res))
-			else:
-				spheres[i] += scad.translate((x, y, 0))(scad.sphere(k,segments=res))
-
-		for i, sphere in enumerate(spheres):
-			spheres[i] = scad.translate((-0.5, -0.5, 0))(sphere)
-
-		self.spheres = spheres
 		self.radii = radii
 		self.x = _x
 		self.y = _y
+		self.centres = _dogaCentres(_x, _y)
+
+		# One material per sphere size
+		self.materials = np.searchsorted(rads, radii.flatten())
+
+		if scad is not None:
+			spheres = []
+			for i in range(0, rads.shape[0]):
+				spheres.append(scad.union()(*[scad.translate((x, y, 0))(scad.sphere(k,segments=res))
+					for (k, x, y) in zip(radii.flatten()[self.materials == i], _x.flatten()[self.materials == i], _y.flatten()[self.materials == i])]))
+
+			for i, sphere in enumerate(spheres):
+				spheres[i] = scad.translate((-0.5, -0.5, 0))(sphere)
+
+			self.spheres = spheres
 
 class DogaCircles(Phantom):
+	kind = "cylinders"
+
 	def __init__(self, n_sizes=5, size_ratio=0.5, n_shuffles=5,res=20):
 		radii, _x, _y = dogaPoints(n_sizes, size_ratio, n_shuffles)
 
-		geo = None # ? Anyone know a way to create an empty scad object?
-		for (k, x, y) in zip(radii.flatten(), _x.flatten(), _y.flatten()):
-			if geo is None:
-				geo = scad.translate((x, y, 0))(scad.linear_extrude(100)(scad.circle(k,segments=res)))
-			else:
-				geo += scad.translate((x, y, 0))(scad.linear_extrude(100)(scad.circle(k,segments=res)))
-
-		assert geo
-
 		self.radii = radii
 		self.x = _x
 		self.y = _y
+		self.centres = _dogaCentres(_x, _y)
+		self.materials = np.zeros(radii.size, dtype=int)
+
+		# Extent of the extruded circles along z
+		self.height = (0, 100)
 
-		self.geometry = scad.translate((-0.5, -0.5, 0))(geo)
+		if scad is not None:
+			geo = scad.union()(*[scad.translate((x, y, 0))(scad.linear_extrude(100)(scad.circle(k,segments=res)))
+				for (k, x, y) in zip(radii.flatten(), _x.flatten(), _y.flatten())])
+			self.geometry = scad.translate((-0.5, -0.5, 0))(geo)
 
 class SiemensStar(Phantom):
+	kind = "sectors"
+
 	def __init__(self, n_sectors=2, radius=0.5):
 		# Number of total points
 		n_points = 2 * n_sectors
 		center = (0, 0)
 
 		# Create even circular points
-		points = []
-		for t in np.linspace(0, 2 * np.pi, n_points, endpoint=False):
-			x = radius * np.cos(t) + center[0]
-			y = radius * np.sin(t) + center[1]
-			points.append((x, y))
-
+		t = np.linspace(0, 2 * np.pi, n_points, endpoint=False)
+		points = np.stack((radius * np.cos(t) + center[0], radius * np.sin(t) + center[1]), axis=1)
 
-		# Extrude first polygon
-		point = (points[2 * 0], points[2 * 0 + 1], center)
-		geo = scad.linear_extrude(100)(scad.polygon(point))
+		# Each sector is the triangle between two consecutive points and the centre
+		self.sector_angles = t.reshape(n_sectors, 2)
+		self.vertices = np.concatenate((points.reshape(n_sectors, 2, 2), np.broadcast_to(center, (n_sectors, 1, 2))), axis=1)
+		self.centres = np.zeros((n_sectors, 3))
+		self.radii = np.full(n_sectors, radius)
+		self.materials = np.zeros(n_sectors, dtype=int)
 
-		# Create n-1 sector extruded polygons
-		for i in range(1, n_sectors):
-			point = (points[2 * i], points[2 * i + 1], center)
-			geo += scad.linear_extrude(100)(scad.polygon(point))
+		# Extent of the extruded sectors along z, translated to ensure they cut the Z axis
+		self.height = (-50, 50)
 
-		# Translate model to ensure it cuts the Z axis
-		geo = scad.translate((0,0,-50))(geo)
-		self.geometry = geo
+		if scad is not None:
+			geo = scad.union()(*[scad.linear_extrude(100)(scad.polygon([tuple(p) for p in sector])) for sector in self.vertices])
+			geo = scad.translate((0,0,-50))(geo)
+			self.geometry = geo
 
 def plate(scale=1):
 	return scad.cube([scale,scale,.1], center=True)
 
 if __name__ == "__main__":
+	import sys
+	import phantom_mesh
 
 	outPath = Path("input_data/phantoms/")
 	os.makedirs(outPath, exist_ok=True)
 	os.makedirs(outPath / "spheres/", exist_ok=True)
 
+	dogaCircles = DogaCircles()
+	dogaSpheresPhantom = DogaSpheres()
+	matSpheres = RandomMatSpheres()
+	siemensStar = SiemensStar(n_sectors=20,radius=0.4)
+	randomSpheres = RandomSpheres()
+
 	# Create a plate with doga holes cutout
-	dogaPlate = plate() - DogaCircles().geometry
+	dogaPlate = plate() - dogaCircles.geometry
 	dogaPlate = scad.scale((100,100,100))(dogaPlate)
 	scad.scad_render_to_file(dogaPlate, outPath / "doga-plate.scad")
 
 	# Create free-standing spheres in a doga formation
-	dogaSpheres = DogaSpheres().geometry
+	dogaSpheres = dogaSpheresPhantom.geometry
 	dogaSpheres = scad.scale((100,100,100))(dogaSpheres)
 	scad.scad_render_to_file(dogaSpheres, outPath / "doga-spheres.scad")
 
 	# Create free-standing spheres split by materials in a doga formation
-	matSpheres = RandomMatSpheres()
 	for i, spheres in enumerate(matSpheres.spheres):
 		spheres = scad.scale((100,100,100))(spheres)
 		scad.scad_render_to_file(spheres, outPath / f"spheres/spheres-{i}.scad")
 
 	# Create a plate with a Siemens star cutout
-	starPlate = plate() - SiemensStar(n_sectors=20,radius=0.4).geometry
+	starPlate = plate() - siemensStar.geometry
 	starPlate = scad.scale((100,100,100))(starPlate)
 	scad.scad_render_to_file(starPlate, outPath / "star-plate.scad")
 
 	# Create a free-standing siemens star
-	star = plate() * SiemensStar(n_sectors=20,radius=0.4).geometry
+	star = plate() * siemensStar.geometry
 	star = scad.scale((100,100,100))(star)
 	scad.scad_render_to_file(star, outPath / "star.scad")
 
 	# Create free-standing random spheres
-	spheres = RandomSpheres().geometry
+	spheres = randomSpheres.geometry
 	spheres = scad.scale((100,100,100))(spheres)
 	scad.scad_render_to_file(spheres, outPath / "spheres.scad")
 
 	print("Scad files created!")
 
-	# If openscad is installed, generate stl files
 	files = [outPath / "doga-plate.scad", outPath / "doga-spheres.scad", outPath / "star-plate.scad", outPath / "star.scad", outPath / "spheres.scad"]
 	files = [Path(x) for x in files]
 
-	# try to call scad on first file
-	try:
-		for i in files:
-			run(f"openscad -i {i} {i.with_suffix('.stl')}")
-	except FileNotFoundError as e:
-		print(f"! Failed to convert scad files to .stl: {e}")
-		print("! You will need to use openscad to convert the files manually.")
+	if "--openscad" in sys.argv:
+		# try to call scad on first file, with an argument list so that no shell is needed
+		try:
+			for i in files:
+				run(["openscad", "-o", str(i.with_suffix('.stl')), str(i)], check=True)
+		except (FileNotFoundError, CalledProcessError) as e:
+			print(f"! Failed to convert scad files to .stl: {e}")
+			print("! You will need to use openscad to convert the files manually.")
+	else:
+		# Tessellate the same phantoms directly, without openscad
+		meshes = {
+			outPath / "doga-plate.stl": phantom_mesh.triangles(dogaCircles, "subtract", res=20)[0],
+			outPath / "doga-spheres.stl": phantom_mesh.triangles(dogaSpheresPhantom, res=20)[0],
+			outPath / "star-plate.stl": phantom_mesh.triangles(siemensStar, "subtract")[0],
+			outPath / "star.stl": phantom_mesh.triangles(siemensStar, "intersect")[0],
+			outPath / "spheres.stl": phantom_mesh.triangles(randomSpheres)[0],
+		}
+		for i, mesh in phantom_mesh.triangles(matSpheres, res=20).items():
+			meshes[outPath / f"spheres/spheres-{i}.stl"] = mesh
+
+		for fname, mesh in meshes.items():
+			phantom_mesh.write_stl(fname, mesh)
+		print("STL files created!")
@@ -0,0 +1,210 @@
+"""Polychromatic images from per-material path-length maps.
+
+The path length of a ray through each material does not depend on the
+energy, so a projection only needs one map per material. The image for a
+whole spectrum is then a contraction over an energies x materials matrix
+of attenuation coefficients:
+
+    image = sum_E w[E] * exp(-sum_m mu[m, E] * L[m])
+
+where w[E] is the number of photons of energy E times the energy recorded
+by the detector for them. Changing the spectrum, the filters or the
+detector response only changes mu or w, so stored maps can be reused for
+spectrum and filter sweeps without simulating again. The matrix mu is a
+material_basis.AttenuationBasis, cached and shared by every model of the
+same materials and energies:
+
+    maps = polychromatic.acquire_path_lengths(projector, angles)
+    for kvp in (60, 80, 100):
+        model = projector.model.with_spectrum(*tube(kvp))
+        images = model.project_stack(maps)
+"""
+
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Tuple
+import numpy as np
+import material_basis
+
+# Pixels contracted at once, which bounds the energies x pixels temporaries
+DEFAULT_CHUNK = 1 << 16
+
+ENERGY_UNITS = {"eV": 1e-3, "keV": 1., "MeV": 1e3}
+
+
+def load_energy_response(fname:str|Path, unit:str="MeV") -> Tuple[np.ndarray, np.ndarray]:
+    """Detector energy response, like gvxr.loadDetectorEnergyResponse.
+
+    Args:
+        fname (str|Path): Text file with the incident and recorded energies in two columns (GATE format).
+        unit (str): Energy unit of the file.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Incident and recorded energies in keV.
+    """
+
+    table = np.loadtxt(fname, dtype=np.double, ndmin=2)
+    return table[:, 0] * ENERGY_UNITS[unit], table[:, 1] * ENERGY_UNITS[unit]
+
+
+def _recorded_energies(energies:np.ndarray, response) -> np.ndarray:
+    if response is None:
+        return energies
+    if callable(response):
+        return np.asarray(response(energies), dtype=np.double)
+    if isinstance(response, (str, Path)):
+        response = load_energy_response(response)
+    incident, recorded = response
+    return np.interp(energies, incident, recorded)
+
+
+@dataclass(frozen=True)
+class SpectralModel():
+    """Spectrum, materials and detector response of a polychromatic projection.
+
+    Energies are in keV, counts are photons per pixel and recorded
+    energies in keV (the energy the detector records for a photon of each
+    energy of the spectrum). The attenuation basis has the same energies.
+    """
+
+    energies:np.ndarray
+    counts:np.ndarray
+    basis:material_basis.AttenuationBasis
+    recorded:np.ndarray
+
+    @classmethod
+    def from_materials(cls, materials:Sequence, densities:Optional[Sequence[Optional[float]]], energies:Sequence[float], counts:Sequence[float],
+            response:Optional[str|Path|Tuple[np.ndarray, np.ndarray]|Callable]=None) -> "SpectralModel":
+        """Create a model from materials.
+
+        Args:
+            materials (Sequence): Element symbols, formulas, NIST compound names, JSON material lists
+                or material_basis.Material objects.
+            densities (Sequence[float], optional): Densities in g/cm3, None for the tabulated ones
+                (or those of the Material objects).
+            energies (Sequence[float]): Energies of the spectrum in keV.
+            counts (Sequence[float]): Number of photons at each energy.
+            response (optional): Detector energy response, as a file name, the arrays returned by
+                load_energy_response or a function of the energy (keV). Defaults to a perfect detector.
+        """
+
+        if densities is None:
+            densities = [None] * len(materials)
+        materials = [material_basis.resolve(m, d) for m, d in zip(materials, densities)]
+        energies = np.atleast_1d(np.asarray(energies, dtype=np.double))
+        return cls(energies, np.atleast_1d(np.asarray(counts, dtype=np.double)), material_basis.basis(materials, energies),
+            _recorded_energies(energies, response))
+
+    @property
+    def materials(self) -> Tuple[str, ...]:
+        return self.basis.names
+
+    @property
+    def densities(self) -> np.ndarray:
+        return self.basis.densities
+
+    @property
+    def mass_attenuation(self) -> np.ndarray:
+        """Mass attenuation coefficients (cm2/g), materials x energies."""
+        return self.basis.mass_attenuation.T
+
+    @property
+    def linear_attenuation(self) -> np.ndarray:
+        """Linear attenuation coefficients (cm-1), materials x energies."""
+        return self.basis.linear_attenuation.T
+
+    @property
+    def weights(self) -> np.ndarray:
+        """Energy (MeV) recorded for the photons of each energy of the spectrum."""
+        return self.counts * self.recorded * 1e-3
+
+    def flat_field(self) -> float:
+        """Value of an unattenuated pixel, like gvxr.getTotalEnergyWithDetectorResponse."""
+        return float(self.weights.sum())
+
+    def with_spectrum(self, energies:Sequence[float], counts:Sequence[float], response=None) -> "SpectralModel":
+        """The same materials with another spectrum (and detector response)."""
+        return SpectralModel.from_materials(self.basis.materials, None, energies, counts, response)
+
+    def with_response(self, response) -> "SpectralModel":
+        """The same spectrum and materials with another detector response (None for a perfect detector)."""
+        return replace(self, recorded=_recorded_energies(self.energies, response))
+
+    def filtered(self, filters:Sequence[Tuple[str, float]]) -> "SpectralModel":
+        """The spectrum after filters, given as (material, thickness in mm) pairs."""
+
+        if not filters:
+            return self
+        materials, thicknesses = zip(*filters)
+        attenuation = material_basis.basis(materials, self.energies).linear_attenuation
+        exponent = attenuation.astype(np.double) @ (np.asarray(thicknesses, dtype=np.double) * 0.1)
+        return replace(self, counts=self.counts * np.exp(-exponent))
+
+    def project(self, lengths:np.ndarray, out:Optional[np.ndarray]=None, area_density:bool=False, chunk:int=DEFAULT_CHUNK) -> np.ndarray:
+        """Polychromatic image from path-length maps.
+
+        Args:
+            lengths (np.ndarray): Materials x rows x columns path lengths in mm, or area densities
+                in g/cm2 if area_density is True.
+            out (np.ndarray, optional): Rows x columns output array.
+            area_density (bool): Whether lengths are area densities.
+            chunk (int): Number of pixels contracted at once.
+
+        Returns:
+            np.ndarray: The image, energies in MeV.
+        """
+
+        lengths = np.asarray(lengths)
+        if lengths.shape[0] != len(self.materials):
+            raise ValueError(f"Expected maps for {len(self.materials)} materials, got {lengths.shape[0]}")
+
+        # energies x materials, per mm or per g/cm2
+        attenuation = self.basis.mass_attenuation if area_density else self.basis.linear_attenuation * np.single(0.1)
+        weights = self.weights
+
+        flat = lengths.reshape(len(self.materials), -1)
+        image = np.empty(flat.shape[1], dtype=np.double)
+        for start in range(0, flat.shape[1], chunk):
+            block = slice(start, start + chunk)
+            image[block] = weights @ np.exp(-(attenuation @ flat[:, block]))
+
+        image = image.reshape(lengths.shape[1:])
+        if out is None:
+            return image
+        out[...] = image
+        return out
+
+    def project_stack(self, maps:np.ndarray, out:Optional[np.ndarray]=None, **kwargs) -> np.ndarray:
+        """Polychromatic projections from angles x materials x rows x columns maps, see project()."""
+
+        if out is None:
+            out = np.empty((maps.shape[0], *maps.shape[2:]), dtype=np.single)
+        for i in range(maps.shape[0]):
+            self.project(maps[i], out[i], **kwargs)
+        return out
+
+
+def acquire_path_lengths(projector, angles:Sequence[float], out:Optional[np.ndarray]=None,
+        progress:Optional[Callable[[int, int], None]]=None) -> np.ndarray:
+    """Path-length maps (mm) of a scan, to be turned into projections by SpectralModel.project_stack.
+
+    Args:
+        projector: A simulator with path_lengths(), e.g. cpu_projector.CPUProjector.
+        angles (Sequence[float]): Rotation angles in degrees.
+        out (np.ndarray, optional): Preallocated angles x materials x rows x columns array,
+            e.g. from np.lib.format.open_memmap to keep the maps on disk.
+        progress (Callable, optional): Called with (number of angles done, total) after each angle.
+
+    Returns:
+        np.ndarray: The maps.
+    """
+
+    for i, angle in enumerate(angles):
+        projector.set_angle(angle)
+        lengths = projector.path_lengths()
+        if out is None:
+            out = np.empty((len(angles), *lengths.shape), dtype=np.single)
+        out[i] = lengths
+        if progress is not None:
+            progress(i + 1, len(angles))
+    return out
@@ -0,0 +1,29 @@
+"""Helpers for the thread and process pools of the processing pipeline."""
+
+from concurrent.futures import Executor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator
+
+
+def bounded_map(executor:Executor, fn:Callable, tasks:Iterable[tuple], max_pending:int) -> Iterator:
+    """Submit tasks while keeping at most max_pending of them in flight, yield their results as they complete.
+
+    Unlike Executor.map(), the tasks are not all submitted up front, so a long
+    stack is never held in memory as pending results.
+
+    Args:
+        executor (Executor): Thread or process pool.
+        fn (Callable): Function called with the arguments of each task.
+        tasks (Iterable[tuple]): Arguments of the tasks.
+        max_pending (int): Most tasks submitted but not yet yielded.
+    """
+
+    pending = set()
+    for task in tasks:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(fn, *task))
+
+    for future in pending:
+        yield future.result()
@@ -0,0 +1,509 @@
+"""Single-file container for CT projection stacks.
+
+A store holds an angle x rows x columns stack together with everything
+needed to reconstruct it: the angles, the geometry, the units, flat and dark
+fields, and the JSON scene configuration that produced it.
+
+Layout of a file:
+
+- a 64-byte header (magic, version, offset and length of the footer);
+- the data region, starting at DATA_OFFSET:
+    - uncompressed stores keep the stack as one C-contiguous array, which is
+      memory-mapped by readers;
+    - compressed stores keep one zlib chunk per angle and block of rows, in
+      any order, located through a chunk index;
+- auxiliary arrays (flat field, dark field, chunk index), stored raw;
+- a JSON footer with the metadata and the location of every array.
+
+Files are written under a temporary name and renamed once complete.
+
+The geometry is a dictionary. The keys used by the reconstruction code are
+"type" ("parallel" or "cone"), "pixel_size", "source_position" and
+"detector_position", with lengths in mm. geometry_from_config() builds it
+from a JSON scene description.
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+import numpy as np
+
+MAGIC = b"GVXRPROJ"
+VERSION = 1
+HEADER = struct.Struct("<8sIQQ")
+DATA_OFFSET = 4096
+
+DEFAULT_CHUNK_ROWS = 64
+
+# Length units of the JSON scene descriptions, in mm
+UNITS = {"um": 1e-3, "mm": 1., "cm": 10., "dm": 100., "m": 1000.}
+
+
+def _normalise_config(config) -> Optional[dict]:
+    if config is None or isinstance(config, dict):
+        return config
+
+    with open(config) as f:
+        return json.load(f)
+
+
+def to_mm(values:Sequence[float], unit:str) -> list:
+    """Convert lengths to mm."""
+    return [float(v) * UNITS[unit] for v in values]
+
+
+def geometry_from_config(config) -> Dict[str, Any]:
+    """Geometry of a JSON scene description (as a dictionary or a file name)."""
+
+    config = _normalise_config(config)
+    source = config["Source"]
+    detector = config["Detector"]
+
+    return {
+        "type": "parallel" if source.get("Shape") == "Parallel" else "cone",
+        "source_position": to_mm(source["Position"][:3], source["Position"][3]),
+        "detector_position": to_mm(detector["Position"][:3], detector["Position"][3]),
+        "detector_up": detector["UpVector"],
+        "number_of_pixels": detector["NumberOfPixels"],
+        "pixel_size": to_mm(detector["Spacing"][:2], detector["Spacing"][2]),
+        "unit": "mm",
+    }
+
+
+class ProjectionStoreWriter():
+    """Write a projection store.
+
+    Projections can be written in any order with write(index, image), which
+    makes the writer usable by acquisition.acquire(). Uncompressed stores also
+    expose the memory-mapped stack as ``stack`` so that it can be filled in
+    place, e.g. ``acquire(simulator, angles, out=writer.stack)``, after which
+    the projections are recorded with mark_written(). close() fails if some
+    projections were never written.
+    """
+
+    def __init__(self,
+            fname:str|Path,
+            shape:Tuple[int, int, int],
+            dtype=np.single,
+            angles:Optional[Sequence[float]]=None,
+            geometry:Optional[Dict[str, Any]]=None,
+            units:Optional[Dict[str, str]]=None,
+            config=None,
+            compression:Optional[str]=None,
+            level:int=1,
+            chunk_rows:int=DEFAULT_CHUNK_ROWS,
+            flat:Optional[np.ndarray|float]=None,
+            dark:Optional[np.ndarray|float]=None):
+
+        if compression not in (None, "zlib"):
+            raise ValueError(f"Unsupported compression '{compression}'")
+
+        self.fname = Path(fname)
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.level = level
+        self.chunk_rows = min(int(chunk_rows), self.shape[1])
+
+        if angles is not None and len(angles) != self.shape[0]:
+            raise ValueError(f"Got {len(angles)} angles for {self.shape[0]} projections")
+
+        self.metadata = {
+            "shape": self.shape,
+            "dtype": self.dtype.str,
+            "compression": compression,
+            "chunk_rows": self.chunk_rows,
+            "angles": [float(a) for a in angles] if angles is not None else None,
+            "geometry": geometry or {},
+            "units": {"angle": "degree", **(units or {})},
+            "config": _normalise_config(config),
+            "arrays": {},
+        }
+        self._aux = {}
+        self._lock = threading.Lock()
+
+        self.fname.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.fname.with_name(self.fname.name + ".partial")
+        self._file = open(self._tmp, "w+b")
+        self._file.write(b"\0" * DATA_OFFSET)
+
+        self.stack = None
+        if compression is None:
+            self._file.truncate(DATA_OFFSET + self.dtype.itemsize * int(np.prod(self.shape)))
+            self.stack = np.memmap(self._file, dtype=self.dtype, mode="r+", offset=DATA_OFFSET, shape=self.shape)
+            self._written = np.zeros(self.shape[0], dtype=bool)
+        else:
+            n_blocks = -(-self.shape[1] // self.chunk_rows)
+            self._index = np.zeros((self.shape[0], n_blocks, 2), dtype=np.uint64)
+            self._end = DATA_OFFSET
+
+        if flat is not None:
+            self.set_flat(flat)
+        if dark is not None:
+            self.set_dark(dark)
+
+    def write(self, index:int, image:np.ndarray):
+        """Store the projection at an angle index."""
+
+        if np.shape(image) != self.shape[1:]:
+            raise ValueError(f"Projection has shape {np.shape(image)}, expected {self.shape[1:]}")
+
+        if self.stack is not None:
+            # Nothing to do if the projection was rendered in place
+            if not np.may_share_memory(image, self.stack[index]):
+                self.stack[index] = image
+            self._written[index] = True
+            return
+
+        image = np.ascontiguousarray(image, dtype=self.dtype)
+
+        # Compress outside the lock, only the append is serialised
+        chunks = [zlib.compress(image[start:start + self.chunk_rows].tobytes(), self.level)
+            for start in range(0, self.shape[1], self.chunk_rows)]
+
+        with self._lock:
+            self._file.seek(self._end)
+            for block, chunk in enumerate(chunks):
+                self._file.write(chunk)
+                self._index[index, block] = (self._end, len(chunk))
+                self._end += len(chunk)
+
+    def write_rows(self, index:int, start:int, rows:np.ndarray):
+        """Store a band of rows of the projection at an angle index (uncompressed stores only)."""
+
+        if self.stack is None:
+            raise ValueError("Partial projections can only be written to uncompressed stores")
+        self.stack[index, start:start + rows.shape[0]] = rows
+        self._written[index] = True
+
+    def mark_written(self, index:int|slice|Sequence[int]):
+        """Record projections filled in place, through ``stack`` or stack_location(), as written."""
+
+        if self.stack is None:
+            raise ValueError("Only uncompressed stores can be written in place")
+        self._written[index] = True
+
+    def stack_location(self) -> Tuple[Path, int]:
+        """File and offset of the stack of an uncompressed store, so that other processes can write projections in place."""
+
+        if self.stack is None:
+            raise ValueError("Only uncompressed stores can be written in place")
+        return self._tmp, DATA_OFFSET
+
+    def set_array(self, name:str, array:np.ndarray):
+        """Attach an auxiliary array, e.g. "flat" or "dark"."""
+        if self._file is None:
+            raise ValueError(f"{self.fname} is already closed")
+        self._aux[name] = np.ascontiguousarray(array)
+
+    def set_flat(self, flat:np.ndarray|float):
+        self.set_array("flat", np.asarray(flat, dtype=self.dtype))
+
+    def set_dark(self, dark:np.ndarray|float):
+        self.set_array("dark", np.asarray(dark, dtype=self.dtype))
+
+    def _append_array(self, name:str, array:np.ndarray):
+        offset = self._file.seek(0, os.SEEK_END)
+        # Keep raw arrays aligned so that they can be memory-mapped
+        padding = -offset % 64
+        self._file.write(b"\0" * padding)
+        self._file.write(array.tobytes())
+        self.metadata["arrays"][name] = {
+            "offset": offset + padding,
+            "shape": array.shape,
+            "dtype": array.dtype.str,
+        }
+
+    def close(self):
+        """Write the metadata and move the file to its final name."""
+
+        if self._file is None:
+            return
+
+        if self.stack is not None:
+            if not np.all(self._written):
+                raise RuntimeError(f"Some projections of {self.fname} were never written")
+            self.stack.flush()
+            del self.stack
+            self.stack = None
+        else:
+            if not np.all(self._index[:, :, 1]):
+                raise RuntimeError(f"Some projections of {self.fname} were never written")
+            self._append_array("index", self._index)
+
+        for name, array in self._aux.items():
+            self._append_array(name, array)
+
+        footer = json.dumps(self.metadata).encode()
+        footer_offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(footer)
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, footer_offset, len(footer)))
+        self._file.close()
+        self._file = None
+
+        os.replace(self._tmp, self.fname)
+
+    def abort(self):
+        """Discard the partially written file."""
+
+        if self._file is None:
+            return
+        self.stack = None
+        self._file.close()
+        self._file = None
+        self._tmp.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _read_metadata(fname:Path) -> dict:
+    with open(fname, "rb") as f:
+        magic, version, footer_offset, footer_length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{fname} is not a projection store")
+        if version > VERSION:
+            raise ValueError(f"{fname} uses version {version} of the format, this reader supports up to {VERSION}")
+        f.seek(footer_offset)
+        return json.loads(f.read(footer_length))
+
+
+class ProjectionStore():
+    """Read a projection store.
+
+    Nothing is loaded upfront: uncompressed stacks are memory-mapped and
+    compressed stacks decode only the chunks that are accessed (with a small
+    LRU cache of decoded chunks). Indexing follows NumPy's basic indexing on
+    the angle x rows x columns stack, e.g. ``store[10]`` is a projection and
+    ``store[:, 100]`` is the sinogram of row 100.
+    """
+
+    def __init__(self, fname:str|Path, cache_size:int=256):
+        self.fname = Path(fname)
+        self.metadata = _read_metadata(self.fname)
+
+        self.shape = tuple(self.metadata["shape"])
+        self.dtype = np.dtype(self.metadata["dtype"])
+        self.compression = self.metadata["compression"]
+        self.chunk_rows = self.metadata["chunk_rows"]
+        self.geometry = self.metadata["geometry"]
+        self.units = self.metadata["units"]
+        self.config = self.metadata["config"]
+
+        angles = self.metadata["angles"]
+        self.angles = np.asarray(angles, dtype=np.double) if angles is not None else None
+
+        self._stack = None
+        self._index = None
+        self._chunks = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+        if self.compression is None:
+            self._stack = np.memmap(self.fname, dtype=self.dtype, mode="r", offset=DATA_OFFSET, shape=self.shape)
+        else:
+            self._index = self.array("index")
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.dtype.itemsize * int(np.prod(self.shape))
+
+    def array(self, name:str) -> Optional[np.ndarray]:
+        """Memory-mapped auxiliary array, or None if the store does not have it."""
+
+        info = self.metadata["arrays"].get(name)
+        if info is None:
+            return None
+        return np.memmap(self.fname, dtype=np.dtype(info["dtype"]), mode="r", offset=info["offset"], shape=tuple(info["shape"]))
+
+    @property
+    def flat(self) -> Optional[np.ndarray]:
+        return self.array("flat")
+
+    @property
+    def dark(self) -> Optional[np.ndarray]:
+        return self.array("dark")
+
+    def _chunk(self, angle:int, block:int) -> np.ndarray:
+        key = (angle, block)
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is not None:
+                self._chunks.move_to_end(key)
+                return chunk
+
+        offset, length = (int(x) for x in self._index[angle, block])
+        with open(self.fname, "rb") as f:
+            f.seek(offset)
+            data = zlib.decompress(f.read(length))
+
+        start = block * self.chunk_rows
+        rows = min(self.chunk_rows, self.shape[1] - start)
+        chunk = np.frombuffer(data, dtype=self.dtype).reshape(rows, self.shape[2])
+
+        with self._lock:
+            self._chunks[key] = chunk
+            while len(self._chunks) > self._cache_size:
+                self._chunks.popitem(last=False)
+        return chunk
+
+    def _read(self, angles:range, rows:range) -> np.ndarray:
+        """Decode a block of the stack with a step of one along rows."""
+
+        out = np.empty((len(angles), len(rows), self.shape[2]), dtype=self.dtype)
+        if len(rows) == 0:
+            return out
+
+        first_block = rows.start // self.chunk_rows
+        last_block = (rows.stop - 1) // self.chunk_rows
+        for i, angle in enumerate(angles):
+            for block in range(first_block, last_block + 1):
+                block_start = block * self.chunk_rows
+                chunk = self._chunk(angle, block)
+                lo = max(rows.start, block_start)
+                hi = min(rows.stop, block_start + chunk.shape[0])
+                out[i, lo - rows.start:hi - rows.start] = chunk[lo - block_start:hi - block_start]
+        return out
+
+    def __getitem__(self, key) -> np.ndarray:
+        if self._stack is not None:
+            return self._stack[key]
+
+        key = np.index_exp[key]
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (3 - len(key) + 1) + key[i + 1:]
+        key = key + (slice(None),) * (3 - len(key))
+
+        if len(key) != 3 or not all(isinstance(k, (int, np.integer, slice)) for k in key):
+            raise IndexError("Compressed projection stores only support basic indexing")
+
+        # Turn integers into slices so that a block can be read, then squeeze them back
+        ranges = []
+        squeeze = []
+        for axis, k in enumerate(key):
+            n = self.shape[axis]
+            if isinstance(k, slice):
+                ranges.append(range(*k.indices(n)))
+            else:
+                k = int(k) + n if k < 0 else int(k)
+                if not 0 <= k < n:
+                    raise IndexError(f"Index {k} is out of bounds for axis {axis} with size {n}")
+                ranges.append(range(k, k + 1))
+                squeeze.append(axis)
+
+        angles, rows, cols = ranges
+        contiguous_rows = range(min(rows), max(rows) + 1) if len(rows) else range(0)
+        block = self._read(angles, contiguous_rows)
+        if rows.step != 1:
+            block = block[:, np.asarray(rows, dtype=np.intp) - contiguous_rows.start]
+        if cols.step == 1:
+            block = block[:, :, cols.start:cols.stop]
+        else:
+            block = block[:, :, np.asarray(cols, dtype=np.intp)]
+
+        return block.squeeze(axis=tuple(squeeze)) if squeeze else block
+
+    def projection(self, index:int) -> np.ndarray:
+        """Projection at an angle index (rows x columns)."""
+        return self[index]
+
+    def sinogram(self, row:int) -> np.ndarray:
+        """Sinogram of a detector row (angles x columns)."""
+        return self[:, row]
+
+    def rows(self, start:int, stop:int) -> np.ndarray:
+        """Slab of sinograms (angles x rows x columns)."""
+        return self[:, start:stop]
+
+    def iter_projections(self, batch:int=16):
+        """Yield (start index, block of projections) with a bounded memory footprint."""
+        for start in range(0, self.shape[0], batch):
+            yield start, self[start:start + batch]
+
+    def as_array(self) -> np.ndarray:
+        """The whole stack: a memory map if uncompressed, decoded in memory otherwise."""
+        return self._stack if self._stack is not None else self[:]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.as_array()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def min(self) -> float:
+        """Smallest value of the stack, streamed one batch of projections at a time."""
+        return min(float(block.min()) for _, block in self.iter_projections())
+
+    def max(self) -> float:
+        """Largest value of the stack, streamed one batch of projections at a time."""
+        return max(float(block.max()) for _, block in self.iter_projections())
+
+
+def create(fname:str|Path, shape:Tuple[int, int, int], **kwargs) -> ProjectionStoreWriter:
+    """Create a projection store, see ProjectionStoreWriter for the arguments."""
+    return ProjectionStoreWriter(fname, shape, **kwargs)
+
+
+def open_store(fname:str|Path, **kwargs) -> ProjectionStore:
+    """Open a projection store for reading."""
+    return ProjectionStore(fname, **kwargs)
+
+
+def save(fname:str|Path, projections:np.ndarray, **kwargs) -> Path:
+    """Write an in-memory stack to a projection store."""
+
+    with ProjectionStoreWriter(fname, projections.shape, dtype=kwargs.pop("dtype", projections.dtype), **kwargs) as writer:
+        for i, projection in enumerate(projections):
+            writer.write(i, projection)
+    return Path(fname)
+
+
+def sorted_by_index(files:Sequence[str|Path]) -> list:
+    """Sort file names by the last number they contain, e.g. scan_2.tif before scan_10.tif."""
+
+    def index(f):
+        numbers = re.findall(r"\d+", Path(f).stem)
+        return (int(numbers[-1]) if numbers else -1, str(f))
+
+    return sorted(files, key=index)
+
+
+def from_tiffs(fname:str|Path, files:Sequence[str|Path], **kwargs) -> Path:
+    """Pack a list of single-projection TIFF files, in angle order, into a projection store."""
+
+    import tifffile as tf
+
+    first = tf.imread(files[0])
+    shape = (len(files), *first.shape)
+    with ProjectionStoreWriter(fname, shape, dtype=kwargs.pop("dtype", first.dtype), **kwargs) as writer:
+        writer.write(0, first)
+        for i, f in enumerate(files[1:], 1):
+            writer.write(i, tf.imread(f))
+    return Path(fname)
+
+
+def as_stack(projections) -> np.ndarray|ProjectionStore:
+    """Open a path as a projection store, pass stores and arrays through."""
+
+    if isinstance(projections, (str, Path)):
+        return ProjectionStore(projections)
+    return projections
@@ -0,0 +1,421 @@
+"""Headless, slab-parallel FBP and FDK reconstruction in NumPy.
+
+Parallel-beam sinograms of different detector rows are independent, so the
+volume is reconstructed in slabs of rows, concurrently, and each slab only
+needs its own rows of the projections. Cone-beam slabs of slices need a
+band of detector rows that is padded according to the cone angle. Slabs are
+read from arrays or projection stores and can be streamed to a volume store
+on disk, so the memory footprint is bounded by the slab size and the number
+of workers.
+
+Conventions:
+
+- projections are angle x rows x columns, angles in degrees;
+- volumes are slices x y x x, with slice k at the height of detector row k
+  (at the isocentre for cone beams) and x along the detector columns at
+  angle 0; the projections of a store holding a detector ROI give the
+  slices of its rows, centred on the full detector;
+- the sample turns counterclockwise around the z axis (the detector's up
+  vector) by the angle, like gvxr.rotateScene with a positive angle;
+- lengths are in the unit of pixel_size, attenuation coefficients in its
+  inverse;
+- cone beams follow a circular orbit around the z axis through the origin,
+  with the source on the +y side at angle 0 and the detector centre
+  opposite.
+
+Nothing is plotted.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import os
+import numpy as np
+import detector
+import flatfield
+import pools
+import projection_store
+import tracing
+
+FILTERS = ("ram-lak", "shepp-logan", "cosine", "hann")
+
+# Memory allowed for the slabs being processed, in bytes
+DEFAULT_MAX_MEMORY = 2 * 1024 ** 3
+
+
+@lru_cache(maxsize=32)
+def ramp_filter(n_cols:int, pixel_size:float, filter:str="ram-lak") -> Tuple[np.ndarray, int]:
+    """Frequency response of the ramp filter for rows of n_cols pixels.
+
+    The filter is the FFT of the band-limited spatial ramp kernel (which
+    keeps the DC term right), zero-padded to at least twice the row length to
+    avoid wrap-around, and apodised by an optional window.
+
+    Returns:
+        Tuple[np.ndarray, int]: The rfft of the kernel, and the padded length.
+    """
+
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter}', expected one of {FILTERS}")
+
+    size = int(2 ** np.ceil(np.log2(2 * n_cols)))
+
+    n = np.concatenate((np.arange(0, size // 2), np.arange(-size // 2, 0)))
+    kernel = np.zeros(size)
+    kernel[0] = 0.25
+    odd = n % 2 == 1
+    kernel[odd] = -1 / (np.pi * n[odd]) ** 2
+
+    response = np.real(np.fft.rfft(kernel)) / pixel_size
+    frequency = np.fft.rfftfreq(size) * 2 # 1 at Nyquist
+
+    if filter == "shepp-logan":
+        response[1:] *= np.sinc(frequency[1:] / 2)
+    elif filter == "cosine":
+        response *= np.cos(frequency * np.pi / 2)
+    elif filter == "hann":
+        response *= 0.5 * (1 + np.cos(frequency * np.pi))
+
+    response.flags.writeable = False
+    return response, size
+
+
+def filter_projections(projections:np.ndarray, pixel_size:float, filter:str="ram-lak") -> np.ndarray:
+    """Ramp-filter projections along their last axis."""
+
+    response, size = ramp_filter(projections.shape[-1], float(pixel_size), filter)
+    spectrum = np.fft.rfft(projections, n=size, axis=-1)
+    spectrum *= response
+    return np.fft.irfft(spectrum, n=size, axis=-1)[..., :projections.shape[-1]].astype(projections.dtype, copy=False)
+
+
+def _interp_columns(row_block:np.ndarray, t:np.ndarray) -> np.ndarray:
+    """Linear interpolation of rows x columns data at fractional column indices t (zero outside)."""
+
+    n = row_block.shape[-1]
+    i0 = np.floor(t).astype(np.intp)
+    w = (t - i0).astype(row_block.dtype)
+    valid = (i0 >= 0) & (i0 < n - 1)
+    i0 = np.where(valid, i0, 0)
+
+    values = row_block[..., i0] * (1 - w) + row_block[..., i0 + 1] * w
+    values *= valid
+    return values
+
+
+def _interp_rows_columns(image:np.ndarray, rows:np.ndarray, cols:np.ndarray) -> np.ndarray:
+    """Bilinear interpolation of an image at fractional (broadcastable) row and column indices (zero outside)."""
+
+    i0 = np.floor(rows).astype(np.intp)
+    j0 = np.floor(cols).astype(np.intp)
+    wi = (rows - i0).astype(image.dtype)
+    wj = (cols - j0).astype(image.dtype)
+    valid = (i0 >= 0) & (i0 < image.shape[0] - 1) & (j0 >= 0) & (j0 < image.shape[1] - 1)
+    i0 = np.where(valid, i0, 0)
+    j0 = np.where(valid, j0, 0)
+
+    top = image[i0, j0] * (1 - wj) + image[i0, j0 + 1] * wj
+    bottom = image[i0 + 1, j0] * (1 - wj) + image[i0 + 1, j0 + 1] * wj
+    values = top * (1 - wi) + bottom * wi
+    values *= valid
+    return values
+
+
+def _grid(size:int, voxel_size:float) -> Tuple[np.ndarray, np.ndarray]:
+    c = (np.arange(size) - (size - 1) / 2) * voxel_size
+    x, y = np.meshgrid(c, c)
+    return x, y
+
+
+def backproject_parallel(filtered:np.ndarray, angles:Sequence[float], pixel_size:float, size:Optional[int]=None,
+        centre:Optional[float]=None) -> np.ndarray:
+    """Backproject filtered parallel-beam projections.
+
+    Args:
+        filtered (np.ndarray): angle x rows x columns.
+        angles (Sequence[float]): Angles in degrees.
+        pixel_size (float): Pixel size, also the voxel size.
+        size (int, optional): Size of the slices, defaults to the number of columns.
+        centre (float, optional): Column of the rotation axis, defaults to the middle.
+
+    Returns:
+        np.ndarray: rows x size x size volume.
+    """
+
+    n_angles, n_rows, n_cols = filtered.shape
+    size = size or n_cols
+    x, y = _grid(size, 1.0)
+    if centre is None:
+        centre = (n_cols - 1) / 2
+
+    volume = np.zeros((n_rows, size, size), dtype=filtered.dtype)
+    for a, theta in enumerate(np.radians(angles)):
+        t = x * np.cos(theta) - y * np.sin(theta) + centre
+        volume += _interp_columns(filtered[a], t)
+
+    # A half turn covers the Radon space once, a full turn twice
+    volume *= np.pi / n_angles
+    return volume
+
+
+def _prepare(block:np.ndarray, transmission:bool, min_intensity:float) -> np.ndarray:
+    block = np.array(block, dtype=flatfield.work_dtype(block.dtype))
+    if transmission:
+        flatfield.correct(block, min_intensity=min_intensity, log=True, out=block)
+    return block
+
+
+def _open(source):
+    return projection_store.ProjectionStore(source) if isinstance(source, (str, Path)) else source
+
+
+def _fbp_slab(source, start:int, stop:int, pixel_size:float, angles:np.ndarray, size:int,
+        transmission:bool, min_intensity:float, filter:str, centre:Tuple[float, float]) -> Tuple[int, np.ndarray, list]:
+    with tracing.span("recon.read") as span:
+        block = _prepare(_open(source)[:, start:stop], transmission, min_intensity)
+        span.add_bytes(block.nbytes)
+    with tracing.span("recon.filter", bytes=block.nbytes):
+        filtered = filter_projections(block, pixel_size, filter)
+    with tracing.span("recon.backproject", bytes=filtered.nbytes):
+        slab = backproject_parallel(filtered, angles, pixel_size, size, centre[0])
+    # The spans of a worker process are sent back with the slab
+    return start, slab, tracing.tracer().drain()
+
+
+def cone_distances(source_pos:Sequence[float], detector_pos:Sequence[float]) -> Tuple[float, float]:
+    """Source-to-object and source-to-detector distances of a circular orbit around the origin."""
+
+    source = np.asarray(source_pos, dtype=np.double)
+    detector = np.asarray(detector_pos, dtype=np.double)
+    return float(np.linalg.norm(source)), float(np.linalg.norm(detector - source))
+
+
+def cone_rows(start:int, stop:int, n_rows:int, size:int, pixel_size:float, sod:float, sdd:float,
+        centre:Optional[float]=None) -> Tuple[int, int]:
+    """Detector rows needed to reconstruct slices [start, stop) of a cone-beam volume.
+
+    Slices and rows are indexed from the same centre, the row of the detector
+    centre (the middle row by default). A voxel at height z
+    projects at height z * magnification on the virtual detector through the
+    rotation axis, and the magnification is bounded by the voxels half a
+    slice diagonal away from the axis, towards and away from the source.
+    """
+
+    if centre is None:
+        centre = (n_rows - 1) / 2
+    tau = pixel_size * sod / sdd
+    radius = size / 2 * np.sqrt(2) * tau
+    mag_max = sod / max(sod - radius, 1e-6 * sod)
+    mag_min = sod / (sod + radius)
+
+    low = start - centre
+    high = stop - 1 - centre
+    low *= mag_max if low < 0 else mag_min
+    high *= mag_max if high > 0 else mag_min
+    return max(0, int(np.floor(low + centre))), min(n_rows, int(np.ceil(high + centre)) + 2)
+
+
+def _fdk_slab(source, start:int, stop:int, pixel_size:float, angles:np.ndarray, size:int,
+        transmission:bool, min_intensity:float, filter:str, centre:Tuple[float, float], sod:float, sdd:float) -> Tuple[int, np.ndarray, list]:
+
+    projections = _open(source)
+    n_angles, n_rows, n_cols = projections.shape
+    col_centre, row_centre = centre
+    row_start, row_stop = cone_rows(start, stop, n_rows, size, pixel_size, sod, sdd, row_centre)
+    with tracing.span("recon.read") as span:
+        block = _prepare(projections[:, row_start:row_stop], transmission, min_intensity)
+        span.add_bytes(block.nbytes)
+
+    # Work on a virtual detector through the rotation axis
+    tau = pixel_size * sod / sdd
+    u = (np.arange(n_cols) - col_centre) * tau
+    v = (np.arange(row_start, row_stop) - row_centre) * tau
+    block *= (sod / np.sqrt(sod ** 2 + u[None, :] ** 2 + v[:, None] ** 2)).astype(block.dtype)
+    with tracing.span("recon.filter", bytes=block.nbytes):
+        filtered = filter_projections(block, tau, filter)
+
+    x, y = _grid(size, tau)
+    z = ((np.arange(start, stop) - row_centre) * tau)[:, None, None]
+    volume = np.zeros((stop - start, size, size), dtype=block.dtype)
+
+    with tracing.span("recon.backproject", bytes=filtered.nbytes):
+        for a, beta in enumerate(np.radians(angles)):
+            s = x * np.cos(beta) - y * np.sin(beta)
+            d = x * np.sin(beta) + y * np.cos(beta)
+            mag = sod / (sod - d)
+
+            # Bilinear interpolation on the virtual detector
+            cu = s * mag / tau + col_centre
+            cv = z * mag / tau + row_centre - row_start
+            volume += _interp_rows_columns(filtered[a], cv, cu) * (mag ** 2).astype(block.dtype)
+
+    volume *= np.pi / n_angles
+    return start, volume, tracing.tracer().drain()
+
+
+def _stack_centre(projections, centre:Optional[Sequence[float]]) -> Tuple[Tuple[float, float], Optional[detector.ROI]]:
+    """Column and row of the stack where the detector centre falls, and the ROI recorded in a store."""
+
+    n_angles, n_rows, n_cols = projections.shape
+    geometry = getattr(projections, "geometry", None)
+    roi = detector.ROI.from_geometry(geometry)
+    if centre is None:
+        centre = detector.roi_centre(geometry) or ((n_cols - 1) / 2, (n_rows - 1) / 2)
+    return (float(centre[0]), float(centre[1])), roi
+
+
+def _slab_rows(n_angles:int, n_cols:int, size:int, workers:int, max_memory:int, rows_per_slab:int=1) -> int:
+    # Projections, their filtered copy and a few temporaries of the size of the slab
+    per_row = 4 * (2 * n_angles * n_cols + 6 * size * size) * rows_per_slab
+    return max(1, int(max_memory // (per_row * workers)))
+
+
+def _run(task, source, n_slices:int, slab_rows:int, size:int, out, workers:int, use_processes:bool, args:tuple,
+        geometry:Optional[dict]=None):
+    """Run the slab tasks, writing each result into out as it arrives."""
+
+    writer = None
+    if out is None:
+        volume = np.empty((n_slices, size, size), dtype=np.single)
+        store = lambda start, slab: volume.__setitem__(slice(start, start + slab.shape[0]), slab)
+    elif isinstance(out, (str, Path)):
+        writer = projection_store.create(out, (n_slices, size, size), geometry={"type": "volume", **(geometry or {})})
+        volume = Path(out)
+
+        def store(start, slab):
+            writer.stack[start:start + slab.shape[0]] = slab
+            writer.mark_written(slice(start, start + slab.shape[0]))
+    else:
+        volume = out
+        store = lambda start, slab: out.__setitem__(slice(start, start + slab.shape[0]), slab)
+
+    # Workers open the store themselves rather than receiving the projections
+    if isinstance(source, projection_store.ProjectionStore):
+        source = str(source.fname)
+    elif use_processes:
+        raise ValueError("Process pools need the projections in a projection store, use threads for arrays")
+
+    if use_processes:
+        # Spawned workers do not inherit the tracing switch
+        executor = ProcessPoolExecutor(workers, initializer=tracing.enable if tracing.enabled() else None)
+    else:
+        executor = ThreadPoolExecutor(workers)
+    try:
+        with executor:
+            tasks = [(source, start, min(start + slab_rows, n_slices), *args) for start in range(0, n_slices, slab_rows)]
+            for start, slab, events in pools.bounded_map(executor, task, tasks, workers):
+                store(start, slab)
+                tracing.tracer().extend(events)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        writer.close()
+    return volume
+
+
+@tracing.traced("recon.fbp")
+def fbp_parallel(projections,
+        pixel_size:float,
+        angles:Sequence[float],
+        out=None,
+        transmission:bool=True,
+        min_intensity:float=0.0001,
+        filter:str="ram-lak",
+        size:Optional[int]=None,
+        slab_rows:Optional[int]=None,
+        workers:Optional[int]=None,
+        use_processes:Optional[bool]=None,
+        max_memory:int=DEFAULT_MAX_MEMORY,
+        centre:Optional[Sequence[float]]=None):
+    """Parallel-beam FBP, one slab of sinogram rows per task.
+
+    Args:
+        projections (np.ndarray|ProjectionStore|str): angle x rows x columns.
+        pixel_size (float): Detector pixel size.
+        angles (Sequence[float]): Angles in degrees.
+        out (np.ndarray|str, optional): Output array, or file name of a volume store to stream the slices to.
+        transmission (bool): The projections are transmitted intensities, -log is applied (like CIL's TransmissionAbsorptionConverter).
+        min_intensity (float): Intensities are clipped to this value before the log.
+        filter (str): One of FILTERS.
+        size (int, optional): Size of the slices, defaults to the number of columns.
+        slab_rows (int, optional): Rows per slab, derived from max_memory by default.
+        workers (int, optional): Number of workers, defaults to the number of CPUs.
+        use_processes (bool, optional): Use a process pool. Defaults to True for projection stores.
+        max_memory (int): Approximate memory budget of the slabs in flight, in bytes.
+        centre (Sequence[float], optional): Column and row of the projections where the detector centre falls.
+            Defaults to the one recorded in the geometry of a store holding an ROI (see detector.ROI), the middle otherwise.
+
+    Returns:
+        np.ndarray|Path: The volume (rows x size x size), or the file name of the volume store.
+            The slices of an ROI are its rows, which are recorded in the geometry of the volume store.
+    """
+
+    projections = projection_store.as_stack(projections)
+    n_angles, n_rows, n_cols = projections.shape
+    size = size or n_cols
+    workers = workers or os.cpu_count() or 1
+    centre, roi = _stack_centre(projections, centre)
+    if use_processes is None:
+        use_processes = isinstance(projections, projection_store.ProjectionStore)
+    if slab_rows is None:
+        slab_rows = min(n_rows, _slab_rows(n_angles, n_cols, size, workers, max_memory))
+        # Give every worker something to do
+        slab_rows = max(1, min(slab_rows, -(-n_rows // workers)))
+
+    args = (float(pixel_size), np.asarray(angles, dtype=np.double), size, transmission, min_intensity, filter, centre)
+    geometry = {"rows": list(roi.rows)} if roi is not None and roi.rows is not None else None
+    return _run(_fbp_slab, projections, n_rows, slab_rows, size, out, workers, use_processes, args, geometry)
+
+
+@tracing.traced("recon.fdk")
+def fdk_cone(projections,
+        pixel_size:float,
+        angles:Sequence[float],
+        source_pos:Sequence[float],
+        detector_pos:Sequence[float],
+        out=None,
+        transmission:bool=True,
+        min_intensity:float=0.0001,
+        filter:str="ram-lak",
+        size:Optional[int]=None,
+        slab_rows:Optional[int]=None,
+        workers:Optional[int]=None,
+        use_processes:Optional[bool]=None,
+        max_memory:int=DEFAULT_MAX_MEMORY,
+        centre:Optional[Sequence[float]]=None):
+    """Cone-beam FDK, one slab of slices per task.
+
+    Each slab reads the band of detector rows its voxels project onto,
+    padded for the cone angle. Voxels are the detector pixels scaled to the
+    isocentre. An ROI must be a band of rows. See fbp_parallel() for the
+    other arguments.
+
+    Args:
+        source_pos (Sequence[float]): Position of the source.
+        detector_pos (Sequence[float]): Position of the centre of the detector.
+
+    Returns:
+        np.ndarray|Path: The volume (rows x size x size), or the file name of the volume store.
+    """
+
+    projections = projection_store.as_stack(projections)
+    n_angles, n_rows, n_cols = projections.shape
+    size = size or n_cols
+    workers = workers or os.cpu_count() or 1
+    sod, sdd = cone_distances(source_pos, detector_pos)
+    centre, roi = _stack_centre(projections, centre)
+    if roi is not None and roi.rows is not None and not roi.is_band(roi.rows[-1] + 1):
+        raise ValueError(f"FDK needs contiguous detector rows, the ROI has rows {list(roi.rows)}")
+    if use_processes is None:
+        use_processes = isinstance(projections, projection_store.ProjectionStore)
+    if slab_rows is None:
+        slab_rows = min(n_rows, _slab_rows(n_angles, n_cols, size, workers, max_memory, 2))
+        slab_rows = max(1, min(slab_rows, -(-n_rows // workers)))
+
+    args = (float(pixel_size), np.asarray(angles, dtype=np.double), size, transmission, min_intensity, filter, centre, sod, sdd)
+    geometry = {"rows": list(roi.rows)} if roi is not None and roi.rows is not None else None
+    return _run(_fdk_slab, projections, n_rows, slab_rows, size, out, workers, use_processes, args, geometry)
@@ -0,0 +1,571 @@
+"""Iterative reconstruction (SIRT, OS-SART, CGLS) for sparse-angle and low-dose scans.
+
+The projector and backprojector are an exactly matched pair, vectorised
+over the voxels and slices and computed on the fly one angle at a time, so
+their memory is bounded by the volume and a few temporaries:
+
+- parallel beams spread each voxel over the two nearest detector columns
+  (linear interpolation), the same weights for every slice;
+- cone beams spread each voxel over the four nearest pixels of the virtual
+  detector through the rotation axis (bilinear interpolation), weighted by
+  the magnification and the obliquity of the ray, on the circular orbit of
+  recon_engine.fdk_cone().
+
+Geometry conventions (angles, volume axes, ROI centring) are those of
+recon_engine. OS-SART updates the volume after each ordered subset of
+angles, interleaved so that consecutive subsets are far apart, and
+converges in a few passes over the data where SIRT (one subset) needs tens
+to hundreds:
+
+    volume = recon_iterative.iterative_parallel(store, pixel_size, angles,
+        method="os-sart", iterations=5, subsets=10, x0="fbp", tolerance=1e-3)
+
+Reconstructions start from zero, a given volume (e.g. the previous one of a
+sweep), a volume store or the FBP/FDK result, can write the volume to a
+checkpoint store every few iterations and resume from it, and stop early
+when the residual is small or stops decreasing.
+"""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import projection_store
+import recon_engine
+import tracing
+
+METHODS = ("sirt", "os-sart", "cgls")
+
+# Elements of the temporaries of a projection or a backprojection
+_CHUNK_ELEMENTS = 1 << 22
+
+
+def _spread(cols:np.ndarray, weights:np.ndarray, n:int) -> Tuple[np.ndarray, np.ndarray]:
+    """Two-point linear interpolation at fractional indices: clipped indices and weights, zero outside [0, n)."""
+
+    i0 = np.floor(cols).astype(np.intp)
+    w = (cols - i0).astype(np.single)
+    pairs = []
+    for i, wi in ((i0, 1 - w), (i0 + 1, w)):
+        valid = (i >= 0) & (i < n)
+        pairs.append((np.where(valid, i, 0), wi * valid * weights))
+    return pairs[0][0], pairs[0][1], pairs[1][0], pairs[1][1]
+
+
+class ParallelProjector():
+    """Matched parallel-beam projector and backprojector of rows x size x size volumes.
+
+    Args:
+        angles (Sequence[float]): Angles in degrees.
+        n_rows (int): Detector rows, also the slices of the volume.
+        n_cols (int): Detector columns.
+        size (int): Size of the slices.
+        pixel_size (float): Pixel size, also the voxel size.
+        centre (float, optional): Column of the rotation axis, the middle by default.
+    """
+
+    def __init__(self, angles:Sequence[float], n_rows:int, n_cols:int, size:int, pixel_size:float, centre:Optional[float]=None):
+        self.angles = np.asarray(angles, dtype=np.double)
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.size = size
+        self.pixel_size = float(pixel_size)
+        self.centre = (n_cols - 1) / 2 if centre is None else float(centre)
+        x, y = recon_engine._grid(size, 1.0)
+        self._x = x.ravel()
+        self._y = y.ravel()
+
+    @property
+    def volume_shape(self) -> Tuple[int, int, int]:
+        return self.n_rows, self.size, self.size
+
+    @property
+    def projection_shape(self) -> Tuple[int, int, int]:
+        return len(self.angles), self.n_rows, self.n_cols
+
+    def _weights(self, a:int):
+        theta = np.radians(self.angles[a])
+        t = self._x * np.cos(theta) - self._y * np.sin(theta) + self.centre
+        return _spread(t, np.single(self.pixel_size), self.n_cols)
+
+    def forward(self, volume:np.ndarray, subset:Optional[Sequence[int]]=None) -> np.ndarray:
+        """Projections of a volume at the angles of subset (all by default), subset x rows x columns."""
+
+        subset = np.arange(len(self.angles)) if subset is None else np.asarray(subset)
+        voxels = volume.reshape(self.n_rows, -1)
+        out = np.zeros((len(subset), self.n_rows, self.n_cols), dtype=np.single)
+        rows = max(1, _CHUNK_ELEMENTS // (2 * voxels.shape[1]))
+
+        for k, a in enumerate(subset):
+            c0, w0, c1, w1 = self._weights(a)
+            # Every slice shares the weights: sort them by column once and sum runs of columns
+            cols = np.concatenate((c0, c1))
+            weights = np.concatenate((w0, w1))
+            order = np.argsort(cols, kind="stable")
+            order = order[weights[order] != 0]
+            cols = cols[order]
+            weights = weights[order]
+            sources = order % voxels.shape[1]
+            if not len(cols):
+                continue
+            starts = np.flatnonzero(np.diff(cols, prepend=-1))
+            for start in range(0, self.n_rows, rows):
+                block = voxels[start:start + rows, sources] * weights
+                out[k][start:start + rows, cols[starts]] = np.add.reduceat(block, starts, axis=1)
+        return out
+
+    def adjoint(self, projections:np.ndarray, subset:Optional[Sequence[int]]=None) -> np.ndarray:
+        """Backprojection (the transpose of forward) of subset x rows x columns projections."""
+
+        subset = np.arange(len(self.angles)) if subset is None else np.asarray(subset)
+        volume = np.zeros((self.n_rows, self.size * self.size), dtype=np.single)
+        for k, a in enumerate(subset):
+            c0, w0, c1, w1 = self._weights(a)
+            volume += projections[k][:, c0] * w0
+            volume += projections[k][:, c1] * w1
+        return volume.reshape(self.volume_shape)
+
+
+class ConeProjector():
+    """Matched cone-beam projector and backprojector of slices x size x size volumes.
+
+    Voxels are the detector pixels scaled to the isocentre, like in
+    recon_engine.fdk_cone(). A voxel of attenuation mu adds
+    mu * tau * magnification ** 2 / cos(gamma) to the line integrals of the
+    pixels it is spread over, tau being the voxel size and gamma the angle
+    of the ray with the central ray.
+
+    Args:
+        angles (Sequence[float]): Angles in degrees.
+        n_rows (int): Detector rows, also the slices of the volume.
+        n_cols (int): Detector columns.
+        size (int): Size of the slices.
+        pixel_size (float): Detector pixel size.
+        sod (float): Source-to-object distance.
+        sdd (float): Source-to-detector distance.
+        centre (Tuple[float, float], optional): Column and row of the detector centre, the middle by default.
+    """
+
+    def __init__(self, angles:Sequence[float], n_rows:int, n_cols:int, size:int, pixel_size:float, sod:float, sdd:float,
+            centre:Optional[Tuple[float, float]]=None):
+        self.angles = np.asarray(angles, dtype=np.double)
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.size = size
+        self.sod = float(sod)
+        self.tau = pixel_size * sod / sdd
+        self.centre = ((n_cols - 1) / 2, (n_rows - 1) / 2) if centre is None else tuple(float(c) for c in centre)
+
+        x, y = recon_engine._grid(size, self.tau)
+        self._x = x.ravel()
+        self._y = y.ravel()
+        self._z = (np.arange(n_rows) - self.centre[1]) * self.tau
+
+        u = (np.arange(n_cols) - self.centre[0]) * self.tau
+        v = (np.arange(n_rows) - self.centre[1]) * self.tau
+        self._obliquity = (np.sqrt(self.sod ** 2 + u[None, :] ** 2 + v[:, None] ** 2) / self.sod).astype(np.single)
+
+    @property
+    def volume_shape(self) -> Tuple[int, int, int]:
+        return self.n_rows, self.size, self.size
+
+    @property
+    def projection_shape(self) -> Tuple[int, int, int]:
+        return len(self.angles), self.n_rows, self.n_cols
+
+    def _columns(self, a:int):
+        beta = np.radians(self.angles[a])
+        s = self._x * np.cos(beta) - self._y * np.sin(beta)
+        d = self._x * np.sin(beta) + self._y * np.cos(beta)
+        mag = self.sod / (self.sod - d)
+        return mag, s * mag / self.tau + self.centre[0]
+
+    def _corners(self, mag:np.ndarray, cols, slices:slice):
+        # Pixel indices and weights of the four pixels around the projection of each voxel of the slices
+        rows = self._z[slices, None] * mag / self.tau + self.centre[1]
+        r0, rw0, r1, rw1 = _spread(rows, (self.tau * mag ** 2).astype(np.single), self.n_rows)
+        c0, cw0, c1, cw1 = cols
+        for r, rw in ((r0, rw0), (r1, rw1)):
+            for c, cw in ((c0, cw0), (c1, cw1)):
+                yield r * self.n_cols + c, rw * cw
+
+    def _slabs(self) -> range:
+        return range(0, self.n_rows, max(1, _CHUNK_ELEMENTS // len(self._x)))
+
+    def forward(self, volume:np.ndarray, subset:Optional[Sequence[int]]=None) -> np.ndarray:
+        """Projections of a volume at the angles of subset (all by default), subset x rows x columns."""
+
+        subset = np.arange(len(self.angles)) if subset is None else np.asarray(subset)
+        voxels = volume.reshape(self.n_rows, -1)
+        out = np.zeros((len(subset), self.n_rows * self.n_cols), dtype=np.double)
+        step = self._slabs().step
+
+        for k, a in enumerate(subset):
+            mag, u = self._columns(a)
+            cols = _spread(u, np.single(1), self.n_cols)
+            for start in self._slabs():
+                block = voxels[start:start + step]
+                for pixels, weights in self._corners(mag, cols, slice(start, start + step)):
+                    out[k] += np.bincount(pixels.ravel(), (block * weights).ravel(), out.shape[1])
+        out = out.reshape(len(subset), self.n_rows, self.n_cols).astype(np.single)
+        out *= self._obliquity
+        return out
+
+    def adjoint(self, projections:np.ndarray, subset:Optional[Sequence[int]]=None) -> np.ndarray:
+        """Backprojection (the transpose of forward) of subset x rows x columns projections."""
+
+        subset = np.arange(len(self.angles)) if subset is None else np.asarray(subset)
+        volume = np.zeros((self.n_rows, len(self._x)), dtype=np.single)
+        step = self._slabs().step
+
+        for k, a in enumerate(subset):
+            image = (projections[k] * self._obliquity).ravel()
+            mag, u = self._columns(a)
+            cols = _spread(u, np.single(1), self.n_cols)
+            for start in self._slabs():
+                for pixels, weights in self._corners(mag, cols, slice(start, start + step)):
+                    volume[start:start + step] += image[pixels] * weights
+        return volume.reshape(self.volume_shape)
+
+
+def ordered_subsets(n_angles:int, subsets:int) -> List[np.ndarray]:
+    """Angle indices of each subset: every subsets-th angle, the subsets taken in bit-reversed order so that consecutive ones are far apart."""
+
+    subsets = max(1, min(int(subsets), n_angles))
+    bits = max(1, int(np.ceil(np.log2(subsets))))
+    order = sorted(range(subsets), key=lambda i: int(f"{i:0{bits}b}"[::-1], 2))
+    return [np.arange(i, n_angles, subsets) for i in order]
+
+
+@dataclass
+class IterationLog():
+    """Residuals of a reconstruction, relative to the norm of the projections, one per iteration."""
+
+    method:str
+    residuals:List[float] = field(default_factory=list)
+    start:int = 0
+    stopped:str = "iterations"
+
+    @property
+    def iterations(self) -> int:
+        return self.start + len(self.residuals)
+
+
+def _safe_inverse(values:np.ndarray) -> np.ndarray:
+    inverse = np.zeros_like(values)
+    np.divide(1, values, out=inverse, where=values > 1e-12 * max(float(values.max(initial=0)), 1e-30))
+    return inverse
+
+
+def _stop(log:IterationLog, tolerance:Optional[float], stagnation:Optional[float]) -> bool:
+    residuals = log.residuals
+    if tolerance is not None and residuals[-1] <= tolerance:
+        log.stopped = "tolerance"
+        return True
+    if stagnation is not None and len(residuals) > 1 and residuals[-2] - residuals[-1] < stagnation * residuals[-2]:
+        log.stopped = "stagnation"
+        return True
+    return False
+
+
+def sart(operator, projections:np.ndarray, x0:Optional[np.ndarray]=None, iterations:int=10, subsets:int=1,
+        relaxation:float=1.0, nonnegative:bool=True, tolerance:Optional[float]=None, stagnation:Optional[float]=None,
+        callback:Optional[Callable[[int, np.ndarray, float], None]]=None, log:Optional[IterationLog]=None,
+        max_memory:int=recon_engine.DEFAULT_MAX_MEMORY) -> Tuple[np.ndarray, IterationLog]:
+    """SIRT (one subset) or OS-SART.
+
+    Each subset S updates x += relaxation * C_S A_S^T R_S (b_S - A_S x),
+    where R_S and C_S are the inverse row and column sums of the system
+    matrix restricted to S. The residual of an iteration is the norm of
+    the subset residuals met during the pass, relative to the norm of b.
+
+    Args:
+        operator: ParallelProjector or ConeProjector.
+        projections (np.ndarray): Line integrals, angle x rows x columns.
+        x0 (np.ndarray, optional): Initial volume, zero by default.
+        iterations (int): Maximum number of passes over the subsets.
+        subsets (int): Number of ordered subsets of angles.
+        relaxation (float): Step size, in (0, 2).
+        nonnegative (bool): Clip negative attenuation after each update.
+        tolerance (float, optional): Stop when the relative residual falls below this value.
+        stagnation (float, optional): Stop when the relative residual decreases by less than this fraction in an iteration.
+        callback (Callable, optional): Called with (iteration, volume, relative residual) after each iteration.
+        log (IterationLog, optional): Log to append to, e.g. when resuming.
+        max_memory (int): Memory allowed for the cached column sums, which are recomputed at each iteration beyond it.
+
+    Returns:
+        Tuple[np.ndarray, IterationLog]: The volume and its residuals.
+    """
+
+    x = np.zeros(operator.volume_shape, dtype=np.single) if x0 is None else np.array(x0, dtype=np.single)
+    groups = ordered_subsets(len(projections), subsets)
+    log = log or IterationLog("sirt" if len(groups) == 1 else "os-sart")
+    norm = float(np.linalg.norm(projections)) or 1.
+
+    # Inverse row sums of the whole matrix, inverse column sums per subset
+    with tracing.span("recon.weights"):
+        rows = _safe_inverse(operator.forward(np.ones(operator.volume_shape, dtype=np.single)))
+    columns:Dict[int, np.ndarray] = {}
+    cache = len(groups) * x.nbytes <= max_memory
+
+    def column_weights(i:int) -> np.ndarray:
+        if i in columns:
+            return columns[i]
+        weights = _safe_inverse(operator.adjoint(np.ones((len(groups[i]),) + projections.shape[1:], dtype=np.single), groups[i]))
+        if cache:
+            columns[i] = weights
+        return weights
+
+    for iteration in range(log.iterations, log.iterations + iterations):
+        squared = 0.
+        with tracing.span("recon.iteration", bytes=projections.nbytes):
+            for i, subset in enumerate(groups):
+                residual = projections[subset] - operator.forward(x, subset)
+                squared += float(np.vdot(residual, residual))
+                residual *= rows[subset]
+                x += relaxation * column_weights(i) * operator.adjoint(residual, subset)
+                if nonnegative:
+                    np.maximum(x, 0, out=x)
+
+        log.residuals.append(float(np.sqrt(squared)) / norm)
+        if callback is not None:
+            callback(iteration + 1, x, log.residuals[-1])
+        if _stop(log, tolerance, stagnation):
+            break
+    return x, log
+
+
+def cgls(operator, projections:np.ndarray, x0:Optional[np.ndarray]=None, iterations:int=10,
+        tolerance:Optional[float]=None, stagnation:Optional[float]=None,
+        callback:Optional[Callable[[int, np.ndarray, float], None]]=None, log:Optional[IterationLog]=None) -> Tuple[np.ndarray, IterationLog]:
+    """Conjugate gradient least squares, minimising |A x - b|. See sart() for the arguments.
+
+    CGLS uses every angle at each iteration and cannot be constrained, but
+    needs no weights and converges faster than SIRT.
+    """
+
+    x = np.zeros(operator.volume_shape, dtype=np.single) if x0 is None else np.array(x0, dtype=np.single)
+    log = log or IterationLog("cgls")
+    norm = float(np.linalg.norm(projections)) or 1.
+
+    r = projections - operator.forward(x)
+    s = operator.adjoint(r)
+    p = s.copy()
+    gamma = float(np.vdot(s, s))
+
+    for iteration in range(log.iterations, log.iterations + iterations):
+        with tracing.span("recon.iteration", bytes=projections.nbytes):
+            q = operator.forward(p)
+            qq = float(np.vdot(q, q))
+            if qq == 0 or gamma == 0:
+                log.residuals.append(float(np.linalg.norm(r)) / norm)
+                log.stopped = "converged"
+                break
+            alpha = gamma / qq
+            x += alpha * p
+            r -= alpha * q
+            s = operator.adjoint(r)
+            gamma, previous = float(np.vdot(s, s)), gamma
+            p *= gamma / previous
+            p += s
+
+        log.residuals.append(float(np.linalg.norm(r)) / norm)
+        if callback is not None:
+            callback(iteration + 1, x, log.residuals[-1])
+        if _stop(log, tolerance, stagnation):
+            break
+    return x, log
+
+
+def _checkpoint(fname:str|Path, volume:np.ndarray, log:IterationLog, geometry:Optional[dict]) -> Path:
+    # The store is written aside and moved over the previous checkpoint, which is never left half written
+    return projection_store.save(fname, volume, geometry={"type": "volume", **(geometry or {}),
+        "iterative": {"method": log.method, "iteration": log.iterations, "residuals": log.residuals, "stopped": log.stopped}})
+
+
+def load_log(store) -> Optional[IterationLog]:
+    """Iterations recorded in a checkpoint or output volume store, None if it has none."""
+
+    store = projection_store.as_stack(store)
+    info = getattr(store, "geometry", {}).get("iterative")
+    if info is None:
+        return None
+    return IterationLog(info["method"], list(info["residuals"]), info["iteration"] - len(info["residuals"]), info.get("stopped", "iterations"))
+
+
+def _solve(operator, projections, x0, method:str, iterations:int, subsets:int, relaxation:float, nonnegative:bool,
+        tolerance:Optional[float], stagnation:Optional[float], out, checkpoint, checkpoint_every:int, callback,
+        geometry:Optional[dict], max_memory:int, fbp:Callable[[], np.ndarray]):
+    """Prepare the data and the initial volume, iterate with checkpoints and write the result."""
+
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}', expected one of {METHODS}")
+
+    log = None
+    if checkpoint is not None and x0 is None and Path(checkpoint).exists():
+        # Resume where the last run stopped
+        x0 = checkpoint
+        log = load_log(checkpoint)
+        expected = "sirt" if method == "os-sart" and subsets <= 1 else method
+        if log is not None and log.method != expected:
+            # A warm start for another method
+            log = None
+
+    if isinstance(x0, str) and x0 == "fbp":
+        with tracing.span("recon.warm_start"):
+            x0 = fbp()
+    elif x0 is not None and not isinstance(x0, np.ndarray):
+        x0 = projection_store.as_stack(x0)[:]
+    if x0 is not None and tuple(x0.shape) != operator.volume_shape:
+        raise ValueError(f"Initial volume has shape {tuple(x0.shape)}, expected {operator.volume_shape}")
+
+    remaining = iterations - (log.iterations if log is not None else 0)
+    if log is not None and log.stopped != "iterations":
+        remaining = 0
+    x = np.array(x0, dtype=np.single) if x0 is not None else np.zeros(operator.volume_shape, dtype=np.single)
+
+    while remaining > 0:
+        step = min(remaining, checkpoint_every) if checkpoint is not None else remaining
+        if method == "cgls":
+            x, log = cgls(operator, projections, x, step, tolerance, stagnation, callback, log)
+        else:
+            x, log = sart(operator, projections, x, step, subsets if method == "os-sart" else 1, relaxation, nonnegative,
+                tolerance, stagnation, callback, log, max_memory)
+        remaining = 0 if log.stopped != "iterations" else remaining - step
+        if checkpoint is not None:
+            with tracing.span("recon.checkpoint", bytes=x.nbytes):
+                _checkpoint(checkpoint, x, log, geometry)
+
+    if log is None:
+        log = IterationLog(method)
+    if out is None:
+        return x
+    if isinstance(out, (str, Path)):
+        return _checkpoint(out, x, log, geometry)
+    out[...] = x
+    return out
+
+
+def _load(projections, transmission:bool, min_intensity:float) -> np.ndarray:
+    with tracing.span("recon.read") as span:
+        data = recon_engine._prepare(projections[:], transmission, min_intensity)
+        span.add_bytes(data.nbytes)
+    return data
+
+
+@tracing.traced("recon.iterative_parallel")
+def iterative_parallel(projections,
+        pixel_size:float,
+        angles:Sequence[float],
+        method:str="os-sart",
+        iterations:int=10,
+        subsets:int=10,
+        x0=None,
+        out=None,
+        checkpoint:Optional[str|Path]=None,
+        checkpoint_every:int=1,
+        tolerance:Optional[float]=None,
+        stagnation:Optional[float]=None,
+        relaxation:float=1.0,
+        nonnegative:bool=True,
+        transmission:bool=True,
+        min_intensity:float=0.0001,
+        size:Optional[int]=None,
+        centre:Optional[Sequence[float]]=None,
+        callback:Optional[Callable[[int, np.ndarray, float], None]]=None,
+        max_memory:int=recon_engine.DEFAULT_MAX_MEMORY):
+    """Iterative parallel-beam reconstruction.
+
+    Args:
+        projections (np.ndarray|ProjectionStore|str): angle x rows x columns.
+        pixel_size (float): Detector pixel size.
+        angles (Sequence[float]): Angles in degrees.
+        method (str): One of METHODS. SIRT and CGLS use every angle at each iteration.
+        iterations (int): Maximum number of iterations (passes over all the angles), including resumed ones.
+        subsets (int): Ordered subsets of angles of OS-SART.
+        x0 (np.ndarray|ProjectionStore|str, optional): Initial volume, a volume store (e.g. the previous
+            volume of a sweep) or "fbp" to start from recon_engine.fbp_parallel(). Zero by default.
+        out (np.ndarray|str, optional): Output array, or file name of a volume store.
+        checkpoint (str|Path, optional): Volume store written every checkpoint_every iterations. If it exists and x0
+            is None, the reconstruction resumes from it.
+        checkpoint_every (int): Iterations between checkpoints.
+        tolerance (float, optional): Stop when the residual, relative to the projections, falls below this value.
+        stagnation (float, optional): Stop when the relative residual decreases by less than this fraction in an iteration.
+        relaxation (float): Step size of SIRT and OS-SART, in (0, 2).
+        nonnegative (bool): Clip negative attenuation (SIRT and OS-SART).
+        transmission (bool): The projections are transmitted intensities, -log is applied.
+        min_intensity (float): Intensities are clipped to this value before the log.
+        size (int, optional): Size of the slices, defaults to the number of columns.
+        centre (Sequence[float], optional): Column and row of the detector centre, see recon_engine.fbp_parallel().
+        callback (Callable, optional): Called with (iteration, volume, relative residual) after each iteration.
+        max_memory (int): Memory allowed for the cached weights of the subsets.
+
+    Returns:
+        np.ndarray|Path: The volume (rows x size x size), or the file name of the volume store, whose
+            geometry records the iterations and residuals (see load_log()).
+    """
+
+    projections = projection_store.as_stack(projections)
+    n_angles, n_rows, n_cols = projections.shape
+    size = size or n_cols
+    centre, roi = recon_engine._stack_centre(projections, centre)
+    operator = ParallelProjector(angles, n_rows, n_cols, size, pixel_size, centre[0])
+    data = _load(projections, transmission, min_intensity)
+
+    fbp = lambda: recon_engine.fbp_parallel(data, pixel_size, angles, transmission=False, size=size, centre=centre,
+        use_processes=False, max_memory=max_memory)
+    geometry = {"rows": list(roi.rows)} if roi is not None and roi.rows is not None else None
+    return _solve(operator, data, x0, method, iterations, subsets, relaxation, nonnegative, tolerance, stagnation,
+        out, checkpoint, checkpoint_every, callback, geometry, max_memory, fbp)
+
+
+@tracing.traced("recon.iterative_cone")
+def iterative_cone(projections,
+        pixel_size:float,
+        angles:Sequence[float],
+        source_pos:Sequence[float],
+        detector_pos:Sequence[float],
+        method:str="os-sart",
+        iterations:int=10,
+        subsets:int=10,
+        x0=None,
+        out=None,
+        checkpoint:Optional[str|Path]=None,
+        checkpoint_every:int=1,
+        tolerance:Optional[float]=None,
+        stagnation:Optional[float]=None,
+        relaxation:float=1.0,
+        nonnegative:bool=True,
+        transmission:bool=True,
+        min_intensity:float=0.0001,
+        size:Optional[int]=None,
+        centre:Optional[Sequence[float]]=None,
+        callback:Optional[Callable[[int, np.ndarray, float], None]]=None,
+        max_memory:int=recon_engine.DEFAULT_MAX_MEMORY):
+    """Iterative cone-beam reconstruction, x0="fbp" starting from recon_engine.fdk_cone().
+
+    An ROI must be a band of rows. See iterative_parallel() for the other arguments.
+
+    Args:
+        source_pos (Sequence[float]): Position of the source.
+        detector_pos (Sequence[float]): Position of the centre of the detector.
+
+    Returns:
+        np.ndarray|Path: The volume (rows x size x size), or the file name of the volume store.
+    """
+
+    projections = projection_store.as_stack(projections)
+    n_angles, n_rows, n_cols = projections.shape
+    size = size or n_cols
+    sod, sdd = recon_engine.cone_distances(source_pos, detector_pos)
+    centre, roi = recon_engine._stack_centre(projections, centre)
+    if roi is not None and roi.rows is not None and not roi.is_band(roi.rows[-1] + 1):
+        raise ValueError(f"Cone-beam reconstructions need contiguous detector rows, the ROI has rows {list(roi.rows)}")
+    operator = ConeProjector(angles, n_rows, n_cols, size, pixel_size, sod, sdd, centre)
+    data = _load(projections, transmission, min_intensity)
+
+    fbp = lambda: recon_engine.fdk_cone(data, pixel_size, angles, source_pos, detector_pos, transmission=False, size=size,
+        centre=centre, use_processes=False, max_memory=max_memory)
+    geometry = {"rows": list(roi.rows)} if roi is not None and roi.rows is not None else None
+    return _solve(operator, data, x0, method, iterations, subsets, relaxation, nonnegative, tolerance, stagnation,
+        out, checkpoint, checkpoint_every, callback, geometry, max_memory, fbp)
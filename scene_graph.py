@@ -0,0 +1,164 @@
+"""Scene graph: static part transforms composed once, scan rotations in closed form.
+
+Rotating parts by a small step at every projection (gvxr.rotateNode or
+gvxr.rotateScene with the angular step) costs one call per part and angle,
+and accumulates rounding errors over hundreds of steps. Here each node's
+static transform (its JSON "Transform" list) is composed into one 4 x 4
+matrix, the rotation matrices of a whole angle schedule are computed at
+once from the angles themselves, and each projection sets absolute
+transforms: the scene root's matrix, or each node's rotation times its
+static matrix. Any angle can be set in any order, with the same result.
+
+Matrices are 4 x 4 NumPy arrays acting on column vectors, in mm.
+gVirtualXray exchanges them as 16 values in OpenGL (column-major) order,
+see to_gl() and from_gl(). Like OpenGL, the transforms of a list are
+post-multiplied, so the last one listed is the first applied.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import projection_store
+
+
+def unit_vector(axis:Sequence[float]) -> np.ndarray:
+    """A vector scaled to length 1."""
+
+    axis = np.asarray(axis, dtype=np.double)
+    return axis / np.linalg.norm(axis)
+
+
+def rotation_matrix(angle:float, axis:Sequence[float]) -> np.ndarray:
+    """3 x 3 counterclockwise rotation by angle (degrees) around axis, like glRotate."""
+    return rotation_matrices([angle], axis)[0, :3, :3]
+
+
+def rotation_matrices(angles:Sequence[float], axis:Sequence[float], centre:Sequence[float]=(0, 0, 0)) -> np.ndarray:
+    """4 x 4 rotations by each angle (degrees) around an axis through centre, N x 4 x 4.
+
+    Computed from the angles (Rodrigues' formula), not by accumulating steps.
+    """
+
+    x, y, z = unit_vector(axis)
+    theta = np.radians(np.asarray(angles, dtype=np.double))
+    c, s = np.cos(theta)[:, None, None], np.sin(theta)[:, None, None]
+
+    k = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    outer = np.outer((x, y, z), (x, y, z))
+    rotation = c * np.eye(3) + s * k + (1 - c) * outer
+
+    matrices = np.zeros((len(theta), 4, 4))
+    matrices[:, :3, :3] = rotation
+    matrices[:, 3, 3] = 1
+    # Rotate around centre: translate it to the origin, rotate, translate back
+    centre = np.asarray(centre, dtype=np.double)
+    matrices[:, :3, 3] = centre - rotation @ centre
+    return matrices
+
+
+def translation_matrix(offset:Sequence[float]) -> np.ndarray:
+    matrix = np.eye(4)
+    matrix[:3, 3] = offset
+    return matrix
+
+
+def scaling_matrix(factors:Sequence[float]) -> np.ndarray:
+    return np.diag([*factors, 1.]).astype(np.double)
+
+
+def transform_matrix(transforms:Sequence) -> np.ndarray:
+    """4 x 4 matrix of a JSON "Transform" list, in mm."""
+
+    matrix = np.eye(4)
+    for transform in transforms:
+        if transform[0] == "Rotation":
+            step = rotation_matrices([transform[1]], transform[2:5])[0]
+        elif transform[0] == "Translation":
+            step = translation_matrix(projection_store.to_mm(transform[1:4], transform[4]))
+        elif transform[0] == "Scaling":
+            step = scaling_matrix(transform[1:4])
+        else:
+            raise ValueError(f"Unknown transform '{transform[0]}'")
+        # Post-multiply, like OpenGL: the last transform is applied first
+        matrix = matrix @ step
+    return matrix
+
+
+def rotation_centre(config:dict) -> List[float]:
+    """Scan/CenterOfRotation of a JSON scene description in mm, the origin if it has none."""
+
+    centre = config.get("Scan", {}).get("CenterOfRotation", (0, 0, 0))
+    return list(centre[:3]) if len(centre) < 4 else projection_store.to_mm(centre[:3], centre[3])
+
+
+def to_gl(matrix:np.ndarray) -> List[float]:
+    """16 values of a 4 x 4 matrix in OpenGL's column-major order."""
+    return np.asarray(matrix, dtype=np.double).T.ravel().tolist()
+
+
+def from_gl(values:Sequence[float]) -> np.ndarray:
+    """4 x 4 matrix from 16 values in OpenGL's column-major order."""
+    return np.asarray(values, dtype=np.double).reshape(4, 4).T
+
+
+@dataclass
+class SceneGraph():
+    """Static transforms of the nodes of a scene and the rotation schedule of a scan.
+
+    Args:
+        static (Dict[str, np.ndarray]): 4 x 4 static matrix of each node, by label.
+        rotation_axis (Sequence[float]): Axis of the scan rotation.
+        centre (Sequence[float]): Point of the rotation axis, in mm.
+        root (np.ndarray, optional): Static matrix of the scene root.
+    """
+
+    static:Dict[str, np.ndarray]
+    rotation_axis:Sequence[float] = (0, 0, 1)
+    centre:Sequence[float] = (0, 0, 0)
+    root:np.ndarray = field(default_factory=lambda: np.eye(4))
+    angles:np.ndarray = field(default_factory=lambda: np.zeros(0))
+    rotations:np.ndarray = field(default_factory=lambda: np.zeros((0, 4, 4)))
+
+    @classmethod
+    def from_config(cls, config:dict, rotation_axis:Optional[Sequence[float]]=None) -> "SceneGraph":
+        """Scene graph of a JSON scene description, rotating around the detector's up vector by default."""
+
+        static = {sample["Label"]: transform_matrix(sample.get("Transform", []))
+            for sample in config["Samples"] if isinstance(sample, dict)}
+
+        if rotation_axis is None:
+            rotation_axis = config["Detector"]["UpVector"]
+        return cls(static, rotation_axis, rotation_centre(config))
+
+    def schedule(self, angles:Sequence[float]):
+        """Precompute the rotations of an angle schedule."""
+
+        self.angles = np.asarray(angles, dtype=np.double)
+        self.rotations = rotation_matrices(self.angles, self.rotation_axis, self.centre)
+
+    def rotation(self, angle:float) -> np.ndarray:
+        """4 x 4 scan rotation at an angle, from the schedule when it is in it."""
+
+        index = np.flatnonzero(self.angles == angle)
+        if len(index):
+            return self.rotations[index[0]]
+        return rotation_matrices([angle], self.rotation_axis, self.centre)[0]
+
+    def node_matrix(self, label:str, angle:float) -> np.ndarray:
+        """Matrix of a node at an angle: its static transform, then the scan rotation."""
+        return self.rotation(angle) @ self.static[label]
+
+    def node_matrices(self, label:str) -> np.ndarray:
+        """Matrices of a node for every angle of the schedule, N x 4 x 4."""
+        return self.rotations @ self.static[label]
+
+    def apply_root(self, gvxr, angle:float):
+        """Set the scene root's transform to the scan rotation (after its static one), one call per angle."""
+        gvxr.setRootTransformationMatrix(to_gl(self.rotation(angle) @ self.root))
+
+    def apply_nodes(self, gvxr, angle:float, labels:Optional[Sequence[str]]=None):
+        """Set the absolute transform of each node (all of them by default)."""
+
+        rotation = self.rotation(angle)
+        for label in labels if labels is not None else self.static:
+            gvxr.setLocalTransformationMatrix(label, to_gl(rotation @ self.static[label]))
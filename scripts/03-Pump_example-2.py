@@ -1,5 +1,4 @@
 import os
-import math
 import numpy as np # Who does not use Numpy?
 from tifffile import imwrite
 import matplotlib # To plot images
@@ -22,6 +21,11 @@ from gvxrPython3.utils import compareWithGroundTruth # Plot the ground truth, th
 from gvxrPython3.utils import interactPlotPowerLaw # Plot the X-ray image using a Power law look-up table
 from gvxrPython3.utils import visualise # Visualise the 3D environment if k3D is supported
 
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import acquisition # Batched CT acquisition
+import projection_store # Single-file projection stack
+
 print("Create an OpenGL context")
 
 window_id = 0
@@ -63,27 +67,24 @@ for i,name in enumerate(parts_list):
 gvxr.displayScene()
 
 
-theta = [];
 num_projections = 721
-angular_step = 360/num_projections
-# Compute the intial X-ray image (zeroth angle) and add it to the list of projections
-xray_image = np.array(gvxr.computeXRayImage()).astype(np.single)
-imwrite('output_data/pump_scan/03-Pump_0.tiff',xray_image)
-# Update the 3D visualisation
-gvxr.displayScene();
-theta.append(0.0);
-gvxr.renderLoop()
-for i in range(1,num_projections):
- #    Rotate the model by angular_step degrees
-     for n,label in enumerate(parts_list):
-          gvxr.rotateNode(label, -1*angular_step, 0,1,0);
-          # Compute an X-ray image and add it to the list of projections
-     # Update the 3D visualisation
-     gvxr.displayScene();
-     xray_image = np.array(gvxr.computeXRayImage()).astype(np.single)
-     imwrite(f'output_data/pump_scan/03-Pump_{i}.tiff',xray_image)
-     theta.append(i * angular_step * math.pi / 180);
-file = open("GVXR_angles.txt", "w")
-file.write(f"angles = {theta} \n")
-file.close()
+angles = acquisition.scan_angles(num_projections, 360)
+
+# The parts were turned by -90 degrees around X, so rotating them by -angle around their own Y
+# is the same as rotating them by angle around the world's Z (the detector is upside down).
+# The projections are rendered straight into a memory-mapped projection store, which also
+# records the angles and the geometry.
+simulator = acquisition.GVXRSimulator(rotation_axis=(0,0,1), labels=parts_list)
+geometry = {
+     "type": "cone",
+     "source_position": list(gvxr.getSourcePosition("mm")),
+     "detector_position": list(gvxr.getDetectorPosition("mm")),
+     "pixel_size": [0.2, 0.2],
+     "unit": "mm",
+}
+with projection_store.create('output_data/pump_scan/03-Pump.gvxrp', (num_projections, *simulator.detector_shape()),
+          angles=angles, geometry=geometry) as store:
+     store.set_flat(simulator.flat_field())
+     acquisition.acquire(simulator, angles, out=store.stack, writer=store)
+
 gvxr.terminate()
\ No newline at end of file
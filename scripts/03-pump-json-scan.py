@@ -1,8 +1,12 @@
 """Load and scan the turbopump from a json file"""
 
 from pathlib import Path
+import sys
 from gvxrPython3 import gvxr, json2gvxr
-import tifffile as tf
+
+sys.path.append(str(Path(__file__).parent.parent))
+import projection_store
+import flatfield
 
 if __name__ == "__main__":
     # Setup scan from json
@@ -24,11 +28,17 @@ if __name__ == "__main__":
     angles = json2gvxr.doCTScan(verbose=False)
     print("Scan complete!")
 
-    # Save angles to file
-    with open("./input_data/TurboPump/scan/angles.csv", "w") as f:
-        f.writelines([ f"{x}\n" for x in angles])
+    # Pack the projections, angles, geometry and scene description into a single file
+    files = projection_store.sorted_by_index(Path("./input_data/TurboPump/scan/").glob("*.tif*"))
+    projection_store.from_tiffs("./input_data/TurboPump/scan.gvxrp", files,
+        angles=angles,
+        geometry=projection_store.geometry_from_config("./JSON/Turbopump.json"),
+        config="./JSON/Turbopump.json",
+        compression="zlib",
+        flat=gvxr.getTotalEnergyWithDetectorResponse())
 
-    # apply flatfields to files
+    # apply flatfields to the projections, in parallel and without loading the whole scan
     print("Performing flatfield correction...")
-    for f in Path("./input_data/TurboPump/scan/").glob("*.tiff"):
-        tf.imwrite(tf.imread(f) / gvxr.getTotalEnergyWithDetectorResponse())
+    flatfield.process_stack("./input_data/TurboPump/scan.gvxrp",
+        "./input_data/TurboPump/scan-flatfield.gvxrp",
+        compression="zlib")
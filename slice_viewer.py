@@ -0,0 +1,247 @@
+"""Lazy slice viewer for large stacks of projections or reconstructed slices.
+
+The stack can be a NumPy array, a memory map or a projection store: only the
+displayed slice (and a few neighbours, prefetched on a background thread)
+are ever read. The display range is estimated from a sample of the stack
+instead of scanning it, large slices are downsampled to the display
+resolution, and scrolling updates the data of an existing image rather than
+creating a new figure. Slider events are debounced on the kernel's event
+loop so that only the last position of a fast scrub is drawn, from the
+thread that owns the widgets and the figure.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import Callable, Optional, Tuple
+import asyncio
+import numpy as np
+import projection_store
+
+
+def sample_slices(n:int, samples:int) -> np.ndarray:
+    """Indices of up to samples evenly spaced slices."""
+    return np.unique(np.linspace(0, n - 1, min(n, samples)).round().astype(int))
+
+
+def sampled_histogram(stack, samples:int=8, max_pixels:int=65536, bins:int=256) -> Tuple[np.ndarray, np.ndarray]:
+    """Histogram of a strided sample of pixels from a few slices."""
+
+    values = []
+    for i in sample_slices(stack.shape[0], samples):
+        image = np.asarray(stack[i])
+        step = max(1, int(np.sqrt(image.size / max_pixels)))
+        values.append(np.ravel(image[::step, ::step]))
+
+    values = np.concatenate(values)
+    values = values[np.isfinite(values)]
+    return np.histogram(values, bins=bins)
+
+
+def estimate_range(stack, samples:int=8, max_pixels:int=65536, percentiles:Tuple[float, float]=(0.5, 99.5)) -> Tuple[float, float]:
+    """Display range from percentiles of a strided sample of pixels.
+
+    Use percentiles=(0, 100) for the sampled minimum and maximum.
+    """
+
+    counts, edges = sampled_histogram(stack, samples, max_pixels, bins=1024)
+    cdf = np.cumsum(counts) / max(counts.sum(), 1)
+    lo = edges[np.searchsorted(cdf, percentiles[0] / 100)]
+    hi = edges[min(np.searchsorted(cdf, percentiles[1] / 100) + 1, len(edges) - 1)]
+
+    if lo == hi:
+        hi = lo + 1
+    return float(lo), float(hi)
+
+
+def downsample(image:np.ndarray, max_shape:Tuple[int, int]) -> np.ndarray:
+    """Block-average an image so that it fits in max_shape pixels."""
+
+    factors = [max(1, -(-n // m)) for n, m in zip(image.shape, max_shape)]
+    if factors == [1, 1]:
+        return image
+
+    # Crop to a multiple of the block size, then average the blocks
+    rows = image.shape[0] // factors[0] * factors[0]
+    cols = image.shape[1] // factors[1] * factors[1]
+    blocks = image[:rows, :cols].reshape(rows // factors[0], factors[0], cols // factors[1], factors[1])
+    return blocks.mean(axis=(1, 3), dtype=np.double).astype(image.dtype, copy=False)
+
+
+class SliceCache():
+    """Read slices of a stack on demand, keep the recent ones and prefetch the neighbours."""
+
+    def __init__(self, stack, max_shape:Optional[Tuple[int, int]]=None, cache_size:int=16, prefetch:int=2):
+        self.stack = projection_store.as_stack(stack)
+        self.max_shape = max_shape
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self._slices = OrderedDict()
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(1) if prefetch else None
+
+    def __len__(self) -> int:
+        return self.stack.shape[0]
+
+    def _load(self, index:int) -> np.ndarray:
+        image = np.asarray(self.stack[index])
+        if self.max_shape is not None:
+            image = downsample(image, self.max_shape)
+        return image
+
+    def _insert(self, index:int, image:np.ndarray):
+        with self._lock:
+            self._slices[index] = image
+            self._slices.move_to_end(index)
+            while len(self._slices) > self.cache_size:
+                self._slices.popitem(last=False)
+
+    def _prefetch(self, index:int):
+        with self._lock:
+            if index in self._slices:
+                return
+        self._insert(index, self._load(index))
+
+    def get(self, index:int) -> np.ndarray:
+        with self._lock:
+            image = self._slices.get(index)
+            if image is not None:
+                self._slices.move_to_end(index)
+
+        if image is None:
+            image = self._load(index)
+            self._insert(index, image)
+
+        if self._executor is not None:
+            for offset in range(1, self.prefetch + 1):
+                for neighbour in (index + offset, index - offset):
+                    if 0 <= neighbour < len(self):
+                        self._executor.submit(self._prefetch, neighbour)
+        return image
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Debouncer():
+    """Call a function with the last arguments it was given once calls stop for delay seconds.
+
+    The call is scheduled on the running event loop of the caller (the
+    kernel's in Jupyter), so the function runs in the caller's thread.
+    Without a running loop, the function is called straight away.
+    """
+
+    def __init__(self, function:Callable, delay:float=0.05):
+        self.function = function
+        self.delay = delay
+        self._handle:Optional[asyncio.TimerHandle] = None
+
+    def __call__(self, *args, **kwargs):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.function(*args, **kwargs)
+            return
+
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = loop.call_later(self.delay, partial(self.function, *args, **kwargs))
+
+
+class SliceViewer():
+    """An image of one slice of a stack, with a slider and a colour range slider.
+
+    The figure, image and colour bar are created once. Changing slice only
+    swaps the image data, changing range only updates the colour limits.
+    """
+
+    def __init__(self, stack, title:str="", cmap:str="gray", index:Optional[int]=None,
+            max_shape:Tuple[int, int]=(1024, 1024), description:str="Slice", figsize=None, delay:float=0.05):
+
+        self.slices = SliceCache(stack, max_shape)
+        self.index = len(self.slices) // 2 if index is None else index
+        self.vmin, self.vmax = estimate_range(self.slices.stack)
+        self.title = title
+        self.cmap = cmap
+        self.description = description
+        self.figsize = figsize
+        self.delay = delay
+        self.figure = None
+        self.image = None
+
+    def draw(self):
+        """Create the figure on first use, update it afterwards."""
+
+        import matplotlib.pyplot as plt
+
+        data = self.slices.get(self.index)
+        if self.figure is None:
+            with plt.ioff():
+                self.figure, axes = plt.subplots(figsize=self.figsize)
+            self.image = axes.imshow(data, cmap=self.cmap, vmin=self.vmin, vmax=self.vmax)
+            self.figure.colorbar(self.image)
+            axes.set_title(self.title)
+        else:
+            self.image.set_data(data)
+            self.image.set_clim(self.vmin, self.vmax)
+            self.figure.canvas.draw_idle()
+        return self.figure
+
+    def show(self, index:int):
+        self.index = index
+        return self.draw()
+
+    def set_range(self, vmin:float, vmax:float):
+        self.vmin, self.vmax = vmin, vmax
+        return self.draw()
+
+    def widget(self, height:Optional[str]=None):
+        """Sliders and the figure, as ipywidgets."""
+
+        import ipywidgets as widgets
+        import matplotlib
+
+        slider = widgets.IntSlider(
+            value=self.index,
+            min=0,
+            max=len(self.slices)-1,
+            description=self.description,
+            readout=True)
+
+        span = self.vmax - self.vmin
+        range_slider = widgets.FloatRangeSlider(
+            value=[self.vmin, self.vmax],
+            min=self.vmin - span / 2,
+            max=self.vmax + span / 2,
+            step=span / 100,
+            description="Colour Range",
+            readout=True)
+
+        self.draw()
+
+        # With ipympl the canvas is itself a widget that redraws in place,
+        # other backends need the same figure displayed again
+        interactive = "ipympl" in matplotlib.get_backend() or "widget" in matplotlib.get_backend()
+        if interactive:
+            output = self.figure.canvas
+            refresh = lambda: None
+        else:
+            output = widgets.Output(layout=widgets.Layout(height=height) if height else widgets.Layout())
+            def refresh():
+                output.clear_output(wait=True)
+                output.append_display_data(self.figure)
+            refresh()
+
+        def update():
+            self.index = slider.value
+            self.vmin, self.vmax = range_slider.value
+            self.draw()
+            refresh()
+
+        debounced = Debouncer(update, self.delay)
+        slider.observe(lambda change: debounced(), names="value")
+        range_slider.observe(lambda change: debounced(), names="value")
+
+        return widgets.VBox((range_slider, slider, output))
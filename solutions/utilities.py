@@ -1 +0,0 @@
-../utilities.py
\ No newline at end of file
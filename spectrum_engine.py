@@ -0,0 +1,265 @@
+"""Memoised X-ray tube spectra with incremental filtration.
+
+The expensive part of a tube spectrum is xpecgen's numerical integration.
+It only depends on the high voltage, the anode and the resolution, so the
+unfiltered spectrum and its inherent filtration (1.2 mm Al + 100 cm air) are
+computed once and cached. Extra filters are then applied as a vectorised
+Beer-Lambert multiply over attenuation coefficients sampled once per
+energy grid. The coefficients come from xraylib through attenuation_tables,
+like those of the rest of the notebooks, rather than from xpecgen's tables.
+"""
+
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence, Tuple
+import numpy as np
+from scipy import optimize
+from scipy.integrate import simpson
+import xraylib as xrl
+from xpecgen import xpecgen as xg
+import attenuation_tables
+
+# Inherent filtration of the tube: (material, thickness in cm)
+INHERENT_FILTRATION = ((13, 0.12), ("air", 100.))
+
+# Dose used to normalise the spectra (as in the notebooks)
+NORM_DOSE = 0.146
+
+# Negative material identifier used by the notebooks for water
+WATER = -1
+
+# Materials of xpecgen's data folder that are not atomic numbers, as attenuation_tables knows them
+_MATERIALS = {"air": "Air, Dry (near sea level)"}
+
+
+@dataclass(frozen=True)
+class TubeSpectrum:
+    """A tube spectrum as arrays.
+
+    The continuous part is sampled at ``energies`` (keV). Characteristic
+    lines are stored as rows of ``lines``: energy (keV), number of photons
+    and peak width (keV).
+    """
+
+    key: tuple
+    energies: np.ndarray
+    counts: np.ndarray
+    lines: np.ndarray
+
+    def attenuate(self, filters:Sequence[Tuple[int|str, float]]) -> "TubeSpectrum":
+        """Apply filters to the spectrum.
+
+        Args:
+            filters: Pairs of xpecgen material identifiers and thicknesses (cm).
+
+        Returns:
+            TubeSpectrum: The filtered spectrum.
+        """
+
+        if not filters:
+            return self
+
+        exponent = np.zeros(self.energies.shape)
+        exponent_lines = np.zeros(self.lines.shape[0])
+        for material, depth in filters:
+            mu, mu_lines = _mu_on_grid(material, self.key)
+            exponent += mu * depth
+            exponent_lines += mu_lines * depth
+
+        lines = self.lines.copy()
+        lines[:, 1] *= np.exp(-exponent_lines)
+        return replace(self, counts=self.counts * np.exp(-exponent), lines=lines)
+
+    def norm(self, weight:Optional[Callable]=None) -> float:
+        """Integral of the spectrum, weighted by a function of the energy."""
+
+        if weight is None:
+            return simpson(self.counts, x=self.energies) + self.lines[:, 1].sum()
+
+        return (simpson(weight(self.energies) * self.counts, x=self.energies)
+            + np.sum(weight(self.lines[:, 0]) * self.lines[:, 1]))
+
+    def hvl(self, mu:Callable, weight:Callable, value:float=0.5) -> float:
+        """Generalised half-value layer (cm), see xpecgen.Spectrum.hvl."""
+
+        y = weight(self.energies) * self.counts
+        n_lines = weight(self.lines[:, 0]) * self.lines[:, 1]
+        norm = simpson(y, x=self.energies) + n_lines.sum()
+        y /= norm
+        n_lines /= norm
+
+        mu_continuous = mu(self.energies)
+        mu_lines = mu(self.lines[:, 0])
+
+        def f(t):
+            return (simpson(y * np.exp(-mu_continuous * t), x=self.energies)
+                + np.sum(n_lines * np.exp(-mu_lines * t)) - value)
+
+        # Bracket the root, f is monotonically decreasing
+        a = 1.0
+        if f(a) > 0:
+            while f(a) > 0:
+                a *= 10.0
+            return optimize.brentq(f, a * 0.1, a)
+        else:
+            while f(a) < 0:
+                a *= 0.1
+            return optimize.brentq(f, a, a * 10.0)
+
+    def points(self, num_discrete:int=10) -> Tuple[np.ndarray, np.ndarray]:
+        """Continuous and discrete parts merged on one mesh, see xpecgen.Spectrum.get_points."""
+
+        if self.lines.shape[0] == 0:
+            return self.energies.copy(), self.counts.copy()
+
+        E, n, width = self.lines[:, 0:1], self.lines[:, 1:2], self.lines[:, 2:3]
+        mesh = E + width * np.linspace(-1, 1, num_discrete)
+        x = np.sort(np.concatenate((mesh.ravel(), self.energies)))
+
+        y = np.interp(x, self.energies, self.counts, left=0, right=0)
+
+        # Triangular peaks of unit area
+        t = np.abs((x - E) / width)
+        y += np.sum(np.where(t > 1, 0, (1 - t) * np.abs(n / width)), axis=0)
+        return x, y
+
+
+@dataclass(frozen=True)
+class SpectrumResult:
+    """A filtered spectrum and its derived figures."""
+
+    spectrum: TubeSpectrum
+    photons: float
+    mean_energy: float
+    dose: float
+    hvl_al: float
+
+    def as_table(self) -> List[List[str]]:
+        """The figures formatted for display."""
+        return [["Dose at 1m", "%.3g mGy" % self.dose],
+                ["Nr of photons", "%.4g" % self.photons],
+                ["Average energy", "%.2f keV" % self.mean_energy],
+                ["Half-value Layer", "%.2f mm (Al)" % (10 * self.hvl_al)]]
+
+
+@lru_cache(maxsize=None)
+def get_mu(material:int|str) -> Callable:
+    """Linear attenuation coefficient (cm-1) as a function of the energy (keV), like xpecgen.get_mu().
+
+    Args:
+        material (int|str): An atomic number or an xpecgen material identifier ("air"),
+            or any material of attenuation_tables.
+    """
+
+    name = xrl.AtomicNumberToSymbol(int(material)) if isinstance(material, (int, np.integer)) else _MATERIALS.get(material, material)
+    Z, w = attenuation_tables.mass_fractions(name)
+    density = attenuation_tables.get_density(name)
+
+    def mu(energies) -> np.ndarray:
+        E = np.asarray(energies, dtype=np.double)
+        return density * (w @ attenuation_tables.cross_sections(Z, E.ravel())).reshape(E.shape)
+    return mu
+
+
+@lru_cache(maxsize=None)
+def get_fluence_to_dose() -> Callable:
+    """Memoised xpecgen.get_fluence_to_dose()."""
+    return xg.get_fluence_to_dose()
+
+
+def _as_arrays(xrs:xg.Spectrum, key:tuple) -> TubeSpectrum:
+    energies = np.asarray(xrs.x, dtype=np.double)
+    counts = np.asarray(xrs.y, dtype=np.double)
+    lines = np.asarray(xrs.discrete, dtype=np.double).reshape(-1, 3)
+    for array in (energies, counts, lines):
+        array.flags.writeable = False
+    return TubeSpectrum(key, energies, counts, lines)
+
+
+@lru_cache(maxsize=32)
+def unfiltered_spectrum(kvp:float, anode:int=74, theta:float=12, e_min:float=3, num_e:int=100, epsrel:float=0.5) -> TubeSpectrum:
+    """Spectrum produced by the tube before any filtration.
+
+    Args:
+        kvp (float): High voltage (kV).
+        anode (int): Atomic number of the anode.
+        theta (float): Anode angle (degrees).
+        e_min (float): Lowest energy of the spectrum (keV).
+        num_e (int): Number of energy bins.
+        epsrel (float): Relative tolerance of the numerical integration.
+
+    Returns:
+        TubeSpectrum: The unfiltered spectrum.
+    """
+
+    xrs = xg.calculate_spectrum(kvp, theta, e_min, num_e, epsrel=epsrel, monitor=None, z=anode)
+    return _as_arrays(xrs, (kvp, anode, theta, e_min, num_e, epsrel))
+
+
+@lru_cache(maxsize=32)
+def inherent_spectrum(kvp:float, anode:int=74, theta:float=12, e_min:float=3, num_e:int=100, epsrel:float=0.5) -> TubeSpectrum:
+    """Spectrum after the inherent filtration, normalised to NORM_DOSE at 1 m."""
+
+    spectrum = unfiltered_spectrum(kvp, anode, theta, e_min, num_e, epsrel).attenuate(INHERENT_FILTRATION)
+
+    norm = spectrum.norm(get_fluence_to_dose()) / NORM_DOSE
+    lines = spectrum.lines.copy()
+    lines[:, 1] /= norm
+    spectrum = replace(spectrum, counts=spectrum.counts / norm, lines=lines)
+
+    for array in (spectrum.counts, spectrum.lines):
+        array.flags.writeable = False
+    return spectrum
+
+
+@lru_cache(maxsize=256)
+def _mu_on_grid(material:int|str, key:tuple) -> Tuple[np.ndarray, np.ndarray]:
+    """Attenuation coefficients of a material at the energies of a spectrum."""
+
+    spectrum = unfiltered_spectrum(*key)
+    mu = get_mu(material)
+    return mu(spectrum.energies), mu(spectrum.lines[:, 0])
+
+
+def water_filtration(thickness:float) -> List[Tuple[int, float]]:
+    """Equivalent hydrogen and oxygen depths (cm) of a layer of water given in mm."""
+
+    mH2O = 2. * xrl.AtomicWeight(1) + xrl.AtomicWeight(8)
+    wH = 0.1 * thickness * 2. * xrl.AtomicWeight(1) / (attenuation_tables.get_density('H') * mH2O)
+    wO = 0.1 * thickness * xrl.AtomicWeight(8) / (attenuation_tables.get_density('O') * mH2O)
+    return [(1, wH), (8, wO)]
+
+
+def filtration(Mat_Z:int, Mat_X:float) -> List[Tuple[int, float]]:
+    """Filters corresponding to the notebook's material and thickness (mm) widgets."""
+
+    if Mat_Z > 0: # Atomic number
+        return [(Mat_Z, 0.1 * Mat_X)]
+    return water_filtration(Mat_X) # -1 == 'Water'
+
+
+def compute(E0:float, Mat_Z:int, Mat_X:float, anode:int=74) -> SpectrumResult:
+    """Filtered tube spectrum and its figures.
+
+    Args:
+        E0 (float): High voltage (kV).
+        Mat_Z (int): Atomic number of the filter, or WATER.
+        Mat_X (float): Thickness of the filter (mm).
+        anode (int): Atomic number of the anode.
+
+    Returns:
+        SpectrumResult: The spectrum, number of photons, mean energy (keV),
+        dose at 1 m (mGy) and half-value layer in aluminium (cm).
+    """
+
+    spectrum = inherent_spectrum(E0, anode).attenuate(filtration(Mat_Z, Mat_X))
+
+    fluence_to_dose = get_fluence_to_dose()
+    photons = spectrum.norm()
+
+    return SpectrumResult(
+        spectrum=spectrum,
+        photons=photons,
+        mean_energy=spectrum.norm(lambda x: x) / photons,
+        dose=spectrum.norm(fluence_to_dose),
+        hvl_al=spectrum.hvl(get_mu(13), fluence_to_dose))
@@ -0,0 +1,340 @@
+"""Parameter sweeps over JSON scan configurations, with a result cache.
+
+A sweep is a base JSON scene description and a grid of values for some of
+its entries, addressed by paths such as "Source/Beam/0/Energy" or
+"Detector/Spacing/0". Every combination of values is a variant. Its fully
+resolved configuration, with the files it refers to (meshes, energy
+responses) replaced by digests of their contents, is hashed into the key
+of its result in a content-addressed cache:
+
+    cache_dir/<key>.gvxrp   the projections, a projection store
+    cache_dir/<key>.json    the variant's parameters and configuration, written last
+
+Variants whose results are in the cache are skipped, the others are
+simulated by a pool of processes. Each process simulates one variant and
+exits, so that it owns its simulator context (gVirtualXray's OpenGL
+context or the CPU projector's pool). Results are written atomically, so a
+sweep that crashed is resumed by running it again, and changing one
+parameter of the grid only recomputes the affected points. A variant that
+fails does not stop the others, the failures are raised together at the end
+(SweepError):
+
+    runner = sweep.Sweep("JSON/notebook2.json", {"Source/Beam/0/Energy": [40, 60, 80]}, "sweeps/energy")
+    for variant, fname in runner.run(workers=4):
+        ...
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import copy
+import hashlib
+import itertools
+import json
+import os
+import numpy as np
+import acquisition
+import projection_store
+
+# Part of the keys, to invalidate the results of older versions of the runner
+SWEEP_VERSION = 1
+
+# Entries of the configuration that name files
+FILE_KEYS = ("Path", "File")
+
+# Entries of the configuration that name outputs, which do not change the projections
+OUTPUT_KEYS = ("OutFolder", "GifPath")
+
+
+def _split(path:str) -> List[str|int]:
+    return [int(part) if part.lstrip("-").isdigit() else part for part in path.strip("/").split("/")]
+
+
+def get_entry(config:dict, path:str) -> Any:
+    """Value of an entry of a configuration, e.g. "Detector/Spacing/0"."""
+
+    value = config
+    for part in _split(path):
+        value = value[part]
+    return value
+
+
+def set_entry(config:dict, path:str, value:Any):
+    """Set an entry of a configuration in place, creating missing dictionaries."""
+
+    parts = _split(path)
+    parent = config
+    for part in parts[:-1]:
+        if isinstance(part, str) and part not in parent:
+            parent[part] = {}
+        parent = parent[part]
+    parent[parts[-1]] = value
+
+
+def expand(base:dict, grid:Dict[str, Sequence[Any]]) -> List[Tuple[Dict[str, Any], dict]]:
+    """Every combination of the values of a parameter grid.
+
+    Args:
+        base (dict): The base configuration.
+        grid (Dict[str, Sequence]): Values of each entry, by path.
+
+    Returns:
+        List[Tuple[dict, dict]]: The parameters and configuration of each variant.
+    """
+
+    variants = []
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid, values))
+        config = copy.deepcopy(base)
+        for path, value in params.items():
+            set_entry(config, path, value)
+        variants.append((params, config))
+    return variants
+
+
+_digests:Dict[Tuple[str, int, int], str] = {}
+_digests_lock = Lock()
+
+
+def file_digest(fname:str|Path) -> str:
+    """SHA-1 of a file's contents, computed once per unchanged file in this process."""
+
+    fname = Path(fname)
+    stat = fname.stat()
+    key = (str(fname.resolve()), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(fname, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+
+def resolve(config:dict, base_dir:str|Path) -> dict:
+    """A copy of a configuration with absolute file names, so that it can be used from any directory."""
+
+    def visit(value):
+        if isinstance(value, dict):
+            return {k: str((Path(base_dir) / v).resolve()) if k in FILE_KEYS + OUTPUT_KEYS and isinstance(v, str) else visit(v)
+                for k, v in value.items()}
+        if isinstance(value, list):
+            return [visit(v) for v in value]
+        return value
+
+    return visit(config)
+
+
+def config_key(config:dict, engine:str) -> str:
+    """Content hash of a resolved configuration, with the files it names replaced by their digests and without its outputs."""
+
+    def visit(value):
+        if isinstance(value, dict):
+            return {k: file_digest(v) if k in FILE_KEYS and isinstance(v, str) else visit(v)
+                for k, v in value.items() if k not in OUTPUT_KEYS}
+        if isinstance(value, list):
+            return [visit(v) for v in value]
+        return value
+
+    # The window size only matters to the display
+    described = {k: v for k, v in config.items() if k != "WindowSize"}
+    description = json.dumps({"config": visit(described), "engine": engine, "version": SWEEP_VERSION}, sort_keys=True)
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def scan_angles(config:dict) -> np.ndarray:
+    """Angles of the "Scan" entry of a configuration, like json2gvxr.doCTScan (a single projection without one)."""
+
+    scan = config.get("Scan")
+    if scan is None:
+        return np.zeros(1)
+    return acquisition.scan_angles(scan["NumberOfProjections"], scan.get("FinalAngle", 360), scan.get("IncludeFinalAngle", False))
+
+
+class SweepError(RuntimeError):
+    """Raised at the end of a sweep some of whose variants failed.
+
+    Args:
+        failures (List[Tuple[Variant, BaseException]]): Each variant that failed and its error.
+    """
+
+    def __init__(self, failures:List[Tuple["Variant", BaseException]]):
+        self.failures = failures
+        details = "; ".join(f"{variant.params}: {type(error).__name__}: {error}" for variant, error in failures)
+        super().__init__(f"{len(failures)} variant(s) failed: {details}")
+
+
+@dataclass(frozen=True)
+class Variant():
+    """A point of a sweep."""
+
+    params:Dict[str, Any]
+    config:dict
+    key:str
+
+
+def _simulate(config:dict, fname:Path, engine:str, compression:Optional[str]) -> Path:
+    """Simulate a variant in a worker process and store its projections."""
+
+    # Simulators read their scene from a file
+    scene = fname.with_name(f"{fname.stem}.{os.getpid()}.scene.json")
+    with open(scene, "w") as f:
+        json.dump(config, f, indent=2)
+
+    simulator = None
+    try:
+        simulator = acquisition.simulator_from_json(scene, engine)
+        angles = scan_angles(config)
+        rows, cols = simulator.detector_shape()
+        with projection_store.create(fname, (len(angles), rows, cols), angles=angles, config=config,
+                geometry=projection_store.geometry_from_config(config), compression=compression,
+                flat=simulator.flat_field()) as writer:
+            acquisition.acquire(simulator, angles, writer=writer)
+    finally:
+        if simulator is not None and hasattr(simulator, "close"):
+            simulator.close()
+        scene.unlink(missing_ok=True)
+    return fname
+
+
+def _pool(workers:int) -> ProcessPoolExecutor:
+    # A new process per variant, so that every simulation has a context of its own (Python >= 3.11)
+    try:
+        return ProcessPoolExecutor(workers, max_tasks_per_child=1)
+    except TypeError:
+        return ProcessPoolExecutor(workers)
+
+
+class Sweep():
+    """A parameter sweep over a base JSON configuration.
+
+    Args:
+        base (str|Path|dict): The base configuration, or its file. File names in it are relative
+            to base_dir, which defaults to the directory of the file.
+        grid (Dict[str, Sequence]): Values of each entry, by path, see expand().
+        cache_dir (str|Path): Directory of the results.
+        engine (str): Simulator, see acquisition.simulator_from_json.
+        base_dir (str|Path, optional): Directory the file names of the configuration are relative to.
+        compression (str, optional): Compression of the projection stores.
+    """
+
+    def __init__(self,
+            base:str|Path|dict,
+            grid:Dict[str, Sequence[Any]],
+            cache_dir:str|Path,
+            engine:str="auto",
+            base_dir:Optional[str|Path]=None,
+            compression:Optional[str]=None):
+
+        if isinstance(base, dict):
+            config = base
+            base_dir = Path(base_dir) if base_dir is not None else Path.cwd()
+        else:
+            with open(base) as f:
+                config = json.load(f)
+            base_dir = Path(base_dir) if base_dir is not None else Path(base).parent
+
+        self.base = resolve(config, base_dir)
+        self.grid = dict(grid)
+        self.cache_dir = Path(cache_dir)
+        self.engine = engine
+        self.compression = compression
+
+    def variants(self) -> List[Variant]:
+        return [Variant(params, config, config_key(config, self.engine)) for params, config in expand(self.base, self.grid)]
+
+    def result(self, variant:Variant) -> Path:
+        return self.cache_dir / f"{variant.key}.gvxrp"
+
+    def done(self, variant:Variant) -> bool:
+        """Whether a variant's result is complete, its manifest being written last."""
+        return (self.cache_dir / f"{variant.key}.json").exists() and self.result(variant).exists()
+
+    def _commit(self, variant:Variant):
+        manifest = self.cache_dir / f"{variant.key}.json"
+        tmp = manifest.with_name(f"{manifest.name}.{os.getpid()}.partial")
+        with open(tmp, "w") as f:
+            json.dump({"params": variant.params, "config": variant.config, "engine": self.engine,
+                "version": SWEEP_VERSION, "result": self.result(variant).name}, f, indent=2)
+        os.replace(tmp, manifest)
+
+    def run(self, workers:int=1, progress:Optional[Callable[[int, int], None]]=None) -> Iterator[Tuple[Variant, Path]]:
+        """Simulate the variants that are not in the cache.
+
+        Args:
+            workers (int): Number of processes, each simulating one variant at a time.
+            progress (Callable, optional): Called with (number of variants done, total) as they finish.
+
+        Yields:
+            Tuple[Variant, Path]: Every variant and its projection store, cached ones first.
+
+        Raises:
+            SweepError: Once the other variants are done and committed, if some failed.
+        """
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        variants = self.variants()
+        todo = {}
+        done = 0
+        for variant in variants:
+            # Identical variants share a result
+            if self.done(variant):
+                done += 1
+                if progress is not None:
+                    progress(done, len(variants))
+                yield variant, self.result(variant)
+            else:
+                todo.setdefault(variant.key, []).append(variant)
+
+        if not todo:
+            return
+
+        with _pool(workers) as executor:
+            futures = {executor.submit(_simulate, same[0].config, self.result(same[0]), self.engine, self.compression): same
+                for same in todo.values()}
+            failures = []
+            for future in as_completed(futures):
+                try:
+                    fname = future.result()
+                except Exception as e:
+                    # The other variants go on, and are committed as they finish
+                    failures += [(variant, e) for variant in futures[future]]
+                    continue
+                for variant in futures[future]:
+                    self._commit(variant)
+                    done += 1
+                    if progress is not None:
+                        progress(done, len(variants))
+                    yield variant, fname
+
+        if failures:
+            raise SweepError(failures)
+
+    def results(self) -> List[Tuple[Variant, Optional[Path]]]:
+        """Every variant and its projection store, None for those not simulated yet."""
+        return [(variant, self.result(variant) if self.done(variant) else None) for variant in self.variants()]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a parameter sweep over a JSON scan configuration.")
+    parser.add_argument("config", help="Base JSON configuration")
+    parser.add_argument("grid", help="JSON file mapping entry paths (e.g. \"Source/Beam/0/Energy\") to lists of values")
+    parser.add_argument("cache_dir", help="Directory of the results")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes")
+    parser.add_argument("--engine", default="auto", choices=("auto", "gvxr", "cpu"), help="Simulator")
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+
+    runner = Sweep(args.config, grid, args.cache_dir, engine=args.engine)
+    for variant, fname in runner.run(args.workers, progress=lambda i, n: print(f"{i}/{n}", end="\r")):
+        print(f"{fname.name}: {variant.params}")
@@ -0,0 +1,111 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import numpy as np
+import pytest
+import acquisition
+import projection_store
+
+SCENE = Path(__file__).resolve().parent.parent / "JSON" / "notebook4-parallel_beam.json"
+
+
+class FlakyExecutor():
+    """Runs tasks in the calling thread: the first task fails, then the pool breaks while it is submitted again."""
+
+    pools = 0
+
+    def __init__(self, *args, **kwargs):
+        FlakyExecutor.pools += 1
+        self.pool = FlakyExecutor.pools
+        self.submitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, function, *args):
+        self.submitted += 1
+        if self.pool == 1 and self.submitted > 2:
+            raise BrokenProcessPool("A worker died")
+
+        future = Future()
+        if self.pool == 1 and self.submitted == 1:
+            future.set_exception(RuntimeError("Rendering failed"))
+        else:
+            future.set_result((args[4], 1.0, []))
+        return future
+
+
+def test_resubmit_to_broken_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(acquisition, "ProcessPoolExecutor", FlakyExecutor)
+    monkeypatch.setattr(FlakyExecutor, "pools", 0)
+    done = []
+    acquisition.acquire_parallel(SCENE, np.arange(4.), tmp_path / "scan.gvxrp", workers=1, engine="cpu", chunk=2,
+        progress=lambda n, total: done.append(n))
+    # The failed chunk is rendered by a new pool
+    assert FlakyExecutor.pools == 2
+    assert done[-1] == 4
+
+
+def test_retries_exhausted(tmp_path, monkeypatch):
+    class Failing(FlakyExecutor):
+        def submit(self, function, *args):
+            future = Future()
+            future.set_exception(RuntimeError("Rendering failed"))
+            return future
+
+    monkeypatch.setattr(acquisition, "ProcessPoolExecutor", Failing)
+    with pytest.raises(RuntimeError, match="Rendering failed"):
+        acquisition.acquire_parallel(SCENE, np.arange(4.), tmp_path / "scan.gvxrp", workers=1, engine="cpu", retries=1)
+
+
+def test_gvxr_centre_of_rotation(tmp_path, monkeypatch):
+    import json
+    import sys
+    import types
+    import scene_graph
+
+    # gVirtualXray is not needed to check which scene the simulator sets up
+    gvxr = types.SimpleNamespace(getRootTransformationMatrix=lambda: scene_graph.to_gl(np.eye(4)))
+    json2gvxr = types.SimpleNamespace(**{name: lambda *args: None for name in
+        ("initGVXR", "initSourceGeometry", "initSpectrum", "initDetector", "initSamples")})
+    monkeypatch.setitem(sys.modules, "gvxrPython3", types.SimpleNamespace(gvxr=gvxr, json2gvxr=json2gvxr))
+
+    with open(SCENE) as f:
+        config = json.load(f)
+    config["Scan"] = {**config.get("Scan", {}), "CenterOfRotation": [1, 2, 3, "cm"]}
+    fname = tmp_path / "scene.json"
+    with open(fname, "w") as f:
+        json.dump(config, f)
+
+    simulator = acquisition.GVXRSimulator.from_json(fname)
+    assert np.allclose(simulator.scene.centre, (10, 20, 30))
+    assert tuple(simulator.rotation_axis) == tuple(config["Detector"]["UpVector"])
+
+
+class FailingSimulator(acquisition.MockSimulator):
+    """Fails at the fifth projection."""
+
+    def compute_into(self, out):
+        if self.calls == 4:
+            raise RuntimeError("Rendering failed")
+        super().compute_into(out)
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_failed_scan_leaves_no_store(tmp_path, compression):
+    simulator = FailingSimulator((8, 8))
+    fname = tmp_path / "scan.gvxrp"
+    with pytest.raises(RuntimeError, match="Rendering failed"):
+        with projection_store.create(fname, (10, 8, 8), compression=compression) as store:
+            acquisition.acquire(simulator, np.arange(10.), out=store.stack, writer=store)
+    assert not list(tmp_path.iterdir())
+
+
+def test_scan_to_store(tmp_path):
+    simulator = acquisition.MockSimulator((8, 8))
+    with projection_store.create(tmp_path / "scan.gvxrp", (10, 8, 8), compression="zlib") as store:
+        projections = acquisition.acquire(simulator, np.arange(10.), writer=store)
+    assert np.array_equal(projection_store.open_store(tmp_path / "scan.gvxrp")[:], projections)
@@ -0,0 +1,29 @@
+import numpy as np
+import attenuation_tables
+
+
+def table(values) -> attenuation_tables.AttenuationTable:
+    energies = np.arange(1., len(values) + 1)
+    ones = np.ones(len(values))
+    return attenuation_tables.AttenuationTable("test", 1., energies, np.asarray(values, dtype=np.double), ones, ones, ones)
+
+
+def test_interpolate_zeros():
+    mu = table([5, 0, 0, 2, 1]).interpolate(np.linspace(1, 5, 41))
+    assert np.all(np.isfinite(mu))
+    assert np.all(mu[10:20] == 0)
+    # Linear in log-energy next to a zero, log-log between positive values
+    assert np.isclose(mu[5], 5 * (1 - np.log(1.5) / np.log(2)))
+    assert np.isclose(mu[35], np.exp(np.interp(np.log(4.5), np.log([4, 5]), np.log([2, 1]))))
+
+
+def test_interpolate_clamps():
+    t = table([4, 3, 2])
+    assert np.allclose(t.interpolate([0.1, 1, 3, 100]), [4, 4, 2, 2])
+    assert np.shape(t.interpolate(2.)) == ()
+
+
+def test_interpolate_grid():
+    t = attenuation_tables.compute_table("W", energies=np.geomspace(10, 200, 50))
+    assert np.allclose(t.interpolate(t.energies), t.total)
+    assert np.allclose(t.interpolate(t.energies, "photo"), t.photo)
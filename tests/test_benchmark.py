@@ -0,0 +1,39 @@
+import benchmark
+
+
+def results(median:float, peak_mb:float=10, children_peak_mb:float=0) -> dict:
+    return {"cases": {"case": {"median": median, "best": median, "peak_mb": peak_mb, "children_peak_mb": children_peak_mb}}}
+
+
+def status(result:dict, baseline:dict) -> str:
+    return benchmark.compare(result, baseline)[0]["status"]
+
+
+def test_noise_floor():
+    # A 1.2 ms run against a 0.7 ms baseline is noise, not a regression
+    assert status(results(0.0012), results(0.0007)) == "ok"
+    assert status(results(0.0007), results(0.0012)) == "ok"
+    assert status(results(0.2), results(0.1)) == "regression"
+    assert status(results(0.1), results(0.2)) == "faster"
+    assert status(results(0.11), results(0.1)) == "ok"
+
+
+def test_memory():
+    assert status(results(0.1, 100), results(0.1, 50)) == "regression"
+    assert status(results(0.1, 12), results(0.1, 4)) == "ok"
+    # The workers' memory is compared too
+    assert status(results(0.1, 10, 200), results(0.1, 10, 100)) == "regression"
+    assert status(results(0.1, 10, 100), results(0.1, 10, 0)) == "ok"
+    benchmark.report(benchmark.compare(results(0.1, 10, 200), results(0.1, 10, 100)), file=False)
+
+
+def test_missing_cases():
+    assert status(results(0.1), {"cases": {}}) == "new"
+    assert status({"cases": {"case": {"skipped": "no CIL"}}}, results(0.1)) == "skipped"
+    assert status({"cases": {"case": {"error": "ValueError"}}}, results(0.1)) == "error"
+
+
+def test_quick_cases_are_registered():
+    ids = [case.id for case in benchmark.cases("quick")]
+    assert len(ids) == len(set(ids))
+    assert all(case.benchmark in benchmark.BENCHMARKS for case in benchmark.cases("full"))
@@ -0,0 +1,64 @@
+from pathlib import Path
+import subprocess
+import sys
+import pytest
+from utilities import capabilities
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def features(monkeypatch, tmp_path):
+    # Fake features, with a module that is installed but fails to import
+    (tmp_path / "broken_dependency.py").write_text("raise RuntimeError('no backend')\n")
+    (tmp_path / "unused_dependency.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(capabilities, "FEATURES", {
+        "ok": ("json",),
+        "absent": ("json", "no_such_dependency"),
+        "broken": ("broken_dependency",),
+        "unused": ("unused_dependency",),
+    })
+    capabilities._probe.cache_clear()
+    yield
+    capabilities._probe.cache_clear()
+
+
+def test_installed():
+    assert capabilities.installed("numpy")
+    assert not capabilities.installed("no_such_dependency")
+    assert not capabilities.installed("no_such_dependency.module")
+
+
+def test_has(features):
+    assert capabilities.has("ok")
+    assert capabilities.missing("ok") is None
+    capabilities.require("ok")
+
+    assert not capabilities.has("absent")
+    assert capabilities.missing("absent") == "no_such_dependency is not installed"
+    assert not capabilities.has("broken")
+    assert "failed to import: no backend" in capabilities.missing("broken")
+    with pytest.raises(ImportError, match="'broken' is unavailable"):
+        capabilities.require("broken")
+
+
+def test_summary_does_not_import(features):
+    summary = capabilities.summary()
+    assert summary == {"ok": None, "absent": "no_such_dependency is not installed", "broken": None, "unused": None}
+    assert "unused_dependency" not in sys.modules
+
+
+def test_lazy_package():
+    # Importing the helpers, or one of them, does not import the heavy dependencies
+    code = ("import sys, utilities; from utilities import recon_parallel; "
+        "print(' '.join(m for m in ('utilities.widgets', 'utilities.spectra', 'matplotlib', 'xpecgen', 'cil') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+
+
+def test_import_cost():
+    seconds, mb, modules = capabilities.import_cost("json", repeat=1)
+    assert seconds >= 0 and modules > 0
+    with pytest.raises(ImportError):
+        capabilities.import_cost("no_such_dependency", repeat=1)
@@ -0,0 +1,47 @@
+import numpy as np
+import attenuation_tables
+import content_cache
+import material_basis
+
+
+def test_lru_and_disk(tmp_path):
+    cache = content_cache.ContentCache(maxsize=2, cache_dir=tmp_path)
+    calls = []
+
+    def compute(value):
+        def run():
+            calls.append(value)
+            return np.full(3, value)
+        return run
+
+    for key in "aba":
+        cache.lookup(key, compute(ord(key)))
+    assert calls == [ord("a"), ord("b")]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # Evicted from memory, then read back from its file
+    cache.lookup("c", compute(ord("c")))
+    value = cache.lookup("b", compute(0))
+    assert np.array_equal(value, np.full(3, ord("b"))) and not value.flags.writeable
+    assert sorted(fname.name for fname in tmp_path.iterdir()) == ["a.npy", "b.npy", "c.npy"]
+
+    cache.clear(disk=True)
+    assert not list(tmp_path.iterdir()) and cache.misses == 0
+
+
+def test_attenuation_tables_on_disk(tmp_path):
+    energies = np.linspace(10, 100, 7)
+    table = attenuation_tables.AttenuationCache(cache_dir=tmp_path).get("Ti", energies=energies)
+    other = attenuation_tables.AttenuationCache(cache_dir=tmp_path)
+    loaded = other.get("Ti", energies=energies)
+    assert other.misses == 1 and loaded.material == "Ti" and loaded.density == table.density
+    assert np.array_equal(loaded.total, table.total)
+
+
+def test_basis_ignores_densities(tmp_path):
+    cache = material_basis.BasisCache(cache_dir=tmp_path)
+    energies = np.linspace(10, 100, 7)
+    basis = cache.get(["Ti", "Al"], energies)
+    denser = cache.get([material_basis.Material.from_name("Ti", 5.), "Al"], energies)
+    assert cache.hits == 1 and denser.mass_attenuation is basis.mass_attenuation
+    assert np.allclose(material_basis.BasisCache(cache_dir=tmp_path).get(["Ti", "Al"], energies).mass_attenuation, basis.mass_attenuation)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import cpu_projector
+import mesh_io
+import phantom_mesh
+
+RADIUS = 10.
+SPACING = 0.5
+
+
+def geometry(shape=(64, 64)) -> cpu_projector.Geometry:
+    # Parallel beam along +y, columns along -x and rows along +z
+    return cpu_projector.Geometry(np.array([0., -100., 0.]), np.array([0., 100., 0.]), np.array([0., 0., 1.]),
+        np.array([-1., 0., 0.]), shape, (SPACING, SPACING), True)
+
+
+def sphere(centre=(0, 0, 0)) -> mesh_io.Mesh:
+    return mesh_io.Mesh.from_triangles(phantom_mesh.sphere_triangles(centre, RADIUS, 96))
+
+
+def test_sphere_chords():
+    mesh = sphere()
+    lengths = cpu_projector.mesh_path_lengths(mesh.vertices, mesh.indices, geometry())
+
+    u, v = geometry().pixel_coordinates(0, 64)
+    r2 = u ** 2 + v ** 2
+    expected = 2 * np.sqrt(np.maximum(RADIUS ** 2 - r2, 0))
+    # The mesh is inscribed in the sphere, away from its silhouette the chords match to within its facets
+    inside = r2 < (0.9 * RADIUS) ** 2
+    assert np.allclose(lengths[inside], expected[inside], rtol=0.01)
+    assert np.all(lengths[r2 > RADIUS ** 2] == 0)
+    assert lengths.max() == pytest.approx(2 * RADIUS, rel=0.01)
+
+
+def test_offset_sphere():
+    mesh = sphere((5, 0, -3))
+    lengths = cpu_projector.mesh_path_lengths(mesh.vertices, mesh.indices, geometry())
+
+    # x = 5 mm is 10 pixels left of the centre (columns run along -x), z = -3 mm 6 rows below it
+    row, col = np.unravel_index(np.argmax(lengths), lengths.shape)
+    assert abs(col - (31.5 - 10)) <= 1
+    assert abs(row - (31.5 - 6)) <= 1
+
+    # Rows [start, stop) are the same as in the whole image
+    assert np.array_equal(cpu_projector.mesh_path_lengths(mesh.vertices, mesh.indices, geometry(), 20, 40), lengths[20:40])
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+import detector
+import projection_store
+
+LSF = np.array([0.05, 0.2, 0.5, 0.2, 0.05])
+
+
+def test_convolve_axis():
+    rng = np.random.default_rng(0)
+    images = rng.random((3, 20, 30))
+    kernel = rng.random(21)
+
+    direct = detector.convolve_axis(images, kernel, axis=-1, method="direct")
+    assert np.allclose(detector.convolve_axis(images, kernel, axis=-1, method="fft"), direct)
+    # Away from the padded borders, the usual convolution
+    assert np.allclose(direct[..., 10:-10], np.apply_along_axis(np.convolve, -1, images, kernel, "valid"))
+    assert np.allclose(detector.convolve_axis(images, kernel, axis=1), np.swapaxes(
+        detector.convolve_axis(np.swapaxes(images, 1, 2), kernel, axis=-1), 1, 2))
+
+    with pytest.raises(ValueError):
+        detector.convolve_axis(images, kernel[:-1])
+    with pytest.raises(ValueError):
+        detector.convolve_axis(images, kernel, mode="wrap")
+
+
+def test_apply_lsf():
+    flat = np.full((16, 16), 3., dtype=np.single)
+    blurred = detector.apply_lsf(flat, 2 * LSF)
+    assert blurred.dtype == np.single
+    assert np.allclose(blurred, 3)
+
+    impulse = np.zeros((15, 15))
+    impulse[7, 7] = 1
+    blurred = detector.apply_lsf(impulse, LSF)
+    # A separable point spread function that keeps the energy
+    assert np.allclose(blurred[5:10, 5:10], np.outer(LSF, LSF))
+    assert blurred.sum() == pytest.approx(1)
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_process_stack(tmp_path, compression):
+    stack = np.random.default_rng(1).random((7, 12, 10), dtype=np.single)
+    src = projection_store.save(tmp_path / "ideal.gvxrp", stack, flat=2.)
+    model = detector.DetectorModel(lsf=LSF)
+
+    dst = detector.process_stack(src, tmp_path / "blurred.gvxrp", model, workers=2, batch=3, compression=compression)
+    store = projection_store.open_store(dst)
+    assert np.allclose(store[:], detector.apply_lsf(stack, LSF))
+    assert np.allclose(store.flat, 2)
+
+
+def test_bin_pixels():
+    images = np.arange(2 * 7 * 9, dtype=np.uint16).reshape(2, 7, 9)
+    binned = detector.bin_pixels(images, (2, 3))
+    assert binned.shape == detector.binned_shape(images.shape, (2, 3)) == (2, 3, 3)
+    assert binned.dtype == np.single
+
+    # Blocks of 2 rows x 3 columns, the last row dropped
+    expected = images[:, :6].reshape(2, 3, 2, 3, 3).sum(axis=(2, 4))
+    assert np.array_equal(binned, expected)
+    assert np.allclose(detector.bin_pixels(images, (2, 3), mean=True), expected / 6)
+
+    out = np.zeros((2, 3, 3), dtype=np.double)
+    assert detector.bin_pixels(images, (2, 3), out=out) is out
+    assert np.array_equal(out, expected)
+    assert np.array_equal(detector.bin_pixels(images, 1), images)
+
+
+def test_binned_geometry():
+    geometry = {"type": "parallel", "number_of_pixels": [9, 7], "pixel_size": [0.1, 0.2]}
+    binned = detector.binned_geometry(geometry, (2, 3))
+    assert binned["number_of_pixels"] == [3, 3]
+    assert np.allclose(binned["pixel_size"], [0.3, 0.4])
+    assert geometry["number_of_pixels"] == [9, 7]
+
+
+def test_binned_model():
+    model = detector.DetectorModel(binning=2, mean=True)
+    assert model.output_shape((8, 6)) == (4, 3)
+    assert np.allclose(model.apply(np.ones((2, 8, 6))), 1)
+
+
+def test_roi():
+    images = np.arange(2 * 8 * 6).reshape(2, 8, 6)
+    band = detector.ROI.band(2, 5, (1, 4))
+    assert band.shape((8, 6)) == (3, 3)
+    assert band.runs(8) == [(2, 5)] and band.is_band(8)
+    assert np.shares_memory(band.crop(images), images)
+    assert np.array_equal(band.crop(images), images[:, 2:5, 1:4])
+
+    rows = detector.ROI(rows=[0, 1, 5])
+    assert rows.runs(8) == [(0, 2), (5, 6)] and not rows.is_band(8)
+    assert np.array_equal(rows.crop(images), images[:, [0, 1, 5]])
+
+    for invalid in (dict(rows=[3, 2]), dict(rows=[-1, 0]), dict(rows=[]), dict(columns=(4, 4))):
+        with pytest.raises(ValueError):
+            detector.ROI(**invalid)
+    with pytest.raises(ValueError):
+        band.shape((4, 6))
+
+
+def test_roi_geometry():
+    geometry = {"type": "parallel", "number_of_pixels": [6, 8], "pixel_size": [1., 1.]}
+    roi = detector.ROI.band(2, 5, (1, 4))
+    cropped = detector.roi_geometry(geometry, roi)
+    assert cropped["number_of_pixels"] == [3, 3]
+    assert detector.ROI.from_geometry(cropped) == roi
+    assert detector.ROI.from_geometry(geometry) is None
+
+    # The detector centre, column 2.5 and row 3.5, in the coordinates of the region
+    assert detector.roi_centre(cropped) == (1.5, 1.5)
+    assert detector.roi_centre(geometry) is None
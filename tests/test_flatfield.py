@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+import flatfield
+import projection_store
+
+
+@pytest.fixture(scope="module")
+def raw(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    stack = rng.integers(100, 4000, size=(21, 12, 10)).astype(np.uint16)
+    flat = rng.uniform(3500, 4500, size=(12, 10)).astype(np.single)
+    dark = rng.uniform(50, 100, size=(12, 10)).astype(np.single)
+    return projection_store.save(tmp_path_factory.mktemp("raw") / "raw.gvxrp", stack, angles=np.arange(21.), flat=flat, dark=dark)
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_workers_are_bit_identical(raw, tmp_path, compression):
+    src = projection_store.open_store(raw)
+    expected = flatfield.correct(src[:], src.flat, src.dark, 1e-4, log=True)
+
+    outputs = []
+    for workers, batch in ((1, 21), (1, 4), (3, 2)):
+        dst = flatfield.process_stack(raw, tmp_path / f"corrected-{workers}-{batch}.gvxrp", min_intensity=1e-4, log=True,
+            workers=workers, batch=batch, compression=compression)
+        outputs.append(projection_store.open_store(dst)[:])
+
+    for output in outputs:
+        assert output.dtype == np.single
+        assert np.array_equal(output, expected)
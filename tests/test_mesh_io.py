@@ -0,0 +1,56 @@
+import numpy as np
+import mesh_io
+import phantom_mesh
+
+
+def test_stl_round_trip(tmp_path):
+    triangles = phantom_mesh.sphere_triangles([1, 2, 3], 2, 12).astype(np.single)
+    fname = mesh_io.write_stl(tmp_path / "sphere.stl", triangles, "sphere")
+    assert mesh_io.is_binary_stl(fname)
+    assert np.array_equal(mesh_io.read_triangles(fname), triangles)
+
+    records = mesh_io.read_records(fname)
+    assert np.allclose(records["normal"], mesh_io.face_normals(triangles))
+    # Outward normals of a sphere
+    assert np.all(np.einsum("ij,ij->i", records["normal"], triangles.mean(axis=1) - [1, 2, 3]) > 0)
+
+
+def test_ascii_stl(tmp_path):
+    fname = tmp_path / "triangle.stl"
+    fname.write_text("solid t\nfacet normal 0 0 1\nouter loop\nvertex 0 0 0\nvertex 1 0 0\nvertex 0 1 0\n"
+        "endloop\nendfacet\nendsolid t\n")
+    assert not mesh_io.is_binary_stl(fname)
+    assert np.array_equal(mesh_io.read_triangles(fname), [[[0, 0, 0], [1, 0, 0], [0, 1, 0]]])
+
+
+def test_indexed_mesh(tmp_path):
+    triangles = phantom_mesh.sphere_triangles([0, 0, 0], 1, 12).astype(np.single)
+    mesh = mesh_io.Mesh.from_triangles(triangles, "sphere")
+    assert np.array_equal(mesh.triangles(), triangles)
+    # Each vertex of a closed mesh is shared: V - E + F = 2 with E = 3F / 2
+    assert mesh.n_vertices == mesh.n_triangles // 2 + 2
+    assert np.allclose(mesh.bounds(), ([-1, -1, -1], [1, 1, 1]), atol=0.1)
+
+    # The same file gives the cached mesh, a modified one is read again
+    fname = mesh.save(tmp_path / "sphere.stl")
+    first = mesh_io.load(fname)
+    assert mesh_io.load(fname, "other").vertices is first.vertices
+    # A different size, as the modification time may not change on coarse file systems
+    mesh_io.write_stl(fname, phantom_mesh.sphere_triangles([0, 0, 0], 2, 16))
+    assert mesh_io.load(fname).n_triangles != first.n_triangles
+
+
+def test_shared_meshes():
+    mesh = mesh_io.Mesh.from_triangles(phantom_mesh.sphere_triangles([0, 0, 0], 1, 8), "sphere")
+    with mesh_io.SharedMeshes() as shared:
+        info = shared.publish(mesh)
+        try:
+            mesh_io.attach_all([info])
+            attached = mesh_io.worker_mesh("sphere")
+            assert np.array_equal(attached.vertices, mesh.vertices)
+            assert np.array_equal(attached.indices, mesh.indices)
+            assert not attached.vertices.flags.writeable
+        finally:
+            block, attached = mesh_io._attached.pop(info.name)
+            del attached
+            block.close()
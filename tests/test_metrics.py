@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import detector
+import metrics
+
+
+@pytest.fixture(scope="module")
+def images():
+    rng = np.random.default_rng(0)
+    return rng.random((3, 24, 20))
+
+
+def star(size:int, n_sectors:int) -> np.ndarray:
+    # Sectors of value 1 on a background of 0, n_sectors square wave periods around the centre
+    y, x = np.mgrid[:size, :size] - (size - 1) / 2
+    return (np.floor(n_sectors * np.arctan2(y, x) / np.pi) % 2 == 0).astype(np.double)
+
+
+def test_zncc(images):
+    assert np.allclose(metrics.zncc(images, 2 * images + 3), 1)
+    assert np.allclose(metrics.zncc(images, -images), -1)
+    assert metrics.zncc(images, images[::-1]).shape == (3,)
+    assert abs(metrics.zncc(images[0], images[1])) < 0.2
+
+    with pytest.raises(ValueError):
+        metrics.zncc(images, images[..., 1:])
+
+
+def test_rmse_psnr(images):
+    assert np.allclose(metrics.rmse(images, images + 0.1), 0.1)
+    assert np.allclose(metrics.psnr(images, images + 0.1, data_range=1), 20)
+
+
+def test_ssim(images):
+    assert np.allclose(metrics.ssim(images, images), 1)
+
+    # A direct computation over every 7 x 7 window of one image
+    a, b = images[0], np.clip(images[0] + np.random.default_rng(1).normal(0, 0.1, images[0].shape), 0, 1)
+    c1, c2 = (0.01 * np.ptp(a)) ** 2, (0.03 * np.ptp(a)) ** 2
+    values = []
+    for i in range(a.shape[0] - 6):
+        for j in range(a.shape[1] - 6):
+            x, y = a[i:i + 7, j:j + 7].ravel(), b[i:i + 7, j:j + 7].ravel()
+            cov = np.cov(x, y)
+            values.append((2 * x.mean() * y.mean() + c1) * (2 * cov[0, 1] + c2)
+                / ((x.mean() ** 2 + y.mean() ** 2 + c1) * (cov[0, 0] + cov[1, 1] + c2)))
+    assert metrics.ssim(a, b) == pytest.approx(np.mean(values))
+    assert metrics.ssim(a, b) < 1
+
+
+def test_siemens_star_mtf():
+    image = star(201, 16)
+    radii = np.array([40., 60., 90.])
+    frequencies, mtf = metrics.siemens_star_mtf(image, 16, radii, contrast=1)
+    assert np.allclose(frequencies, 16 / (2 * np.pi * radii))
+    # A sharp star is fully modulated at every radius
+    assert np.allclose(mtf, 1, atol=0.05)
+
+    # Blurred, the modulation drops with the frequency
+    blurred = detector.apply_lsf(np.stack((image, image)), np.exp(-0.5 * (np.arange(-6, 7) / 2) ** 2))
+    frequencies, mtf = metrics.siemens_star_mtf(blurred, 16, radii)
+    assert mtf.shape == (2, 3)
+    assert np.allclose(mtf[:, -1], 1)
+    assert np.all(np.diff(mtf, axis=-1) > 0.05)
+
+
+def test_compare_stacks(images):
+    target = images + np.random.default_rng(2).normal(0, 0.05, images.shape)
+    scores = metrics.compare_stacks(images, target, ("rmse", "zncc", "ssim", "psnr"), batch=2)
+    assert np.allclose(scores["zncc"], metrics.zncc(images, target))
+    assert np.allclose(scores["ssim"], metrics.ssim(images, target))
+    assert scores["stack_zncc"] == pytest.approx(float(metrics.zncc(images.reshape(1, -1), target.reshape(1, -1))))
+    assert scores["stack_rmse"] == pytest.approx(np.sqrt(np.mean((images - target) ** 2)))
+
+    with pytest.raises(ValueError):
+        metrics.compare_stacks(images, target, ("mae",))
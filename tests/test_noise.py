@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import noise
+import projection_store
+
+
+@pytest.fixture
+def images():
+    return np.linspace(0.1, 2., 6 * 16 * 20, dtype=np.single).reshape(6, 16, 20)
+
+
+MODEL = noise.NoiseModel(photons=1000, flat=2., electronic=0.01)
+
+
+def test_reproducible(images):
+    first = MODEL.apply(images, 42)
+    assert np.array_equal(MODEL.apply(images, 42), first)
+    assert np.array_equal(MODEL.apply(images, np.random.SeedSequence(42)), first)
+    assert not np.array_equal(MODEL.apply(images, 43), first)
+    assert not np.array_equal(MODEL.apply(images, 42, realisation=1), first)
+
+
+def test_projections_are_independent_of_batches(images):
+    whole = MODEL.apply(images, 7, realisation=3)
+    # Any projection can be recomputed alone, from its index in the stack
+    assert np.array_equal(MODEL.apply(images[4], 7, realisation=3, start=4), whole[4])
+    assert np.array_equal(np.concatenate([MODEL.apply(images[i:i + 4], 7, 3, start=i) for i in (0, 4)]), whole)
+
+
+def test_statistics():
+    model = noise.NoiseModel(photons=400, flat=1.)
+    flat = np.full((1, 200, 200), 0.5, dtype=np.single)
+    noisy = model.apply(flat, 0)
+    # 200 photons per pixel on average
+    assert np.isclose(noisy.mean(), 0.5, rtol=0.01)
+    assert np.isclose(noisy.var(), 0.5 * model.gain, rtol=0.05)
+    assert noisy.dtype == np.single
+
+
+@pytest.mark.parametrize("workers, batch, compression", [(1, 6, None), (3, 1, None), (2, 4, "zlib")])
+def test_process_stack(tmp_path, images, workers, batch, compression):
+    src = projection_store.save(tmp_path / "clean.gvxrp", images, angles=np.arange(6.), flat=2.)
+    outputs = noise.process_stack(src, [tmp_path / "a.gvxrp", tmp_path / "b.gvxrp"], MODEL, seed=5, realisations=[0, 2],
+        workers=workers, batch=batch, compression=compression)
+
+    for fname, realisation in zip(outputs, [0, 2]):
+        store = projection_store.open_store(fname)
+        assert np.array_equal(store[:], MODEL.apply(images, 5, realisation))
+        assert store.metadata["noise"]["realisation"] == realisation
+        assert np.array_equal(store.angles, np.arange(6.))
@@ -0,0 +1,70 @@
+from collections import Counter
+import numpy as np
+import pytest
+import mesh_io
+import phantom_mesh
+import phantoms
+
+
+def check_closed(triangles:np.ndarray):
+    """Every edge is traversed as many times in each direction, by consistently oriented triangles.
+
+    Solids that touch along an edge (the sectors of a Siemens star) share it between more than two triangles.
+    """
+
+    indices = mesh_io.Mesh.from_triangles(triangles).indices
+    edges = Counter(map(tuple, indices[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2).tolist()))
+    assert all(edges[b, a] == count for (a, b), count in edges.items())
+
+
+def volume(triangles:np.ndarray) -> float:
+    # Divergence theorem, positive for outward-facing triangles
+    return np.einsum("ij,ij->", triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])) / 6
+
+
+def area(polygon:np.ndarray) -> float:
+    x, y = np.asarray(polygon).T
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def test_spheres():
+    triangles = phantom_mesh.sphere_triangles([[0, 0, 0], [3, 0, 0]], [1, 0.5], 48)
+    check_closed(triangles)
+    # Inscribed in the spheres, a little smaller
+    exact = 4 / 3 * np.pi * (1 + 0.5 ** 3)
+    assert 0.98 * exact < volume(triangles) < exact
+
+
+def test_prisms():
+    square = phantom_mesh.circle_points(np.zeros((1, 2)), [1], 4)[0]
+    triangle = np.array([[3, 0], [2, 1], [4, 1]])
+    triangles = phantom_mesh.prism_triangles([square, triangle], -1, 1)
+    check_closed(triangles)
+    assert volume(triangles) == pytest.approx(2 * (2 + 1))
+
+
+def test_plate_with_holes():
+    # Through holes: the sectors of a Siemens star, which touch at the centre
+    star = phantoms.SiemensStar(4, radius=0.4)
+    triangles = phantom_mesh.triangles(star, with_plate="subtract", scale=1)[0]
+    check_closed(triangles)
+    holes = sum(area(sector) for sector in star.vertices)
+    assert volume(triangles) == pytest.approx((1 - holes) * phantom_mesh.PLATE_THICKNESS)
+
+    # Blind holes: the circles only reach the top half of the plate
+    circles = phantoms.DogaCircles(n_sizes=2, n_shuffles=2)
+    triangles = phantom_mesh.triangles(circles, with_plate="subtract", scale=1)[0]
+    check_closed(triangles)
+    holes = sum(area(polygon) for polygon in phantom_mesh._polygons(circles, None))
+    assert volume(triangles) == pytest.approx((1 - holes / 2) * phantom_mesh.PLATE_THICKNESS)
+
+
+def test_cache(tmp_path):
+    cache = phantom_mesh.MeshCache(tmp_path)
+    files = cache.get("SiemensStar", n_sectors=3)
+    # The defaults are part of the key
+    assert cache.get("SiemensStar", n_sectors=3, radius=0.5) == files
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.get("SiemensStar", n_sectors=3, scale=10) != files
+
+    check_closed(mesh_io.read_triangles(files[0]))
@@ -0,0 +1,25 @@
+import numpy as np
+import phantom_raster
+
+
+def spheres(n:int=20) -> phantom_raster.Scene:
+    rng = np.random.default_rng(0)
+    return phantom_raster.Scene([phantom_raster.Spheres(rng.uniform(-0.3, 0.3, (n, 3)), rng.uniform(0.02, 0.1, n))])
+
+
+def test_voxelize_sphere_volume():
+    scene = phantom_raster.Scene([phantom_raster.Spheres([[0, 0, 0]], [0.5])])
+    volume = phantom_raster.voxelize(scene, (40, 40, 40), 1 / 32, supersample=2)
+    assert np.isclose(volume.sum() / 32 ** 3, 4 / 3 * np.pi * 0.5 ** 3, rtol=0.01)
+
+
+def test_voxelize_chunks(monkeypatch):
+    scene = spheres()
+    whole = phantom_raster.voxelize(scene, (24, 32, 32), 1 / 32, chunk_slices=24)
+
+    calls = []
+    bounds = phantom_raster.Spheres.bounds
+    monkeypatch.setattr(phantom_raster.Spheres, "bounds", lambda self: calls.append(1) or bounds(self))
+    assert np.array_equal(phantom_raster.voxelize(scene, (24, 32, 32), 1 / 32, chunk_slices=1), whole)
+    # Once for all the spheres, not once per sphere and chunk
+    assert len(calls) == 1
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import attenuation_tables
+import polychromatic
+
+ENERGIES = np.array([30., 50., 80.])
+COUNTS = np.array([100., 200., 50.])
+
+
+@pytest.fixture(scope="module")
+def model():
+    return polychromatic.SpectralModel.from_materials(["Al", "H2O"], None, ENERGIES, COUNTS)
+
+
+def test_project(model):
+    lengths = np.random.default_rng(0).uniform(0, 20, size=(2, 5, 4))
+    image = model.project(lengths, chunk=7)
+
+    # Beer-Lambert summed over the spectrum, energies recorded in MeV
+    mu = np.array([attenuation_tables.linear_attenuation(material, ENERGIES) for material in ("Al", "H2O")])
+    expected = np.einsum("e,e...->...", COUNTS * ENERGIES * 1e-3, np.exp(-np.einsum("me,m...->e...", 0.1 * mu, lengths)))
+    assert np.allclose(image, expected, rtol=1e-5)
+    assert model.project(np.zeros((2, 1, 1)))[0, 0] == pytest.approx(model.flat_field())
+
+    # Area densities (g/cm2) give the same image as the path lengths (mm) they come from
+    area = lengths * 0.1 * model.densities[:, None, None]
+    assert np.allclose(model.project(area, area_density=True), image, rtol=1e-5)
+
+    with pytest.raises(ValueError):
+        model.project(lengths[:1])
+
+
+def test_project_stack(model):
+    maps = np.random.default_rng(1).uniform(0, 5, size=(3, 2, 4, 4)).astype(np.single)
+    stack = model.project_stack(maps)
+    assert stack.shape == (3, 4, 4) and stack.dtype == np.single
+    assert np.allclose(stack[2], model.project(maps[2]), rtol=1e-6)
+
+
+def test_response_and_filters(model, tmp_path):
+    # A detector recording half of the energy of each photon, from a GATE file in MeV
+    fname = tmp_path / "response.txt"
+    np.savetxt(fname, np.column_stack((ENERGIES, ENERGIES / 2)) * 1e-3)
+    assert model.with_response(fname).flat_field() == pytest.approx(model.flat_field() / 2)
+    assert model.with_response(lambda e: e / 2).flat_field() == pytest.approx(model.flat_field() / 2)
+
+    # Filtering the spectrum is the same as adding the filter's path length
+    filtered = model.filtered([("Al", 2.)])
+    lengths = np.array([[[1.]], [[10.]]])
+    assert filtered.project(lengths) == pytest.approx(model.project(lengths + [[[2.]], [[0.]]]))
+    assert model.filtered([]) is model
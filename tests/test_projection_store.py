@@ -0,0 +1,113 @@
+from pathlib import Path
+import numpy as np
+import pytest
+import projection_store
+
+
+@pytest.fixture
+def stack():
+    return np.random.default_rng(0).random((7, 45, 33), dtype=np.single)
+
+
+@pytest.fixture(params=[None, "zlib"])
+def store(request, tmp_path, stack):
+    fname = projection_store.save(tmp_path / "scan.gvxrp", stack, compression=request.param, chunk_rows=16,
+        angles=np.linspace(0, 180, 7), geometry={"type": "parallel", "pixel_size": [0.5, 0.5]}, flat=np.full(stack.shape[1:], 2.))
+    return projection_store.open_store(fname)
+
+
+def test_header(store):
+    with open(store.fname, "rb") as f:
+        magic, version, offset, length = projection_store.HEADER.unpack(f.read(projection_store.HEADER.size))
+    assert magic == projection_store.MAGIC and version == projection_store.VERSION
+    assert offset + length == store.fname.stat().st_size
+    assert not Path(str(store.fname) + ".partial").exists()
+
+
+def test_round_trip(store, stack):
+    assert store.shape == stack.shape and store.dtype == stack.dtype
+    assert np.array_equal(store.as_array(), stack)
+    assert np.array_equal(np.asarray(store), stack)
+    assert np.array_equal(store.angles, np.linspace(0, 180, 7))
+    assert store.geometry == {"type": "parallel", "pixel_size": [0.5, 0.5]}
+    assert store.units["angle"] == "degree"
+    assert np.array_equal(store.flat, np.full(stack.shape[1:], 2.)) and store.dark is None
+    assert (store.min(), store.max()) == (stack.min(), stack.max())
+
+
+@pytest.mark.parametrize("key", [
+    3, -1, (slice(None), 20), (slice(1, 6, 2), slice(10, 40, 3), slice(None, None, -4)),
+    (Ellipsis, 7), (2, Ellipsis), (slice(None), slice(15, 17)), (slice(None), slice(30, 20)), np.int64(4),
+])
+def test_indexing(store, stack, key):
+    assert np.array_equal(store[key], stack[key])
+
+
+def test_views(store, stack):
+    assert np.array_equal(store.projection(2), stack[2])
+    assert np.array_equal(store.sinogram(40), stack[:, 40])
+    assert np.array_equal(store.rows(10, 20), stack[:, 10:20])
+    assert np.array_equal(np.concatenate([block for _, block in store.iter_projections(3)]), stack)
+
+
+def test_compressed_indexing_errors(tmp_path, stack):
+    store = projection_store.open_store(projection_store.save(tmp_path / "scan.gvxrp", stack, compression="zlib"))
+    with pytest.raises(IndexError):
+        store[[0, 1]]
+    with pytest.raises(IndexError):
+        store[:, 45]
+
+
+def test_writer_any_order(tmp_path, stack):
+    with projection_store.create(tmp_path / "scan.gvxrp", stack.shape, compression="zlib", chunk_rows=8) as writer:
+        for i in reversed(range(len(stack))):
+            writer.write(i, stack[i])
+    assert np.array_equal(projection_store.open_store(tmp_path / "scan.gvxrp")[:], stack)
+
+
+def test_abort(tmp_path, stack):
+    with pytest.raises(RuntimeError):
+        with projection_store.create(tmp_path / "scan.gvxrp", stack.shape) as writer:
+            writer.write(0, stack[0])
+            raise RuntimeError("Stopped")
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_writer_checks(tmp_path, stack, compression):
+    writer = projection_store.create(tmp_path / "scan.gvxrp", stack.shape, compression=compression)
+    with pytest.raises(ValueError):
+        writer.write(0, stack[0, :-1])
+    for i in range(1, len(stack)):
+        writer.write(i, stack[i])
+    with pytest.raises(RuntimeError):
+        writer.close()
+    writer.abort()
+    assert not list(tmp_path.iterdir())
+
+
+def test_writer_in_place(tmp_path, stack):
+    with projection_store.create(tmp_path / "scan.gvxrp", stack.shape) as writer:
+        writer.stack[:] = stack
+        writer.mark_written(slice(None))
+    assert np.array_equal(projection_store.open_store(tmp_path / "scan.gvxrp")[:], stack)
+
+
+def test_validation(tmp_path):
+    with pytest.raises(ValueError):
+        projection_store.create(tmp_path / "scan.gvxrp", (3, 4, 4), angles=[0, 1])
+    with pytest.raises(ValueError):
+        projection_store.create(tmp_path / "scan.gvxrp", (3, 4, 4), compression="lzma")
+
+
+def test_geometry_from_config():
+    config = {"Source": {"Position": [0, -10, 0, "cm"], "Shape": "PointSource"},
+        "Detector": {"Position": [0, 50, 0, "mm"], "UpVector": [0, 0, 1], "NumberOfPixels": [10, 8], "Spacing": [0.1, 0.2, "cm"]}}
+    geometry = projection_store.geometry_from_config(config)
+    assert geometry["type"] == "cone"
+    assert np.allclose(geometry["source_position"], (0, -100, 0))
+    assert np.allclose(geometry["pixel_size"], (1, 2))
+
+
+def test_sorted_by_index():
+    assert projection_store.sorted_by_index(["scan_10.tif", "scan_2.tif", "scan_1.tif"]) == ["scan_1.tif", "scan_2.tif", "scan_10.tif"]
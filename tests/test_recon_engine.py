@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import phantom_raster
+import projection_store
+import recon_engine
+import tracing
+
+SIZE = 48
+PIXEL_SIZE = 1.2 / SIZE
+SOURCE, DETECTOR = (0, 4, 0), (0, -4, 0)
+
+
+@pytest.fixture(scope="module")
+def scene():
+    # Off-centre spheres, so that a flipped or rotated volume does not match
+    return phantom_raster.Scene([phantom_raster.Spheres([[0.15, -0.1, 0.05], [-0.2, 0.1, -0.1]], [0.15, 0.1])])
+
+
+@pytest.fixture(scope="module")
+def volume(scene):
+    return phantom_raster.voxelize(scene, (SIZE, SIZE, SIZE), PIXEL_SIZE, supersample=3)
+
+
+def check(reconstruction, volume, mu:float=1.):
+    assert reconstruction.shape == volume.shape
+    assert np.abs(reconstruction - mu * volume).mean() < 0.01 * mu
+    assert np.isclose(reconstruction[volume == 1].mean(), mu, rtol=0.05)
+    assert abs(reconstruction[volume == 0].mean()) < 0.02 * mu
+
+
+def test_fbp(scene, volume):
+    angles = np.linspace(0, 180, 90, endpoint=False)
+    projections = phantom_raster.project_parallel(scene, angles, (SIZE, SIZE), PIXEL_SIZE, mu=2., transmission=True)
+    reconstruction = recon_engine.fbp_parallel(projections, PIXEL_SIZE, angles, workers=1)
+    check(reconstruction, volume, 2.)
+
+    # The slabs do not change the result
+    assert np.allclose(recon_engine.fbp_parallel(projections, PIXEL_SIZE, angles, workers=3, slab_rows=5), reconstruction, atol=1e-6)
+
+
+def test_fdk(scene, volume, tmp_path):
+    angles = np.linspace(0, 360, 120, endpoint=False)
+    # Detector pixels twice the voxels, which are the pixels scaled to the isocentre
+    projections = phantom_raster.project_cone(scene, angles, (SIZE, SIZE), 2 * PIXEL_SIZE, SOURCE, DETECTOR)
+    reconstruction = recon_engine.fdk_cone(projections, 2 * PIXEL_SIZE, angles, SOURCE, DETECTOR, transmission=False, workers=1)
+    check(reconstruction, volume)
+
+    # From a store, to a volume store
+    store = projection_store.save(tmp_path / "cone.gvxrp", projections, angles=angles)
+    out = recon_engine.fdk_cone(store, 2 * PIXEL_SIZE, angles, SOURCE, DETECTOR, out=tmp_path / "volume.gvxrp",
+        transmission=False, workers=2, use_processes=False)
+    assert np.allclose(projection_store.open_store(out)[:], reconstruction, atol=1e-6)
+
+
+def test_worker_spans(scene, tmp_path):
+    angles = np.linspace(0, 180, 30, endpoint=False)
+    projections = phantom_raster.project_parallel(scene, angles, (16, 16), 4 * PIXEL_SIZE, transmission=True)
+    store = projection_store.save(tmp_path / "parallel.gvxrp", projections, angles=angles)
+
+    tracing.enable()
+    tracing.tracer().clear()
+    try:
+        recon_engine.fbp_parallel(store, 4 * PIXEL_SIZE, angles, workers=2, slab_rows=4, use_processes=True)
+        stages = tracing.tracer().summary()
+    finally:
+        tracing.disable()
+        tracing.tracer().clear()
+
+    # The spans of the worker processes reach the main one, one per slab
+    for name in ("recon.read", "recon.filter", "recon.backproject"):
+        assert stages[name]["count"] == 4
+    assert stages["recon.fbp"]["count"] == 1
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import phantom_raster
+import recon_iterative
+
+SIZE = 24
+PIXEL_SIZE = 1.2 / SIZE
+ANGLES = np.linspace(0, 180, 20, endpoint=False)
+
+
+@pytest.fixture(scope="module")
+def projections():
+    scene = phantom_raster.Scene([phantom_raster.Spheres([[0.15, -0.1, 0.05], [-0.2, 0.1, -0.1]], [0.15, 0.1])])
+    return phantom_raster.project_parallel(scene, ANGLES, (SIZE, SIZE), PIXEL_SIZE)
+
+
+@pytest.mark.parametrize("operator", [
+    recon_iterative.ParallelProjector(ANGLES, 6, 20, 16, 0.1),
+    recon_iterative.ParallelProjector(ANGLES, 6, 20, 16, 0.1, centre=8.3),
+    recon_iterative.ConeProjector(np.linspace(0, 360, 15, endpoint=False), 6, 20, 16, 0.2, 40., 80.),
+    recon_iterative.ConeProjector(np.linspace(0, 360, 15, endpoint=False), 6, 20, 16, 0.2, 40., 80., centre=(9.2, 2.4)),
+], ids=["parallel", "parallel-offset", "cone", "cone-offset"])
+def test_adjoint(operator):
+    rng = np.random.default_rng(0)
+    x = rng.random(operator.volume_shape, dtype=np.single)
+    y = rng.random(operator.projection_shape, dtype=np.single)
+    forward = operator.forward(x)
+    assert forward.shape == operator.projection_shape
+    assert np.isclose(np.vdot(forward, y), np.vdot(x, operator.adjoint(y)), rtol=1e-4)
+
+    subset = [1, 4, 7]
+    assert np.allclose(operator.forward(x, subset), forward[subset], rtol=1e-4, atol=1e-5)
+    assert np.isclose(np.vdot(operator.forward(x, subset), y[subset]), np.vdot(x, operator.adjoint(y[subset], subset)), rtol=1e-4)
+
+
+def test_ordered_subsets():
+    subsets = recon_iterative.ordered_subsets(20, 4)
+    assert len(subsets) == 4
+    assert sorted(np.concatenate(subsets).tolist()) == list(range(20))
+
+
+@pytest.mark.parametrize("method", recon_iterative.METHODS)
+def test_converges(projections, method):
+    residuals = []
+    recon_iterative.iterative_parallel(projections, PIXEL_SIZE, ANGLES, method, iterations=5, subsets=4,
+        transmission=False, callback=lambda i, x, residual: residuals.append(residual))
+    assert len(residuals) == 5
+    assert residuals[-1] < residuals[0] < 1
+
+
+def test_checkpoint_resume(tmp_path, projections):
+    kwargs = dict(method="os-sart", subsets=4, transmission=False)
+    straight = recon_iterative.iterative_parallel(projections, PIXEL_SIZE, ANGLES, iterations=4, **kwargs)
+
+    checkpoint = tmp_path / "checkpoint.gvxrp"
+    recon_iterative.iterative_parallel(projections, PIXEL_SIZE, ANGLES, iterations=2, checkpoint=checkpoint, **kwargs)
+    assert recon_iterative.load_log(checkpoint).iterations == 2
+    # Interrupted after two iterations, resumed for the other two
+    resumed = recon_iterative.iterative_parallel(projections, PIXEL_SIZE, ANGLES, iterations=4, checkpoint=checkpoint,
+        checkpoint_every=2, **kwargs)
+    assert np.array_equal(resumed, straight)
+
+    log = recon_iterative.load_log(checkpoint)
+    assert (log.method, log.iterations, len(log.residuals), log.stopped) == ("os-sart", 4, 4, "iterations")
+
+
+def test_tolerance(projections):
+    residuals = []
+    recon_iterative.iterative_parallel(projections, PIXEL_SIZE, ANGLES, "cgls", iterations=50, tolerance=0.05,
+        transmission=False, callback=lambda i, x, residual: residuals.append(residual))
+    assert len(residuals) < 50 and residuals[-1] < 0.05
+
+
+def test_errors(projections):
+    with pytest.raises(ValueError):
+        recon_iterative.iterative_parallel(projections, PIXEL_SIZE, ANGLES, "art", transmission=False)
+    with pytest.raises(ValueError):
+        recon_iterative.iterative_parallel(projections, PIXEL_SIZE, ANGLES, x0=np.zeros((2, 2, 2)), transmission=False)
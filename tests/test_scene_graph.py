@@ -0,0 +1,61 @@
+import numpy as np
+import scene_graph
+
+
+class RecordingGVXR():
+    """Stands in for gvxr, keeping the matrices set on each node."""
+
+    def __init__(self):
+        self.matrices = {}
+
+    def setLocalTransformationMatrix(self, label, values):
+        self.matrices[label] = scene_graph.from_gl(values)
+
+
+# scripts/03-Pump_example-2.py: scaleNode(0.2) then rotateNode(-90, 1, 0, 0) on each part
+PUMP_STATIC = scene_graph.scaling_matrix([0.2] * 3) @ scene_graph.rotation_matrices([-90], (1, 0, 0))[0]
+PUMP_AXIS = (0, 0, 1)
+
+
+def rotate_node(matrix, angle, axis):
+    """gvxr.rotateNode, which post-multiplies the node's matrix."""
+    return matrix @ scene_graph.rotation_matrices([angle], axis)[0]
+
+
+def test_gl_round_trip():
+    matrix = np.arange(16, dtype=np.double).reshape(4, 4)
+    assert np.array_equal(scene_graph.from_gl(scene_graph.to_gl(matrix)), matrix)
+    assert scene_graph.to_gl(scene_graph.translation_matrix((1, 2, 3)))[12:15] == [1, 2, 3]
+
+
+def test_rotation_is_counterclockwise():
+    assert np.allclose(scene_graph.rotation_matrix(90, (0, 0, 1)) @ (1, 0, 0), (0, 1, 0))
+
+
+def test_pump_nodes_match_stepped_rotation():
+    # The baseline script called rotateNode(label, -step, 0, 1, 0) at every projection
+    scene = scene_graph.SceneGraph({"part": PUMP_STATIC}, PUMP_AXIS)
+    angles = np.arange(0, 360, 15.)
+    scene.schedule(angles)
+    gvxr = RecordingGVXR()
+
+    stepped = PUMP_STATIC
+    for angle in angles:
+        scene.apply_nodes(gvxr, angle)
+        assert np.allclose(gvxr.matrices["part"], stepped)
+        stepped = rotate_node(stepped, -15, (0, 1, 0))
+
+
+def test_pump_quarter_turn_is_not_an_in_plane_spin():
+    scene = scene_graph.SceneGraph({"part": PUMP_STATIC}, PUMP_AXIS)
+    gvxr = RecordingGVXR()
+    scene.apply_nodes(gvxr, 0)
+    first = gvxr.matrices["part"]
+    scene.apply_nodes(gvxr, 90)
+    quarter = gvxr.matrices["part"]
+
+    # The beam is along Y: a turn around the scan axis moves model points along it, a spin about the beam would not
+    point = np.array([1., 0, 0, 1])
+    assert not np.isclose((first @ point)[1], (quarter @ point)[1])
+    assert np.allclose(quarter, rotate_node(first, -90, (0, 1, 0)))
+    assert not np.allclose(quarter, scene_graph.rotation_matrices([90], (0, -1, 0))[0] @ first)
@@ -0,0 +1,63 @@
+import asyncio
+import numpy as np
+import projection_store
+import slice_viewer
+
+
+def test_estimate_range():
+    stack = np.broadcast_to(np.arange(1000, dtype=np.single).reshape(1, 10, 100), (5, 10, 100))
+    lo, hi = slice_viewer.estimate_range(stack)
+    assert 0 <= lo < 10 and 990 < hi <= 999
+    assert slice_viewer.estimate_range(stack, percentiles=(0, 100)) == (0, 999)
+
+    # Constant and non-finite values still give a usable range
+    stack = np.full((3, 4, 4), 2., dtype=np.single)
+    stack[0, 0, 0] = np.nan
+    lo, hi = slice_viewer.estimate_range(stack)
+    assert lo <= 2 <= hi and lo < hi
+
+
+def test_downsample():
+    image = np.arange(35, dtype=np.single).reshape(5, 7)
+    assert slice_viewer.downsample(image, (8, 8)) is image
+
+    small = slice_viewer.downsample(image, (2, 3))
+    # Blocks of 3 x 3 pixels, the last rows and columns cropped
+    assert small.shape == (1, 2) and small.dtype == image.dtype
+    assert np.array_equal(small, [[image[:3, :3].mean(), image[:3, 3:6].mean()]])
+
+
+def test_slice_cache(tmp_path):
+    stack = np.random.default_rng(0).random((10, 8, 8), dtype=np.single)
+    store = projection_store.save(tmp_path / "stack.gvxrp", stack)
+
+    cache = slice_viewer.SliceCache(store, cache_size=3, prefetch=0)
+    assert len(cache) == 10
+    for i in (0, 1, 2, 0, 3):
+        assert np.array_equal(cache.get(i), stack[i])
+    # Slice 1 was the least recently used
+    assert list(cache._slices) == [2, 0, 3]
+    cache.close()
+
+    cache = slice_viewer.SliceCache(stack, max_shape=(4, 4), prefetch=1)
+    assert cache.get(5).shape == (4, 4)
+    cache._executor.shutdown(wait=True)
+    assert sorted(cache._slices) == [4, 5, 6]
+    cache.close()
+
+
+def test_debouncer():
+    calls = []
+    debounced = slice_viewer.Debouncer(calls.append, delay=0.01)
+
+    async def scrub():
+        for i in range(5):
+            debounced(i)
+        await asyncio.sleep(0.05)
+        return calls[:]
+
+    assert asyncio.run(scrub()) == [4]
+
+    # Without an event loop the call is immediate
+    debounced(5)
+    assert calls == [4, 5]
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+spectrum_engine = pytest.importorskip("spectrum_engine")
+
+
+@pytest.mark.parametrize("material", [1, 8, 13, 74, "air"])
+def test_mu_matches_xpecgen(material):
+    from xpecgen import xpecgen
+
+    # xpecgen's own tables, at energies away from the absorption edges
+    energies = np.array([10., 20., 50., 100., 150.])
+    expected = xpecgen.get_mu(material)(energies)
+    assert np.allclose(spectrum_engine.get_mu(material)(energies), expected, rtol=0.02)
+
+
+def test_filters_commute():
+    spectrum = spectrum_engine.inherent_spectrum(80)
+    filters = [(13, 0.1), (29, 0.01)]
+    once = spectrum.attenuate(filters)
+    assert np.allclose(once.counts, spectrum.attenuate(filters[:1]).attenuate(filters[1:]).counts)
+    assert np.allclose(once.lines, spectrum.attenuate(filters[::-1]).lines)
+
+
+def test_compute():
+    result = spectrum_engine.compute(100, 13, 1.0)
+    assert result.dose < spectrum_engine.NORM_DOSE
+    assert 30 < result.mean_energy < 100
+    assert result.hvl_al > spectrum_engine.compute(100, 13, 0.).hvl_al
@@ -0,0 +1,52 @@
+from pathlib import Path
+import json
+import pytest
+import projection_store
+import sweep
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def scene(pixels:int=16) -> dict:
+    return {
+        "Source": {"Position": [0, -1000, 0, "mm"], "Shape": "Parallel", "Beam": [{"Energy": 60, "Unit": "keV", "PhotonCount": 1000}]},
+        "Detector": {"Position": [0, 1000, 0, "mm"], "UpVector": [0, 0, 1], "NumberOfPixels": [pixels, pixels], "Spacing": [4, 4, "mm"]},
+        "Samples": [{"Label": "star", "Path": "input_data/phantoms/star.stl", "Unit": "mm", "Material": ["Element", "Al"]}],
+        "Scan": {"NumberOfProjections": 2, "FinalAngle": 180, "OutFolder": "scan/projections", "GifPath": "scan/preview.gif"},
+    }
+
+
+def test_config_key_ignores_outputs():
+    base = sweep.resolve(scene(), ROOT)
+    moved = sweep.resolve({**scene(), "Scan": {**scene()["Scan"], "OutFolder": "elsewhere", "GifPath": "other.gif"}}, ROOT)
+    assert Path(base["Scan"]["OutFolder"]).is_absolute()
+    assert sweep.config_key(base, "cpu") == sweep.config_key(moved, "cpu")
+    assert sweep.config_key(base, "cpu") != sweep.config_key(sweep.resolve(scene(32), ROOT), "cpu")
+
+
+def test_entries():
+    config = scene()
+    sweep.set_entry(config, "Source/Beam/0/Energy", 80)
+    sweep.set_entry(config, "Scan/Extra/Value", 1)
+    assert sweep.get_entry(config, "Source/Beam/0/Energy") == 80
+    assert config["Scan"]["Extra"] == {"Value": 1}
+    assert len(sweep.expand(config, {"Source/Beam/0/Energy": [40, 60], "Detector/Spacing/0": [1, 2, 3]})) == 6
+
+
+def test_failures_do_not_stop_the_sweep(tmp_path):
+    grid = {"Samples/0/Material": [["Element", "Al"], ["Element", "Xx"]], "Source/Beam/0/Energy": [60, 80]}
+    runner = sweep.Sweep(scene(), grid, tmp_path / "cache", engine="cpu", base_dir=ROOT)
+
+    finished = []
+    with pytest.raises(sweep.SweepError) as error:
+        for variant, fname in runner.run():
+            finished.append(variant.params)
+    assert len(finished) == 2 and len(error.value.failures) == 2
+    assert all(variant.params["Samples/0/Material"][1] == "Xx" for variant, _ in error.value.failures)
+
+    # The variants that succeeded are committed, the next run only retries the others
+    done = [fname for _, fname in runner.results() if fname is not None]
+    assert len(done) == 2 and all(projection_store.open_store(fname).shape == (2, 16, 16) for fname in done)
+    with open(tmp_path / "cache" / f"{runner.variants()[0].key}.json") as f:
+        assert json.load(f)["params"]["Source/Beam/0/Energy"] == 60
+    assert not list((tmp_path / "cache").glob("*.partial"))
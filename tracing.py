@@ -0,0 +1,257 @@
+"""Lightweight tracing of the simulate, correct and reconstruct pipeline.
+
+Stages are recorded as spans: a name, the wall and CPU time they took, the
+bytes they moved and the peak resident memory of the process when they
+ended. Spans come from a context manager or a decorator:
+
+    with tracing.span("acquire.render", bytes=image.nbytes):
+        ...
+
+    @tracing.traced("recon.fbp")
+    def fbp_parallel(...):
+        ...
+
+Tracing is off unless tracing.enable() is called or the GVXR_TRACE
+environment variable is set (which also enables it in worker processes).
+When off, span() returns a shared object whose methods do nothing and
+traced functions are called straight away, so the instrumentation can stay
+on the hot paths. Traces are exported as JSON or in the Chrome trace
+format (chrome://tracing, Perfetto), and summarised per stage by report(),
+printed at exit when GVXR_TRACE is set.
+
+Each process records its own spans. Pools that hand their workers' events
+back to the main process (acquisition.acquire_parallel, the slabs of
+recon_engine) merge them with
+Tracer.extend(); times come from the system-wide perf_counter clock, so
+the events of all processes share one time line. CPU times are those of
+the thread that ran the span: a span waiting on a thread pool counts
+little CPU, the work being in the spans of its workers.
+"""
+
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak memory is not recorded
+    resource = None
+
+
+@dataclass
+class Event():
+    """A finished span. Times are in seconds, start on the perf_counter clock, cpu of the thread that ran it, sizes in bytes."""
+
+    name:str
+    start:float
+    wall:float
+    cpu:float
+    bytes:int = 0
+    peak_rss:int = 0
+    pid:int = 0
+    thread:int = 0
+    args:Dict[str, object] = field(default_factory=dict)
+
+
+def _peak_rss() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Tracer():
+    """Thread-safe list of the events of this process."""
+
+    def __init__(self):
+        self.events:List[Event] = []
+        self.origin = time.perf_counter()
+        self._lock = Lock()
+
+    def record(self, event:Event):
+        with self._lock:
+            self.events.append(event)
+
+    def extend(self, events:Sequence[Event]):
+        """Add events recorded elsewhere, e.g. by worker processes."""
+
+        with self._lock:
+            self.events.extend(events)
+
+    def drain(self) -> List[Event]:
+        """Remove and return the events recorded so far, e.g. to send them from a worker to the main process."""
+
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+            self.origin = time.perf_counter()
+
+    def summary(self) -> Dict[str, dict]:
+        """Totals per stage: count, wall and CPU time, bytes and peak memory."""
+
+        stages = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            stage = stages.setdefault(event.name, {"count": 0, "wall": 0., "cpu": 0., "bytes": 0, "peak_rss": 0})
+            stage["count"] += 1
+            stage["wall"] += event.wall
+            stage["cpu"] += event.cpu
+            stage["bytes"] += event.bytes
+            stage["peak_rss"] = max(stage["peak_rss"], event.peak_rss)
+        return stages
+
+    def report(self, file=None) -> str:
+        """A table of the summary, printed to file (stdout by default) unless file is False."""
+
+        lines = [f"{'stage':<28}{'count':>8}{'wall (s)':>11}{'mean (ms)':>11}{'cpu (s)':>10}{'MB':>10}{'MB/s':>10}{'peak MB':>10}"]
+        for name, stage in sorted(self.summary().items(), key=lambda item: -item[1]["wall"]):
+            mb = stage["bytes"] / 1e6
+            rate = f"{mb / stage['wall']:.1f}" if stage["bytes"] and stage["wall"] > 0 else "-"
+            lines.append(f"{name:<28}{stage['count']:>8}{stage['wall']:>11.3f}{1e3 * stage['wall'] / stage['count']:>11.2f}"
+                f"{stage['cpu']:>10.3f}{mb:>10.1f}{rate:>10}{stage['peak_rss'] / 1e6:>10.0f}")
+        text = "\n".join(lines)
+        if file is not False:
+            print(text, file=file)
+        return text
+
+    def save_json(self, fname:str|Path) -> Path:
+        """Write the events, start times from the start of the trace, and the summary as JSON."""
+
+        with self._lock:
+            events = [{**asdict(event), "start": event.start - self.origin} for event in self.events]
+        with open(fname, "w") as f:
+            json.dump({"events": events, "summary": self.summary()}, f, indent=1, default=str)
+        return Path(fname)
+
+    def save_chrome(self, fname:str|Path) -> Path:
+        """Write the events in the Chrome trace event format, times in microseconds."""
+
+        with self._lock:
+            events = [{"name": event.name, "cat": event.name.split(".")[0], "ph": "X", "ts": 1e6 * (event.start - self.origin),
+                "dur": 1e6 * event.wall, "pid": event.pid, "tid": event.thread,
+                "args": {"cpu_s": event.cpu, "bytes": event.bytes, "peak_rss": event.peak_rss, **event.args}}
+                for event in self.events]
+        with open(fname, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+        return Path(fname)
+
+
+_tracer = Tracer()
+_enabled = False
+
+
+def tracer() -> Tracer:
+    """The tracer of this process."""
+    return _tracer
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(report_at_exit:bool=False):
+    """Start recording spans, and print the report when the interpreter exits if asked to."""
+
+    global _enabled
+    _enabled = True
+    if report_at_exit:
+        atexit.register(_tracer.report)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+class Span():
+    """A stage being timed, see span()."""
+
+    __slots__ = ("name", "bytes", "args", "_wall", "_cpu")
+
+    def __init__(self, name:str, bytes:int=0, args:Optional[dict]=None):
+        self.name = name
+        self.bytes = bytes
+        self.args = args or {}
+
+    def add_bytes(self, n:int):
+        """Count bytes moved by the stage."""
+        self.bytes += int(n)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *args):
+        wall = time.perf_counter()
+        _tracer.record(Event(self.name, self._wall, wall - self._wall, time.thread_time() - self._cpu,
+            self.bytes, _peak_rss(), os.getpid(), threading.get_ident(), self.args))
+
+
+class _NullSpan():
+    """What span() returns when tracing is off."""
+
+    __slots__ = ()
+
+    def add_bytes(self, n:int):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+def span(name:str, bytes:int=0, **args) -> Span|_NullSpan:
+    """Context manager timing a stage.
+
+    Args:
+        name (str): Name of the stage, the part before the first dot being its category.
+        bytes (int): Bytes moved by the stage, more can be added with add_bytes().
+        args: Extra values stored with the event.
+    """
+
+    if not _enabled:
+        return _null_span
+    return Span(name, bytes, args)
+
+
+def traced(name:Optional[str]=None) -> Callable:
+    """Decorator timing every call of a function, as a stage named after it by default."""
+
+    def decorator(fn:Callable) -> Callable:
+        stage = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if os.environ.get("GVXR_TRACE"):
+    # Worker processes inherit the variable, only the main one reports
+    enable(report_at_exit=multiprocessing.parent_process() is None)
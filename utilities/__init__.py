@@ -0,0 +1,51 @@
+"""Helpers of the notebooks.
+
+    attenuation     GetDensity, mu
+    spectra         spectrum
+    reconstruction  recon_parallel, recon_cone
+    widgets         recon_widget
+    capabilities    which optional dependencies are available
+
+Importing the package imports none of them: each submodule is imported by
+the first access to one of its names, and the heavy dependencies
+(matplotlib, xpecgen, ipywidgets, CIL) by the first call that needs them.
+`from utilities import recon_parallel` therefore only costs NumPy and
+recon_engine, which keeps worker processes quick to start.
+"""
+
+from pathlib import Path
+import importlib
+import sys
+
+# The helpers use the modules next to the package, which may be imported through a link (see solutions/)
+_ROOT = str(Path(__file__).resolve().parent.parent)
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)
+
+_EXPORTS = {
+    "GetDensity": "attenuation",
+    "mu": "attenuation",
+    "spectrum": "spectra",
+    "recon_parallel": "reconstruction",
+    "recon_cone": "reconstruction",
+    "recon_widget": "widgets",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name:str):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f"{__name__}.{_EXPORTS[name]}"), name)
+        # Later accesses skip __getattr__
+        globals()[name] = value
+        return value
+    if name == "has_cil":
+        # Kept for old notebooks, see capabilities.has()
+        from utilities import capabilities
+        return capabilities.has("cil")
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted([*globals(), *_EXPORTS])
@@ -0,0 +1,57 @@
+"""Attenuation coefficients of the notebooks, plotted with matplotlib (imported on first use)."""
+
+import numpy as np
+import attenuation_tables
+
+def GetDensity(material):
+    return attenuation_tables.get_density(material)
+
+def mu(material='H2C'):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+
+    old_font_size  = mpl.rcParams['font.size']
+    table = attenuation_tables.get_table(material)
+    energy_range = table.energies
+    density = table.density
+    print(f'density {material} = {density}')
+    mu_rho = table.total
+    mu_rho_Photo = table.photo
+    mu_rho_Compt = table.compton
+    mu_rho_Rayl = table.rayleigh
+    plt.close(1)
+    fig = plt.figure(num=1,dpi=150,clear=True)
+    mpl.rcParams.update({'font.size': 6})
+    axMW = plt.subplot(111)
+    axMW.plot(energy_range, mu_rho,color="black",linewidth=2.,linestyle="-",label='Total')
+    axMW.plot(energy_range, mu_rho_Photo,color="red",linewidth=2.,linestyle="-",label='Photoelectric')
+    axMW.plot(energy_range, mu_rho_Compt,color="blue",linewidth=2.,linestyle="-",label='Compton')
+    axMW.plot(energy_range, mu_rho_Rayl,color="green",linewidth=2.,linestyle="-",label='Rayleigh')
+    axMW.set_xscale('log')
+    axMW.set_yscale('log')
+    axMW.set_xlim(np.min(energy_range),np.max(energy_range))
+    axMW.set_ylim(1e-2,1e4)
+    plt.legend(loc='center right', frameon=True)
+    plt.xlabel('Energy (keV)')
+    plt.ylabel("Linear attenuation coefficient (cm$^{-1}$)")
+    axMW.grid(which='major', axis='x', linewidth=0.5, linestyle='-', color='0.75')
+    axMW.grid(which='minor', axis='x', linewidth=0.3, linestyle='-', color='0.75')
+    axMW.grid(which='major', axis='y', linewidth=0.5, linestyle='-', color='0.75')
+    axMW.grid(which='minor', axis='y', linewidth=0.3, linestyle='-', color='0.75')
+    axMW.xaxis.set_major_formatter(mpl.ticker.FormatStrFormatter("%d"))
+    #axMW.xaxis.set_minor_formatter(mpl.ticker.FormatStrFormatter("%d"))
+    axMW.grid(True)
+    #symbol=xrl.AtomicNumberToSymbol(material)
+    axMW.set_title("%s" % material, va='bottom')
+    #plt.savefig('mu_over_rho_W.pdf', format='PDF')
+    text=axMW.text(np.min(energy_range),1e4, "", va="top", ha="left")
+    def onclick(event):
+        energy = np.round(event.xdata*10)*0.1
+        energyidx = int(np.where(np.min(np.abs(energy_range-energy))==np.abs(energy_range-energy))[0])
+        tx = 'The linear attnuation coefficient of ' + material + ' at %.1f keV is %1.4e cm$^{-1}$\n(Rayleigh %1.4e cm$^{-1}$, Photoelectric %1.4e cm$^{-1}$, Compton %1.4e cm$^{-1}$)'%(energy,mu_rho[energyidx],mu_rho_Rayl[energyidx],mu_rho_Photo[energyidx],mu_rho_Compt[energyidx])
+        text.set_text(tx)
+        text.set_x(axMW.get_xlim()[0])
+        text.set_y(axMW.get_ylim()[1])
+    cid = fig.canvas.mpl_connect('button_press_event', onclick)
+    plt.show()
+    mpl.rcParams['font.size'] = old_font_size
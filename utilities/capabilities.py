@@ -0,0 +1,153 @@
+"""Which optional dependencies are available, and what importing them costs.
+
+installed() looks modules up without importing them, which is enough to
+pick a code path. has() imports them once and caches the outcome, so a
+package that is installed but broken (e.g. CIL without its compiled
+backends) is reported as unavailable, with the reason from missing().
+
+Run as a script to print the features and the import time and memory of
+the helpers and their dependencies, each measured in a fresh interpreter:
+
+    python -m utilities.capabilities
+"""
+
+from functools import lru_cache
+from typing import Dict, Optional, Sequence, Tuple
+import importlib
+import importlib.util
+import json
+import subprocess
+import sys
+
+# Modules each feature needs
+FEATURES = {
+    "cil": ("cil.framework", "cil.processors", "cil.recon"),
+    "cil_display": ("cil.utilities.display",),
+    "plotting": ("matplotlib",),
+    "widgets": ("ipywidgets",),
+    "spectra": ("xraylib", "xpecgen", "scipy"),
+    "attenuation": ("xraylib", "xraylib_np"),
+    "gvxr": ("gvxrPython3",),
+}
+
+
+def installed(module:str) -> bool:
+    """Whether a module can be found, without importing it (only its parent packages are)."""
+
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+@lru_cache(maxsize=None)
+def _probe(feature:str) -> Optional[str]:
+    # None if every module of the feature imports, the first error otherwise
+    for module in FEATURES[feature]:
+        if not installed(module):
+            return f"{module} is not installed"
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            return f"{module} failed to import: {e}"
+    return None
+
+
+def has(feature:str) -> bool:
+    """Whether the modules of a feature (a key of FEATURES) import, importing them on the first call."""
+    return _probe(feature) is None
+
+
+def missing(feature:str) -> Optional[str]:
+    """Why a feature is unavailable, None if it is available."""
+    return _probe(feature)
+
+
+def require(feature:str):
+    """Raise an ImportError explaining why a feature is unavailable."""
+
+    reason = missing(feature)
+    if reason is not None:
+        raise ImportError(f"'{feature}' is unavailable: {reason}")
+
+
+def summary() -> Dict[str, Optional[str]]:
+    """Availability of every feature, without importing anything: None if installed, the missing module otherwise."""
+
+    return {feature: next((f"{module} is not installed" for module in modules if not installed(module)), None)
+        for feature, modules in FEATURES.items()}
+
+
+_MEASURE = """
+import sys, time
+def peak():
+    # Peak RSS in kB. ru_maxrss would start from the parent's peak, which a child inherits on Linux
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM"))
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+before = peak()
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, peak() - before, len(sys.modules))
+"""
+
+
+def import_cost(module:str, repeat:int=3) -> Tuple[float, float, int]:
+    """Best time (s) and peak memory increase (MB) of importing a module in a fresh interpreter, and the number of modules loaded.
+
+    Raises:
+        ImportError: The module failed to import.
+    """
+
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", _MEASURE.format(module=module)], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ImportError(result.stderr.strip().splitlines()[-1])
+        seconds, rss, modules = result.stdout.split()
+        mb = int(rss) / 1024
+        if best is None or float(seconds) < best[0]:
+            best = (float(seconds), mb, int(modules))
+    return best
+
+
+def benchmark(modules:Sequence[str], repeat:int=3) -> Dict[str, Optional[Tuple[float, float, int]]]:
+    """import_cost() of each module, None for those that fail to import."""
+
+    costs = {}
+    for module in modules:
+        try:
+            costs[module] = import_cost(module, repeat)
+        except ImportError:
+            costs[module] = None
+    return costs
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report the optional dependencies and the import cost of the helpers.")
+    parser.add_argument("modules", nargs="*", default=["utilities", "utilities.reconstruction", "utilities.attenuation",
+        "utilities.spectra", "utilities.widgets", "acquisition", "cpu_projector", "recon_engine", "matplotlib.pyplot",
+        "xpecgen.xpecgen", "ipywidgets", "cil.recon"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    features = {feature: missing(feature) for feature in FEATURES}
+    costs = benchmark(args.modules, args.repeat)
+    if args.json:
+        print(json.dumps({"features": features, "imports": costs}, indent=1))
+    else:
+        for feature, reason in features.items():
+            print(f"{feature:<14}{'yes' if reason is None else 'no (' + reason + ')'}")
+        print()
+        print(f"{'module':<28}{'time (ms)':>10}{'RSS (MB)':>10}{'modules':>9}")
+        for module, cost in costs.items():
+            if cost is None:
+                print(f"{module:<28}{'unavailable':>10}")
+            else:
+                print(f"{module:<28}{1e3 * cost[0]:>10.1f}{cost[1]:>10.1f}{cost[2]:>9}")
@@ -0,0 +1,164 @@
+"""Reconstruction of the notebooks' scans, with CIL when it is available and recon_engine otherwise (or for a detector ROI).
+
+Iterative methods (SIRT, OS-SART, CGLS) always use recon_iterative. CIL is only imported by the first reconstruction that uses it, so that
+worker processes which never reconstruct with CIL do not pay for it.
+"""
+
+from typing import Optional
+from utilities import capabilities
+import numpy as np
+import projection_store
+import recon_engine
+import recon_iterative
+import tracing
+
+def _scan_angles(projections, final_angle:Optional[float]) -> np.ndarray:
+    # Stores know their angles, arrays are assumed to span [0, final_angle]
+    if final_angle is None:
+        return projections.angles
+    return np.linspace(0, 1, projections.shape[0]) * final_angle
+
+def _show_geometry(geometry):
+    capabilities.require("cil_display")
+    import matplotlib.pyplot as plt
+    from cil.utilities.display import show_geometry
+
+    show_geometry(geometry)
+    plt.show()
+
+def _use_cil(projections) -> bool:
+    # CIL geometries have a full, centred panel: stores of a detector ROI go to recon_engine, which knows where the centre falls
+    has_cil = capabilities.has("cil")
+    print(f"Has CIL: {'YES' if has_cil else 'NO'}")
+    roi = (getattr(projections, "geometry", None) or {}).get("roi")
+    if has_cil and roi is not None:
+        print("Detector ROI: using recon_engine")
+    return has_cil and roi is None
+
+def _fill(acData, projections):
+    if isinstance(projections, np.ndarray):
+        acData.fill(projections.squeeze())
+    else:
+        # Copy a few projections at a time rather than loading the whole store first
+        array = acData.as_array()
+        for start, block in projections.iter_projections():
+            array[start:start + block.shape[0]] = block.reshape((block.shape[0],) + array.shape[1:])
+
+def recon_parallel(projections:np.ndarray|projection_store.ProjectionStore|str, pixel_size:Optional[float]=None, final_angle:Optional[float]=None, display:bool=False, method:str="fbp", **kwargs) -> Optional[np.ndarray]:
+    """Reconstruct a parallel CT scan using FBP, or iteratively.
+
+    Without CIL, or for a store of a detector ROI, the slab-parallel NumPy implementation of recon_engine is used.
+
+    Args:
+        projections (np.ndarray|ProjectionStore|str): A set of projections. First axis is angle.
+            Can be a projection store (or its file name), whose geometry and angles are used by default.
+        pixel_size (float, optional): Pixel size of the detector. Required for arrays.
+        final_angle (float, optional): Angle of the last projection. Required for arrays.
+        display (bool): Show the acquisition geometry (CIL only).
+        method (str): "fbp", or one of recon_iterative.METHODS for few-angle or low-dose scans, e.g. "os-sart".
+        kwargs: Passed to recon_iterative.iterative_parallel, e.g. iterations, subsets, x0="fbp" or tolerance.
+
+    Returns:
+        np.ndarray: Reconstructed slices.
+    """
+
+    result = None
+    projections = projection_store.as_stack(projections)
+    if pixel_size is None:
+        pixel_size = projections.geometry["pixel_size"]
+
+    if method != "fbp":
+        print(f"Running {method.upper()} Reconstruction")
+        return recon_iterative.iterative_parallel(projections, np.ravel(pixel_size)[0], _scan_angles(projections, final_angle), method, **kwargs)
+
+    if _use_cil(projections):
+        from cil.framework import AcquisitionData, AcquisitionGeometry, ImageData
+        from cil.processors import TransmissionAbsorptionConverter
+        from cil.recon import FBP
+
+        geo:AcquisitionGeometry = AcquisitionGeometry.create_Parallel3D()
+
+        geo.set_panel(projections.shape[1:][::-1], pixel_size)
+        angles = _scan_angles(projections, final_angle)
+        geo.set_angles(angles)
+        geo.set_labels(["angle", "vertical", "horizontal"])
+
+        acData:AcquisitionData = geo.allocate()
+
+        with tracing.span("recon.read", bytes=acData.as_array().nbytes):
+            _fill(acData, projections)
+        with tracing.span("recon.convert", bytes=acData.as_array().nbytes):
+            acData = TransmissionAbsorptionConverter(min_intensity=0.0001)(acData)
+
+        print("Running FBP Reconstruction")
+        with tracing.span("recon.fbp", bytes=acData.as_array().nbytes):
+            result:ImageData|None = FBP(acData, geo.get_ImageGeometry()).run()
+
+        if display:
+            _show_geometry(acData.geometry)
+
+        assert result is not None
+        return result.as_array()
+
+    print("Running FBP Reconstruction")
+    return recon_engine.fbp_parallel(projections, np.ravel(pixel_size)[0], _scan_angles(projections, final_angle))
+
+def recon_cone(projections:np.ndarray|projection_store.ProjectionStore|str, pixel_size:Optional[float]=None, final_angle:Optional[float]=None, detector_pos:Optional[np.ndarray|list|tuple]=None, source_pos:Optional[np.ndarray|list|tuple]=None, display:bool=False, method:str="fdk", **kwargs) -> Optional[np.ndarray]:
+    """Reconstruct a cone-beam CT scan using FDK, or iteratively.
+
+    Without CIL, or for a store of a detector ROI, the slab-parallel NumPy implementation of recon_engine is used.
+
+    Args:
+        projections (np.ndarray|ProjectionStore|str): A set of projections. First axis is angle.
+            Can be a projection store (or its file name), whose geometry and angles are used by default.
+        display (bool): Show the acquisition geometry (CIL only).
+        method (str): "fdk", or one of recon_iterative.METHODS.
+        kwargs: Passed to recon_iterative.iterative_cone.
+
+    Returns:
+        np.ndarray: Reconstructed slices.
+    """
+
+    result = None
+    projections = projection_store.as_stack(projections)
+    if pixel_size is None:
+        pixel_size = projections.geometry["pixel_size"]
+    if detector_pos is None:
+        detector_pos = projections.geometry["detector_position"]
+    if source_pos is None:
+        source_pos = projections.geometry["source_position"]
+
+    if method != "fdk":
+        print(f"Running {method.upper()} Reconstruction")
+        return recon_iterative.iterative_cone(projections, np.ravel(pixel_size)[0], _scan_angles(projections, final_angle), source_pos, detector_pos, method, **kwargs)
+
+    if _use_cil(projections):
+        from cil.framework import AcquisitionData, AcquisitionGeometry, ImageData
+        from cil.processors import TransmissionAbsorptionConverter
+        from cil.recon import FDK
+
+        geo:AcquisitionGeometry = AcquisitionGeometry.create_Cone3D(source_pos, detector_pos)
+
+        geo.set_panel(projections.shape[1:][::-1], pixel_size)
+        angles = _scan_angles(projections, final_angle)
+        geo.set_angles(angles)
+        geo.set_labels(["angle", "vertical", "horizontal"])
+
+        acData:AcquisitionData = geo.allocate()
+        with tracing.span("recon.read", bytes=acData.as_array().nbytes):
+            _fill(acData, projections)
+        with tracing.span("recon.convert", bytes=acData.as_array().nbytes):
+            acData = TransmissionAbsorptionConverter(min_intensity=0.0001)(acData)
+
+        print("Running FDK Reconstruction")
+        with tracing.span("recon.fdk", bytes=acData.as_array().nbytes):
+            result:ImageData|None = FDK(acData, geo.get_ImageGeometry()).run()
+
+        if display:
+            _show_geometry(acData.geometry)
+
+        assert result is not None
+        return result.as_array()
+
+    print("Running FDK Reconstruction")
+    return recon_engine.fdk_cone(projections, np.ravel(pixel_size)[0], _scan_angles(projections, final_angle), source_pos, detector_pos)
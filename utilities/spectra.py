@@ -0,0 +1,38 @@
+"""X-ray tube spectra of the notebooks, computed with xpecgen and plotted with matplotlib (both imported on first use)."""
+
+
+def spectrum(E0,Mat_Z,Mat_X):
+    # xpecgen brings matplotlib and most of SciPy, only import them when a spectrum is asked for
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    import spectrum_engine
+
+    old_font_size  = mpl.rcParams['font.size']
+    # The tube spectrum and its inherent filtration (1.2mm Al + 100cm Air) are cached,
+    # only the filter is applied here
+    result = spectrum_engine.compute(E0,Mat_Z,Mat_X)
+    a = result.as_table()
+    #print(to_text(a))
+    (x2,y2) = result.spectrum.points()
+
+    plt.close(2)
+    plt.figure(num=2,dpi=150,clear=True)
+    mpl.rcParams.update({'font.size': 6})
+    axMW = plt.subplot(111)
+    axMW.plot(x2,y2)
+    axMW.set_xlim(3,E0)
+    axMW.set_ylim(0,)
+    plt.xlabel("Energy [keV]")
+    plt.ylabel("Nr of photons per [keV·cm²·mGy] @ 1m")
+    axMW.grid(which='major', axis='x', linewidth=0.5, linestyle='-', color='0.75')
+    axMW.grid(which='minor', axis='x', linewidth=0.2, linestyle='-', color='0.85')
+    axMW.grid(which='major', axis='y', linewidth=0.5, linestyle='-', color='0.75')
+    axMW.grid(which='minor', axis='y', linewidth=0.2, linestyle='-', color='0.85')
+    axMW.xaxis.set_major_formatter(mpl.ticker.FormatStrFormatter("%d"))
+    axMW.yaxis.set_major_formatter(mpl.ticker.FormatStrFormatter("%.2g"))
+    axMW.xaxis.set_minor_locator(mpl.ticker.AutoMinorLocator())
+    axMW.yaxis.set_minor_locator(mpl.ticker.AutoMinorLocator())
+    axMW.grid(True)
+    plt.show()
+
+    mpl.rcParams['font.size'] = old_font_size
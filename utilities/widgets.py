@@ -0,0 +1,15 @@
+"""Interactive viewers of the notebooks, built with ipywidgets (imported on first use)."""
+
+import slice_viewer
+
+
+def recon_widget(projections, recon):
+    import ipywidgets as widgets
+
+    # Quick Interactive projection and reconstruction viewer
+    # Both stacks can be arrays, memory maps or projection stores: slices are read lazily,
+    # the colour ranges are estimated from a sample and the figures are updated in place
+    viewerProj = slice_viewer.SliceViewer(projections, title="Virtual Scan Radiographs (Raw)", index=0, description="Projection")
+    viewerRecon = slice_viewer.SliceViewer(recon, title="Reconstruction", cmap="viridis", description="Reconstruction")
+
+    return widgets.HBox((viewerProj.widget(height='200px'), viewerRecon.widget(height='500px')))